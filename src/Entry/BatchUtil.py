@@ -1,12 +1,13 @@
-import multiprocessing.pool, time, os, shutil
-from typing import List
+import concurrent.futures, functools, time, os, sys
+from typing import List, Tuple
 from collections import namedtuple
-from multiprocessing import Pool
 
-from src.Entry.FileBackedQueue import FileBackedQueue
-from src.GenomicUtils.LocusFile import LociManager
+from src.GenomicUtils.LocusFile import LociManager, LociSlice, read_loci
 
 Chunk = namedtuple("Chunk", ["start", "end"])
+PREFETCHED_CHUNKS = 2  # chunks of loci queued per core, besides the ones running
+BACKLOGGED_CHUNKS = 4  # chunks per core that may be done and waiting for an earlier chunk to be written, before no more are queued
+LOCUS_BLOCK_SIZE = 1_000  # number of loci whose histograms (add_reads_batch) and alleles (calculate_alleles_batch) are built together
 
 
 def get_noise_table_path() -> str:
@@ -23,67 +24,108 @@ def get_batch_sizes(total_batch_size: int, regular_size: int) -> List[int]:
     return batch_sizes
 
 
-def extract_results(results: List[multiprocessing.pool.ApplyResult]) -> List[FileBackedQueue]:
-    # extracts results from multiproccessing
-    combined = [result.get() for result in results]
+def balance_cores(cores: int, num_chunks: int, decompression_threads: int = 0, processes: int = 1, BAMs: int = 1) -> Tuple[int, int]:
+    """
+    Splits the cores of a run between worker processes and the htslib threads that decompress the BAMs each worker opens
+    (see SingleFileBatches.HistogramSource). Each worker keeps processes processes busy (pair workers read their BAMs in a
+    reader process, see PairFileBatches.PairHistograms) and opens BAMs BAMs, and a BAM decompressed by threads threads
+    uses that many cores, rather than a share of its process's
+    By default (decompression_threads 0), a run has a worker per processes cores, unless it has fewer chunks left than that
+    (ex. targeted panels), and then the cores no worker would use decompress for the workers
+    Given decompression threads, a run has as many workers as its cores fit (at least one)
+    :return: number of worker processes, decompression threads of each BAM a worker opens (1: no thread pool)
+    """
+    num_chunks = max(num_chunks, 1)
+    if decompression_threads == 0:
+        workers = max(min(cores // processes, num_chunks), 1)
+        spare_cores = cores // workers - processes  # of each worker
+        return workers, max(1 + spare_cores // BAMs, 1) if BAMs != 0 else 1
+    worker_cores = processes + BAMs * (decompression_threads - 1)
+    return max(min(cores // worker_cores, num_chunks), 1), decompression_threads
+
+
+def extract_results(results: List[concurrent.futures.Future]) -> list:
+    # extracts results from multiproccessing (see timed_batch)
+    combined = [result.result()[0] for result in results]
     return combined
 
 
-def write_results(output_prefix: str, results: List[str], header):
-    with open(f"{output_prefix}.tsv", 'w+') as output_file:
-        output_file.write(header)
-        output_file.write("\n")
-        output_file.write("\n".join(results))
+def timed_batch(batch_function, loci_slice: LociSlice, args: list, result_dir: str):
+    # parses loci of slice and runs batch function on them. Returns its result and how long both took
+    start = time.perf_counter()
+    result = batch_function(*([read_loci(loci_slice)] + args + [result_dir]))
+    return result, time.perf_counter() - start
+
 
+def report_chunk_time(chunk_number: int, num_chunks: int, num_loci: int, seconds: float):
+    print(f"chunk {chunk_number + 1}/{num_chunks}: {num_loci} loci in {seconds:.2f}s", file=sys.stderr)
 
-def write_queues_results(output_prefix: str, results: List[FileBackedQueue], header: str):
-    with open(f"{output_prefix}.tsv", 'w+') as output_file:
-        output_file.write(header)
-        output_file.write("\n")
-        for r in results:
-            shutil.copyfileobj(open(r.out_file_path, 'r'), output_file)
-            # output_file.write("\n")
-            r.delete_backing_file()
 
+def report_finished_chunk(chunk_number: int, num_chunks: int, num_loci: int, future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is None:
+        report_chunk_time(chunk_number, num_chunks, num_loci, future.result()[1])
 
-def run_single_threaded(batch_function, args: list, loci_iterator: LociManager, total_batch_size: int, result_dir: str) -> list:
+
+def run_single_threaded(batch_function, args: list, loci_iterator: LociManager, batch_sizes: List[int], result_dir: str, writer=None,
+                        first_chunk: int = 0) -> list:
     """
     runs batch fuction without invoking pool to save performance (serialization, etc.)
     """
     results = []
-    batch_sizes = get_batch_sizes(total_batch_size, 100_000)
-    for batch in batch_sizes:
-        current_loci = loci_iterator.get_batch(batch)
-        results.append(batch_function(*([current_loci] + args + [result_dir])))
+    for chunk_number, batch in enumerate(batch_sizes[first_chunk:], first_chunk):
+        result, seconds = timed_batch(batch_function, loci_iterator.get_slice(batch), args, result_dir)
+        report_chunk_time(chunk_number, len(batch_sizes), batch, seconds)
+        if writer is not None:
+            writer.add(chunk_number, result)
+        else:
+            results.append(result)
     return results
 
 
-def run_batch(batch_function, args: list, loci_iterator: LociManager, total_batch_size: int, cores: int, result_dir: str) -> List[FileBackedQueue]:
+def write_done_chunks(writer, chunk_numbers: dict, done: set):
+    # hands the results of done chunks to writer, and forgets them
+    for future in done:
+        writer.add(chunk_numbers.pop(future), future.result()[0])
+
+
+def run_batch(batch_function, args: list, loci_iterator: LociManager, total_batch_size: int, cores: int, result_dir: str,
+              batch_sizes: List[int] = None, writer=None) -> list:
     """
+    Chunks of loci are queued up to PREFETCHED_CHUNKS per core ahead of the workers, so a worker starts its next chunk as soon
+    as it is done with one. Workers are sent the byte range of their chunk in the loci file, and parse it themselves.
+    The time each chunk took is reported to stderr as it finishes
     :param batch_function: function to run on given loci. First argument must be list of loci
     :param args: other args to feed function
-    :return: results from given function
+    :param batch_sizes: number of loci in each batch (see RegionPartitioner.get_chunk_sizes). Default: batches of 100,000 loci
+    :param writer: if given, results are handed to writer.add(chunk number, result) as each chunk is done, rather than returned.
+    Writers keep results that are done before earlier chunks (see OutputWriter.OrderedWriter); while BACKLOGGED_CHUNKS per core
+    are kept, no more chunks are queued. Chunks before writer.next_chunk, which a resumed run has written, are skipped
+    :return: results from given function, in order of batches (nothing, if there is a writer)
     """
-    results = []
-    if cores == 1:
-        return run_single_threaded(batch_function, args, loci_iterator, total_batch_size, result_dir)
-    with Pool(processes=cores) as threads:
+    if batch_sizes is None:
         batch_sizes = get_batch_sizes(total_batch_size, 100_000)
-
-        for batch in batch_sizes:
-            num_active_processes = sum([1 for p in results if not p.ready()]) # how many processes are actually running
-            while num_active_processes == cores:
-                time.sleep(1)  # long wait time to avoid wasting processing power
-                num_active_processes = sum([1 for p in results if not p.ready()])
-            current_loci = loci_iterator.get_batch(batch)
-            results.append(threads.apply_async(batch_function,
-                                           args=([current_loci] + args + [result_dir])))
-
-
-        # for i, batch in enumerate(batch_sizes):
-        #     current_loci = loci_iterator.get_batch(batch)
-        #     results.append(threads.apply_async(batch_function,
-        #                                        args=([current_loci] + args + [result_dir])))
-        threads.close()
-        threads.join()
+    first_chunk = writer.next_chunk if writer is not None else 0
+    loci_iterator.get_slice(sum(batch_sizes[:first_chunk]))  # loci of skipped chunks
+    if cores == 1:
+        return run_single_threaded(batch_function, args, loci_iterator, batch_sizes, result_dir, writer, first_chunk)
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cores) as executor:
+        queued = set()  # submitted, and either running or waiting for a worker
+        chunk_numbers = {}  # future -> chunk number, of chunks not yet handed to writer
+        for chunk_number, batch in enumerate(batch_sizes[first_chunk:], first_chunk):
+            while len(queued) == cores * (1 + PREFETCHED_CHUNKS) or \
+                    (writer is not None and len(queued) != 0 and writer.backlog >= cores * BACKLOGGED_CHUNKS):
+                done, queued = concurrent.futures.wait(queued, return_when=concurrent.futures.FIRST_COMPLETED)
+                if writer is not None:
+                    write_done_chunks(writer, chunk_numbers, done)
+            result = executor.submit(timed_batch, batch_function, loci_iterator.get_slice(batch), args, result_dir)
+            result.add_done_callback(functools.partial(report_finished_chunk, chunk_number, len(batch_sizes), batch))
+            queued.add(result)
+            if writer is not None:
+                chunk_numbers[result] = chunk_number
+            else:
+                results.append(result)
+        while writer is not None and len(queued) != 0:
+            done, queued = concurrent.futures.wait(queued, return_when=concurrent.futures.FIRST_COMPLETED)
+            write_done_chunks(writer, chunk_numbers, done)
     return extract_results(results)
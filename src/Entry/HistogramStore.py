@@ -0,0 +1,193 @@
+# cython: language_level=3
+import os, shutil
+from typing import List
+import numpy as np
+
+from src.IndelCalling.Histogram import Histogram
+from src.IndelCalling.Locus import Locus
+from src.Entry.RunManifest import RunManifest
+
+
+class HistogramShard:
+    """
+    Histograms of one chunk of loci, built by its worker in the sparse format of a HistogramCatalog, and sent back to the
+    parent (see HistogramCatalogWriter). Loci are numbered from the first locus of the chunk; loci without reads are not stored
+    """
+    def __init__(self):
+        self.num_loci = 0
+        self.loci = []
+        self.lengths = []
+        self.counts = []
+        self.num_lengths = []
+
+    def append(self, histogram: Histogram):
+        histogram.prune_keys()
+        if len(histogram.repeat_lengths) != 0:
+            self.loci.append(self.num_loci)
+            # in the order they were first seen, which breaks ties in Histogram.__str__. The int 0 of lengths that were negative
+            # (see Histogram.add_repeat_lengths) is stored as -0.0, so it prints as it does in a tsv histogram
+            self.lengths.extend(-0.0 if length == 0 and isinstance(length, int) else length for length in histogram.repeat_lengths.keys())
+            self.counts.extend(histogram.repeat_lengths.values())
+            self.num_lengths.append(len(histogram.repeat_lengths))
+        self.num_loci += 1
+
+    def close(self):
+        # should be called when all histograms have been appended. Lists become arrays, which are sent back compactly
+        self.loci = np.array(self.loci, dtype=np.int64)
+        self.lengths = np.array(self.lengths, dtype=np.float64)
+        self.counts = np.array(self.counts, dtype=np.int32)
+        self.num_lengths = np.array(self.num_lengths, dtype=np.int64)
+
+
+class HistogramCatalogWriter:
+    """
+    Appends the HistogramShards of the chunks of a run to a HistogramCatalog in order, as they are done (an
+    OutputWriter.OrderedWriter for catalogs, which records the chunks it writes in a RunManifest, if given one, the same
+    way). The first locus of the first shard is line first_locus (0-indexed) of the loci file. The catalog is written to
+    [catalog_path].partial and moved to catalog_path when it is complete, as in IndexLoci.write_loci_catalog
+    """
+    def __init__(self, catalog_path: str, first_locus: int, manifest: RunManifest = None):
+        self.catalog_path = catalog_path
+        self.first_locus = first_locus
+        self.manifest = manifest
+        self.temporary_path = catalog_path + ".partial"
+        self.names = {column: os.path.join(os.path.basename(self.temporary_path), column + ".bin") for column in HistogramCatalog.BINARY_COLUMNS}
+        self.next_locus = first_locus
+        self.num_lengths = 0
+        self.next_chunk = 0
+        self.waiting = {}  # chunk number -> shard, of shards done before the next chunk to write
+        if manifest is not None and len(manifest.file_sizes) != 0:  # resumed
+            column_paths = {column: os.path.join(self.temporary_path, column + ".bin") for column in HistogramCatalog.BINARY_COLUMNS}
+            if any(not os.path.isfile(column_paths[column]) or os.path.getsize(column_paths[column]) < manifest.file_sizes[self.names[column]]
+                   for column in column_paths):
+                raise ValueError(f"{self.temporary_path} is shorter than its manifest records, and can't be resumed")
+            self.columns = {column: open(column_paths[column], 'r+b', buffering=2**20) for column in column_paths}
+            for column, column_file in self.columns.items():
+                column_file.truncate(manifest.file_sizes[self.names[column]])  # chunks written after the manifest was
+                column_file.seek(0, os.SEEK_END)
+            self.next_chunk = manifest.chunks_done
+            self.next_locus += sum(manifest.chunk_sizes[:manifest.chunks_done])
+            self.num_lengths = manifest.file_sizes[self.names["counts"]] // np.dtype(HistogramCatalog.BINARY_COLUMNS["counts"]).itemsize
+        else:
+            if os.path.exists(self.temporary_path):  # of a run that failed
+                shutil.rmtree(self.temporary_path)
+            os.makedirs(self.temporary_path)
+            self.columns = {column: open(os.path.join(self.temporary_path, column + ".bin"), 'wb', buffering=2**20)
+                            for column in HistogramCatalog.BINARY_COLUMNS}
+            self.record()
+
+    @property
+    def backlog(self) -> int:
+        return len(self.waiting)
+
+    def add(self, chunk_number: int, shard: HistogramShard):
+        self.waiting[chunk_number] = shard
+        if self.next_chunk in self.waiting:
+            while self.next_chunk in self.waiting:
+                self.write(self.waiting.pop(self.next_chunk))
+                self.next_chunk += 1
+            self.record()
+
+    def write(self, shard: HistogramShard):
+        self.columns["loci"].write((shard.loci + self.next_locus).tobytes())
+        self.columns["ends"].write((np.cumsum(shard.num_lengths) + self.num_lengths).tobytes())
+        self.columns["lengths"].write(shard.lengths.tobytes())
+        self.columns["counts"].write(shard.counts.tobytes())
+        self.next_locus += shard.num_loci
+        self.num_lengths += int(shard.num_lengths.sum())
+
+    def record(self, complete: bool = False):
+        # records the chunks written in the manifest, once they are on disk
+        if self.manifest is not None:
+            for column_file in self.columns.values():
+                column_file.flush()
+                os.fsync(column_file.fileno())
+            self.manifest.record(self.next_chunk, {self.names[column]: column_file.tell() for column, column_file in self.columns.items()}, complete)
+
+    def close(self):
+        if len(self.waiting) != 0:
+            self.discard()
+            raise RuntimeError(f"Chunks {sorted(self.waiting)} of {self.catalog_path} were done, but not all chunks before them were")
+        for column in self.columns.values():
+            column.close()
+        np.save(os.path.join(self.temporary_path, HistogramCatalog.MARKER), np.array([self.first_locus, self.next_locus], dtype=np.int64))
+        if os.path.exists(self.catalog_path):
+            shutil.rmtree(self.catalog_path)
+        os.replace(self.temporary_path, self.catalog_path)
+        if self.manifest is not None:
+            self.manifest.record(self.next_chunk, {}, complete=True)
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        for column in self.columns.values():
+            column.close()
+        if self.manifest is None:
+            shutil.rmtree(self.temporary_path)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class HistogramCatalog:
+    """
+    Histograms of a run (see --histogram_format), so alleles and mutations can be called from them again without the BAMs
+    A directory of range.npy, the [first, last) lines (0-indexed) of the loci file the run processed, and raw columns of
+    the loci with reads among them: loci (int64 line numbers, ascending), and the repeat lengths (float64) and supporting
+    reads (int32) of each locus, lengths and counts[ends[i-1]:ends[i]] (ends are int64). Loci in range that are not stored had no reads
+    """
+    BINARY_COLUMNS = {"loci": np.int64, "ends": np.int64, "lengths": np.float64, "counts": np.int32}
+    MARKER = "range.npy"
+
+    def __init__(self, catalog_path: str):
+        self.catalog_path = catalog_path
+        for column, dtype in self.BINARY_COLUMNS.items():
+            column_path = os.path.join(catalog_path, column + ".bin")
+            setattr(self, column, np.memmap(column_path, dtype=dtype, mode='r') if os.path.getsize(column_path) != 0
+                    else np.zeros(0, dtype=dtype))  # numpy can't map empty files
+        self.first_locus, self.end_locus = (int(line) for line in np.load(os.path.join(catalog_path, self.MARKER)))
+
+    def get_histograms(self, loci: List[Locus], lines: np.array, integer_indels_only: bool) -> List[Histogram]:
+        # histograms of loci, which are the given (ascending) lines of the loci file
+        lines = np.asarray(lines, dtype=np.int64)
+        histograms = [Histogram(locus, integer_indels_only) for locus in loci]
+        if len(lines) == 0:
+            return histograms
+        if lines[0] < self.first_locus or lines[-1] >= self.end_locus:
+            raise ValueError(f"Loci {lines[0] + 1}-{lines[-1] + 1} are not all in histogram catalog {self.catalog_path}, "
+                             f"which has loci {self.first_locus + 1}-{self.end_locus}. Was it made from another loci file, or batch?")
+        first, last = (int(position) for position in np.searchsorted(self.loci, [lines[0], lines[-1] + 1]))
+        # loci stored between the first and last line, and their repeat lengths
+        stored_loci = np.array(self.loci[first:last])
+        first_length = int(self.ends[first - 1]) if first != 0 else 0
+        offsets = [0] + (np.array(self.ends[first:last]) - first_length).tolist()
+        last_length = first_length + offsets[-1]
+        stored_lengths = self.lengths[first_length:last_length]
+        lengths = stored_lengths.tolist()
+        for i in np.flatnonzero((stored_lengths == 0) & np.signbit(stored_lengths)).tolist():
+            lengths[i] = 0
+        counts = self.counts[first_length:last_length].tolist()
+        positions = np.minimum(np.searchsorted(stored_loci, lines), max(len(stored_loci) - 1, 0))
+        for i in np.flatnonzero(stored_loci[positions] == lines if len(stored_loci) != 0 else []).tolist():
+            stored = int(positions[i])
+            histograms[i].repeat_lengths.update(zip(lengths[offsets[stored]:offsets[stored + 1]], counts[offsets[stored]:offsets[stored + 1]]))
+        return histograms
+
+
+def is_histogram_catalog(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, HistogramCatalog.MARKER))
+
+
+_histogram_catalogs = {}
+
+
+def open_histogram_catalog(catalog_path: str) -> HistogramCatalog:
+    # one mapping of each catalog per process, as LocusFile.open_loci_catalog
+    key = (catalog_path, os.stat(os.path.join(catalog_path, HistogramCatalog.MARKER)).st_ino)
+    if key not in _histogram_catalogs:
+        _histogram_catalogs[key] = HistogramCatalog(catalog_path)
+    return _histogram_catalogs[key]
@@ -0,0 +1,64 @@
+# cython: language_level=3
+import os, shutil
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from src.GenomicUtils.LocusFile import LociManager, read_slice_fields
+
+BLOCK_SIZE = 1_000_000  # loci converted at a time
+
+
+def write_columns(catalog_path: str, num_loci: int) -> dict:
+    # column name -> memory mapped .npy file of column
+    dtypes = {"chromosome": np.uint16, "start": np.int32, "end": np.int32, "repeats": np.float64, "pattern": np.int32}
+    columns = {column: open_memmap(os.path.join(catalog_path, column + ".npy"), mode='w+', dtype=dtype, shape=(num_loci,))
+               for column, dtype in dtypes.items()}
+    columns["sequence_offsets"] = open_memmap(os.path.join(catalog_path, "sequence_offsets.npy"), mode='w+', dtype=np.int64, shape=(num_loci + 1,))
+    return columns
+
+
+def code(values: dict, value: str, max_code: int) -> int:
+    # code of value, adding it to values if it is new
+    if value not in values:
+        if len(values) > max_code:
+            raise ValueError(f"More than {max_code + 1} distinct values in loci file column, which a loci catalog can't encode")
+        values[value] = len(values)
+    return values[value]
+
+
+def write_loci_catalog(loci_path: str, catalog_path: str):
+    """
+    Converts a tsv loci file into a LociCatalog. The catalog is written next to catalog_path and moved there when it is
+    complete, so an interrupted conversion never leaves behind something that looks like a catalog
+    """
+    manager = LociManager(loci_path)
+    num_loci = manager.index.num_lines
+    temporary_path = f"{catalog_path}.{os.getpid()}.tmp"
+    os.makedirs(temporary_path)
+    columns = write_columns(temporary_path, num_loci)
+    chromosome_codes, pattern_codes = {}, {}
+    max_chromosome_code, max_position = np.iinfo(np.uint16).max, np.iinfo(np.int32).max
+    with open(os.path.join(temporary_path, "sequences.bin"), 'wb') as sequences_file:
+        for block_start in range(0, num_loci, BLOCK_SIZE):
+            loci = read_slice_fields(manager.get_slice(BLOCK_SIZE))
+            block = slice(block_start, block_start + len(loci))
+            columns["chromosome"][block] = [code(chromosome_codes, locus[0], max_chromosome_code) for locus in loci]
+            for column, field in [("start", 3), ("end", 4)]:
+                positions = np.array([int(locus[field]) for locus in loci], dtype=np.int64)
+                if len(positions) != 0 and (positions.min() < 0 or positions.max() > max_position):
+                    raise ValueError(f"Locus {column} out of range of a loci catalog, around locus {block_start + 1}")
+                columns[column][block] = positions
+            columns["repeats"][block] = [float(locus[6]) for locus in loci]
+            columns["pattern"][block] = [code(pattern_codes, locus[12], max_position) for locus in loci]
+            sequences = [locus[13].encode('ascii') for locus in loci]
+            columns["sequence_offsets"][block_start + 1:block.stop + 1] = columns["sequence_offsets"][block_start] + \
+                np.cumsum([len(sequence) for sequence in sequences], dtype=np.int64)
+            sequences_file.write(b"".join(sequences))
+    for column in columns.values():
+        column.flush()
+    np.save(os.path.join(temporary_path, "chromosome_names.npy"), np.array(list(chromosome_codes), dtype=str))
+    np.save(os.path.join(temporary_path, "patterns.npy"), np.array(list(pattern_codes), dtype=str))
+    if os.path.exists(catalog_path):
+        shutil.rmtree(catalog_path)
+    os.replace(temporary_path, catalog_path)
+
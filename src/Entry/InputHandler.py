@@ -1,17 +1,31 @@
-import argparse, sys, os, pysam
-from typing import List
+import argparse, sys, os, re
+from typing import List, Tuple
+
+from src.Entry.HistogramStore import HistogramCatalog, is_histogram_catalog
+from src.Entry.OutputWriter import OUTPUT_COMPRESSIONS, output_path
+from src.Entry.RunManifest import manifest_path
+from src.Entry.ScatterGather import shard_prefix
+from src.GenomicUtils.AlignmentFiles import index_paths, open_alignment_file
 
 
 def create_parser() -> argparse.ArgumentParser:
     # :return: creates parser with all command line arguments arguments
     MSMuTect_intro = "MSMuTect\n Version 4.0\n Authors: Yossi Maruvka, Avraham Kahan, and the Maruvka Lab at Technion"
-    parser = argparse.ArgumentParser(description=MSMuTect_intro)
-    parser.add_argument("-T", "--tumor_file", help="Tumor BAM file")
-    parser.add_argument("-N", "--normal_file", help="Non-tumor BAM file")
-    parser.add_argument("-S", "--single_file", help="Analyze a single file for histogram and/or alleles")
-    parser.add_argument("-l", "--loci_file", help="File of loci to be processed and included in the output", required=True)
+    parser = argparse.ArgumentParser(description=MSMuTect_intro, epilog="To convert a loci file into a loci catalog, which is faster to start from, run 'msmutect index-loci --help'. "
+                                     "To split a run into shards that run independently (ex. on a cluster), see 'msmutect scatter --help' and 'msmutect gather --help'")
+    parser.add_argument("-T", "--tumor_file", help="Tumor BAM (or CRAM) file, or histogram catalog of it (see --histogram_format)")
+    parser.add_argument("-N", "--normal_file", help="Non-tumor BAM (or CRAM) file, or histogram catalog of it (see --histogram_format)")
+    parser.add_argument("-S", "--single_file", help="Analyze a single file (BAM, CRAM, or histogram catalog) for histogram and/or alleles")
+    parser.add_argument("--reference", help="Reference FASTA of CRAM files. Only the positions, flags and cigars of reads are decoded from CRAMs, "
+                        "which do not need the reference, so it is only loaded if a CRAM needs it to decode them")
+    parser.add_argument("-l", "--loci_file", help="File (or catalog, see index-loci) of loci to be processed and included in the output", required=True)
     parser.add_argument("-O", "--output_prefix", help="prefix for all output files", required=True)
-    parser.add_argument("-c", "--cores", help="Number of cores to run MSMuTect on", type=int, default=1)
+    parser.add_argument("-c", "--cores", help="Number of cores to run MSMuTect on. A pair run (-N, -T) has a worker per 2 cores: "
+                        "each reads its BAMs in a second process while it calls mutations, so a run uses as many processes as it has cores", type=int, default=1)
+    parser.add_argument("--decompression_threads", help="Threads decompressing each BAM a core reads. By default, a run with fewer chunks of loci than cores "
+                        "(ex. a targeted panel) gives the cores it has no chunks for to decompressing the BAMs of the others. "
+                        "Given threads, a run has cores / threads processes, each with that many threads for its BAM; "
+                        "pair runs have cores / (2 x threads) workers, each reading its 2 BAMs with that many threads each (default: 0, automatic)", type=int, default=0)
     parser.add_argument("-b", "--batch_start", help="1-indexed number locus to begin analyzing at (Inclusive)", default=1, type=int)
     parser.add_argument("-e", "--batch_end", help="1-indexed number locus to stop analyzing at (Inclusive)", type=int)
     parser.add_argument("-H", "--histogram", help="Output a Histogram File", action='store_true')
@@ -19,12 +33,85 @@ def create_parser() -> argparse.ArgumentParser:
     parser.add_argument("-m", "--mutation", help="Output mutation file", action='store_true')
     parser.add_argument("-F", "--flanking", help="Length of flanking on both sides of an accepted read", type=int, default=10)
     parser.add_argument("-r", "--read_level", help="Minimum number of reads to call allele", type=int, default=5)
+    parser.add_argument("--min_coverage", help="Loci with fewer reads than this in a sample are not called in it: they get no alleles "
+                        "(AN in pair runs) without being looked at, and pair runs do not read the tumor for loci with fewer in the normal. "
+                        "Loci with fewer reads than -r have no alleles anyway (default: 0)", type=int, default=0)
+    parser.add_argument("--skip_low_coverage", help="Leave loci with fewer than --min_coverage reads in any sample out of outputs", action='store_true')
     parser.add_argument("-f", "--force", help="Overwrite pre-existing files", action='store_true')
     parser.add_argument("--integer", help="Only use indels of integer deletions/insertions of the repeat unit when calling alleles", action='store_true')
+    parser.add_argument("--allele_cache", help="Maximum number of called allele sets each process caches for reuse at loci with identical histograms (0 disables the cache)", type=int, default=100_000)
+    parser.add_argument("--allele_cache_memory", help="Maximum memory, in MB, of each process's allele cache", type=int, default=200)
+    parser.add_argument("--deterministic", help="Seed the allele calling of each locus from its histogram, so results do not depend on caching or on the order loci are processed in", action='store_true')
+    parser.add_argument("--ks_calls", help="Only run the KS test for mutation calls of these types; the KS columns of other calls are NA. (default: all calls)",
+                        nargs='+', choices=["M", "NM", "FFT", "RR", "TMA", "INS", "AN"])
+    parser.add_argument("--LOR_ratio", help="How much lower the AIC of each sample's histogram must be with the other sample's alleles than with its own, to call a mutation (default: 8.0)",
+                        type=float, nargs='+', default=[8.0])
+    parser.add_argument("--fisher_threshold", help="P-value of Fisher's exact test of tumor and normal histograms below which a mutation is called (default: 0.031)",
+                        type=float, nargs='+', default=[0.031])
+    parser.add_argument("--p_equal", help="Binomial p-value below which the support of two normal alleles is too unequal to call a mutation, INS (default: 0.3)",
+                        type=float, nargs='+', default=[0.3])
+    parser.add_argument("--partition", help="How loci are split between cores: 'regions' balances chunks of each chromosome by the reads the BAM index estimates are in them, 'lines' uses chunks of 100,000 loci (default: regions)",
+                        choices=["regions", "lines"], default="regions")
+    parser.add_argument("--contig_aliases", help="Tab separated file of contigs named differently in the loci file and the BAM files: "
+                        "each line is the name of a contig in the loci file, and its name in the BAMs. Needed only for names that differ by more than a chr prefix, or chrM/MT")
+    parser.add_argument("--histogram_format", help="Format of histogram files (-H): 'tsv' lists the 6 repeat lengths with the most supporting reads, "
+                        "'binary' stores every repeat length of every locus in a directory of numpy arrays, [output_prefix].hist.hcat. "
+                        "A .hist.hcat can be given instead of its BAM (-S, -N, -T), with the same loci file, to call alleles and mutations again without reading the BAM (default: tsv)",
+                        choices=["tsv", "binary"], default="tsv")
+    parser.add_argument("--compress", help="Compression of tsv output files, which are then named [output].tsv.gz: 'gzip', or 'bgzf', "
+                        "the blocked gzip of bgzip, which tabix can index (default: none)", choices=OUTPUT_COMPRESSIONS, default="none")
+    parser.add_argument("--shard", help="Run only shard k of the run split into N shards of loci balanced by their estimated reads (see 'msmutect scatter'), "
+                        "as k/N. Outputs are named [output_prefix].shard[k]of[N].*, and merged by 'msmutect gather [output_prefix]'", type=parse_shard)
+    parser.add_argument("--resume", help="Continue a run that stopped (ex. was killed) with the same flags, from the chunks of loci it had not written. "
+                        "Each output has a manifest of its run, [output].manifest.json, which records the chunks written to it", action='store_true')
     parser.add_argument("--vcf", help="Output VCF file in addition to TSV file. IMPORTANT NOTE: the location of the indel may be anywhere in the locus, but the VCF will always have it at the beginning of the locus. In addition, all loci with non-reference alleles are listed but only mutations are listed as 'PASS'", action='store_true')
     return parser
 
 
+def create_index_loci_parser() -> argparse.ArgumentParser:
+    # :return: creates parser of the index-loci subcommand (msmutect index-loci [loci_file])
+    parser = argparse.ArgumentParser(prog="msmutect index-loci", description="Convert a sorted loci file into a loci catalog: a binary, "
+                                     "memory mapped format that is faster to start from and split between cores. Give the catalog to -l instead of the loci file")
+    parser.add_argument("loci_file", help="Sorted loci file to convert")
+    parser.add_argument("-O", "--output", help="Path of catalog (a directory) to create (default: [loci_file].lcat)")
+    parser.add_argument("-f", "--force", help="Overwrite pre-existing catalog", action='store_true')
+    return parser
+
+
+def create_scatter_parser() -> argparse.ArgumentParser:
+    # :return: creates parser of the scatter subcommand (msmutect scatter -l [loci_file] -n [shards])
+    parser = argparse.ArgumentParser(prog="msmutect scatter", description="List the shards a run is split into by --shard k/N: "
+                                     "ranges of consecutive loci, balanced by the reads the BAM indexes estimate are in them. "
+                                     "Give each shard's run the same flags, and --shard k/N (or its -b and -e). Then merge their outputs with 'msmutect gather'")
+    parser.add_argument("-l", "--loci_file", help="File (or catalog) of loci of the run", required=True)
+    parser.add_argument("-n", "--shards", help="Number of shards", type=int, required=True)
+    parser.add_argument("-T", "--tumor_file", help="Tumor BAM file of the run")
+    parser.add_argument("-N", "--normal_file", help="Non-tumor BAM file of the run")
+    parser.add_argument("-S", "--single_file", help="BAM file of a single file run")
+    parser.add_argument("-b", "--batch_start", help="1-indexed number locus the run begins at (Inclusive)", default=1, type=int)
+    parser.add_argument("-e", "--batch_end", help="1-indexed number locus the run stops at (Inclusive)", type=int)
+    parser.add_argument("--contig_aliases", help="Contig aliases file of the run (see 'msmutect --help')")
+    parser.add_argument("-O", "--output", help="File to write the shards to (default: standard output)")
+    return parser
+
+
+def create_gather_parser() -> argparse.ArgumentParser:
+    # :return: creates parser of the gather subcommand (msmutect gather [output_prefix])
+    parser = argparse.ArgumentParser(prog="msmutect gather", description="Merge the tsv and vcf outputs of the shards of a run "
+                                     "(run with --shard k/N) into the outputs the run would have written without shards, sorted and with one header")
+    parser.add_argument("output_prefix", help="Output prefix (-O) the shards were run with")
+    parser.add_argument("-f", "--force", help="Overwrite pre-existing files", action='store_true')
+    return parser
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    # k/N -> (k, N)
+    match = re.fullmatch(r"(\d+)/(\d+)", shard)
+    if match is None or not 1 <= int(match[1]) <= int(match[2]):
+        raise argparse.ArgumentTypeError(f"Shard should be k/N, with 1 <= k <= N, not {shard}")
+    return int(match[1]), int(match[2])
+
+
 def exit_on(message: str, status: int = 1):
     # print message, and exit
     print("ERROR: " + message)
@@ -32,37 +119,30 @@ def exit_on(message: str, status: int = 1):
 
 
 def simple_index_check(bam: str):
-    bam_bai_path = bam + ".bai"
-    bai_path = bam[:-4] + ".bai"
-    bam_bai_file_exists = os.path.exists(bam_bai_path)
-    bai_file_exists = os.path.exists(bai_path)
+    # .bai of BAM, or .crai of CRAM, next to it
     index_file_older_than_bam_message = "Index file older than BAM file. Index file must be younger than BAM file. If you are sure the index file is correct, run 'touch [index_file]'"
-    if bam_bai_file_exists:
-        if os.path.getmtime(bam_bai_path) < os.path.getmtime(bam):
-            exit_on(index_file_older_than_bam_message)
-    elif bai_file_exists:
-        if os.path.getmtime(bai_path) < os.path.getmtime(bam):
-            exit_on(index_file_older_than_bam_message)
-    else:
-        exit_on("Given BAM file/s are not sorted and/or indexed")
+    for index_path in index_paths(bam):
+        if os.path.exists(index_path):
+            if os.path.getmtime(index_path) < os.path.getmtime(bam):
+                exit_on(index_file_older_than_bam_message)
+            return
+    exit_on(f"Given BAM file/s are not sorted and/or indexed (no {' or '.join(os.path.basename(path) for path in index_paths(bam))})")
 
 
-def validate_indexing(bam_files: List[str]) -> None:
-    """ validates that given BAM files are indexed"""
-    prefixes = ['', 'chr', 'Chr']
+def validate_indexing(bam_files: List[str], reference: str = None) -> None:
+    """ validates that given BAM (or CRAM) files are indexed, and have contigs (which loci are mapped to by ContigTable) """
     for bam in bam_files:
-        simple_index_check(bam) # simply checks for .bai file
-        validated = False
-        current_handle = pysam.AlignmentFile(open(bam, 'rb'))
-        for prefix in prefixes:
-            try:
-                _ = current_handle.fetch(f"{prefix}{1}", start=10_000, multiple_iterators=False)
-                validated = True
-                break  # verified
-            except ValueError:  # different prefix, or not indexed
-                continue
-        if not validated:
-            exit_on("Given BAM file/s are not sorted and/or indexed, or contain an unsusual prefix (not 'chr', 'Chr', or nothing")
+        if is_histogram_catalog(bam):
+            continue
+        if bam.endswith((".hist.tsv", ".hist.tsv.gz")):
+            exit_on("Histogram tsv files only list 6 repeat lengths of each locus. To call alleles and mutations from histograms, "
+                    "write them with --histogram_format binary, and give the .hist.hcat instead of the BAM")
+        simple_index_check(bam) # simply checks for .bai (or .crai) file
+        with open_alignment_file(bam, reference) as current_handle:
+            if not current_handle.has_index():
+                exit_on("Given BAM file/s are not sorted and/or indexed")
+            if current_handle.nreferences == 0:
+                exit_on("Given BAM file/s have no contigs in their header")
 
 
 def validate_bams(arguments: argparse.Namespace):
@@ -76,7 +156,18 @@ def validate_bams(arguments: argparse.Namespace):
     else:
         if not os.path.exists(arguments.tumor_file) or not os.path.exists(arguments.normal_file):
             exit_on("Provided Normal or Tumor BAM path does not exist")
-    validate_indexing([bam_file for bam_file in [arguments.tumor_file, arguments.normal_file, arguments.single_file] if bool(bam_file)])
+    if arguments.reference and not os.path.isfile(arguments.reference):
+        exit_on("Provided reference file does not exist")
+    validate_indexing([bam_file for bam_file in [arguments.tumor_file, arguments.normal_file, arguments.single_file] if bool(bam_file)], arguments.reference)
+
+
+def is_threshold_sweep(arguments: argparse.Namespace) -> bool:
+    return max(len(arguments.LOR_ratio), len(arguments.fisher_threshold), len(arguments.p_equal)) > 1
+
+
+def would_overwrite(path: str, resume: bool) -> bool:
+    # a resumed run continues the outputs its manifests record, rather than overwriting them
+    return os.path.exists(path) and not (resume and os.path.isfile(manifest_path(path)))
 
 
 def validate_output_files(arguments: argparse.Namespace):
@@ -85,27 +176,34 @@ def validate_output_files(arguments: argparse.Namespace):
         arguments.output_prefix = os.path.join(os.getcwd(), arguments.output_prefix)
     if not os.path.exists(os.path.dirname(arguments.output_prefix)):
         exit_on("Output directory does not exist")
+    if arguments.shard:
+        arguments.output_prefix = shard_prefix(arguments.output_prefix, *arguments.shard)
     if arguments.force:
         return
+    tsv = output_path("", arguments.compress)  # suffix of tsv outputs
+    histogram_suffix = ".hist.hcat" if arguments.histogram_format == "binary" else ".hist" + tsv
+    if is_threshold_sweep(arguments):
+        if os.path.exists(arguments.output_prefix + ".sweep.tsv"):
+            exit_on(overwrite_files_mssg)
     elif arguments.single_file:
         if arguments.histogram and not arguments.allele:
-            if os.path.exists(arguments.output_prefix + ".hist.tsv"):
+            if would_overwrite(arguments.output_prefix + histogram_suffix, arguments.resume):
                 exit_on(overwrite_files_mssg)
         else:
-            if os.path.exists(arguments.output_prefix + ".all.tsv"):
+            if would_overwrite(arguments.output_prefix + ".all" + tsv, arguments.resume):
                 exit_on(overwrite_files_mssg)
     else:  # pair file
-        if arguments.mutation and arguments.vcf and os.path.exists(arguments.output_prefix+".vcf"):
+        if arguments.mutation and arguments.vcf and os.path.exists(arguments.output_prefix+".vcf") and not arguments.resume:
             exit_on(overwrite_files_mssg)
-        if (arguments.histogram or arguments.allele) and arguments.mutation and os.path.exists(arguments.output_prefix + ".full.mut.tsv"):
+        if (arguments.histogram or arguments.allele) and arguments.mutation and would_overwrite(arguments.output_prefix + ".full.mut" + tsv, arguments.resume):
                     exit_on(overwrite_files_mssg)
-        elif not arguments.histogram and not arguments.allele and os.path.exists(arguments.output_prefix + ".partial.mut.tsv"):
+        elif not arguments.histogram and not arguments.allele and would_overwrite(arguments.output_prefix + ".partial.mut" + tsv, arguments.resume):
                 exit_on(overwrite_files_mssg)
-        elif arguments.allele and (os.path.exists(arguments.output_prefix + ".tumor.all.tsv") or
-        os.path.exists(arguments.output_prefix + ".normal.all.tsv")):
+        elif arguments.allele and (would_overwrite(arguments.output_prefix + ".tumor.all" + tsv, arguments.resume) or
+        would_overwrite(arguments.output_prefix + ".normal.all" + tsv, arguments.resume)):
             exit_on(overwrite_files_mssg)
-        elif arguments.histogram and (os.path.exists(arguments.output_prefix + ".tumor.hist.tsv") or
-                                      os.path.exists(arguments.output_prefix + ".normal.hist.tsv")):
+        elif arguments.histogram and (would_overwrite(arguments.output_prefix + ".tumor" + histogram_suffix, arguments.resume) or
+                                      would_overwrite(arguments.output_prefix + ".normal" + histogram_suffix, arguments.resume)):
             exit_on(overwrite_files_mssg)
 
 
@@ -120,12 +218,63 @@ def validate_input(arguments: argparse.Namespace):
         exit_on("Batch Start must be equal to or greater than 1")
     elif arguments.cores <= 0:
         exit_on("Cores must be equal to or greater than 1")
+    elif arguments.decompression_threads < 0:
+        exit_on("Decompression threads must be equal to or greater than 0")
     elif arguments.flanking < 0:
         exit_on("Flanking must be equal to or greater than 0")
     elif arguments.read_level < 1:
         exit_on("Minimum Read Level for calling alleles must be equal to or greater than 1")
+    elif arguments.min_coverage < 0:
+        exit_on("Minimum coverage must be equal to or greater than 0")
+    elif arguments.skip_low_coverage and arguments.min_coverage == 0:
+        exit_on("--skip_low_coverage skips loci with fewer reads than --min_coverage, which must be given")
+    elif (arguments.min_coverage or arguments.skip_low_coverage) and arguments.histogram and not arguments.allele and not arguments.mutation:
+        exit_on("Histogram runs (-H, without -A or -m) write the histograms of all loci. --min_coverage applies to runs that call alleles or mutations")
     elif not os.path.exists(arguments.loci_file):
         exit_on("Loci file path does not exist")
     elif arguments.vcf and not arguments.mutation:
         exit_on("VCF file can only be generated for mutation calls")
+    elif arguments.contig_aliases and not os.path.isfile(arguments.contig_aliases):
+        exit_on("Contig aliases file does not exist")
+    elif is_threshold_sweep(arguments) and (not arguments.mutation or arguments.histogram or arguments.allele or arguments.vcf):
+        exit_on("Several values of --LOR_ratio, --fisher_threshold or --p_equal sweep them, and write only how many loci got each call "
+                "under each combination of them. Sweeps call mutations (-m), without -A, -H or --vcf")
+    elif arguments.resume and is_threshold_sweep(arguments):
+        exit_on("Sweeps write their counts when they are done, and can't be resumed")
+    elif arguments.histogram_format == "binary" and (not arguments.histogram or arguments.allele or arguments.mutation):
+        exit_on("Binary histograms are only written by histogram runs (-H, without -A or -m)")
 
+
+def validate_histogram_catalogs(arguments: argparse.Namespace, batch_end: int):
+    # histogram catalogs given instead of BAMs must have histograms of all loci of the batch
+    for path in [arguments.tumor_file, arguments.normal_file, arguments.single_file]:
+        if path and is_histogram_catalog(path):
+            catalog = HistogramCatalog(path)
+            if arguments.batch_start - 1 < catalog.first_locus or batch_end > catalog.end_locus:
+                exit_on(f"Histogram catalog {path} has loci {catalog.first_locus + 1}-{catalog.end_locus}, "
+                        f"which do not include loci {arguments.batch_start}-{batch_end} of this run")
+
+
+def validate_scatter_input(arguments: argparse.Namespace):
+    if not os.path.exists(arguments.loci_file):
+        exit_on("Provided loci file does not exist")
+    if arguments.shards <= 0:
+        exit_on("Number of shards must be equal to or greater than 1")
+    if arguments.batch_start <= 0:
+        exit_on("Batch Start must be equal to or greater than 1")
+    for path in [arguments.tumor_file, arguments.normal_file, arguments.single_file, arguments.contig_aliases]:
+        if path and not os.path.exists(path):
+            exit_on(f"{path} does not exist")
+    if arguments.output and not os.path.exists(os.path.dirname(os.path.abspath(arguments.output))):
+        exit_on("Output directory does not exist")
+
+
+def validate_index_loci_input(arguments: argparse.Namespace):
+    if not os.path.isfile(arguments.loci_file):
+        exit_on("Provided loci file does not exist")
+    if not arguments.output:
+        arguments.output = arguments.loci_file + ".lcat"
+    if not os.path.exists(os.path.dirname(os.path.abspath(arguments.output))):
+        exit_on("Output directory does not exist")
+    if os.path.exists(arguments.output) and not arguments.force:
+        exit_on("Catalog would be overwritten by this run. To force overwrite, use -f flag")
@@ -0,0 +1,152 @@
+# cython: language_level=3
+import os, struct, zlib
+from typing import List
+
+from src.Entry.RunManifest import RunManifest
+
+OUTPUT_COMPRESSIONS = ["none", "gzip", "bgzf"]  # bgzf: blocked gzip, as bgzip writes, which tabix and htslib can index
+COMPRESSION_LEVEL = 6
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per bgzf block, as in htslib
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")  # empty block that ends a bgzf file
+
+
+def output_path(output_prefix: str, compression: str) -> str:
+    # path of tsv output file of prefix
+    return f"{output_prefix}.tsv" + (".gz" if compression != "none" else "")
+
+
+def bgzf_block(data: bytes) -> bytes:
+    # one bgzf block: a gzip member whose extra field (BC) holds the size of the block
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) > 0xffff - 25:  # incompressible data, which is smaller stored than deflated
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(compressed) + 25)
+    return header + compressed + struct.pack("<2I", zlib.crc32(data), len(data))
+
+
+class OutputChunk:
+    """
+    Output lines of a chunk of loci, encoded as they are written to the output file (see OUTPUT_COMPRESSIONS), so workers
+    compress their chunks in parallel, and send them back for the parent to append to the output as they are (see OrderedWriter)
+    Compressed chunks are whole gzip members (or bgzf blocks), which can be concatenated
+    """
+    MAX_BUFFERED = 2**20  # characters of lines encoded at a time
+
+    def __init__(self, compression: str = "none"):
+        self.compression = compression
+        self.lines: List[str] = []
+        self.buffered = 0
+        self.encoded: List[bytes] = []
+        self.compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31) if compression == "gzip" else None
+        self.bgzf_remainder = b""  # end of data that does not yet fill a bgzf block
+        self.data = None
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self.buffered += len(line)
+        if self.buffered > self.MAX_BUFFERED:
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) == 0:
+            return
+        data = ("\n".join(self.lines) + "\n").encode()
+        self.lines = []
+        self.buffered = 0
+        if self.compression == "gzip":
+            self.encoded.append(self.compressor.compress(data))
+        elif self.compression == "bgzf":
+            data = self.bgzf_remainder + data
+            full_blocks = len(data) - len(data) % BGZF_BLOCK_SIZE
+            self.encoded.extend(bgzf_block(data[start:start + BGZF_BLOCK_SIZE]) for start in range(0, full_blocks, BGZF_BLOCK_SIZE))
+            self.bgzf_remainder = data[full_blocks:]
+        else:
+            self.encoded.append(data)
+
+    def close(self):
+        # should be called when all lines have been appended
+        self.flush()
+        if self.compressor is not None:
+            self.encoded.append(self.compressor.flush())
+            self.compressor = None
+        if len(self.bgzf_remainder) != 0:
+            self.encoded.append(bgzf_block(self.bgzf_remainder))
+            self.bgzf_remainder = b""
+        self.data = b"".join(self.encoded)
+        self.encoded = []
+
+
+class OrderedWriter:
+    """
+    Writes the OutputChunks of a run to its output file in order, as they are done: chunks that are done before the ones
+    ahead of them wait in a reorder buffer (backlog), and are written as soon as the chunks before them are
+    If given a RunManifest, the writer records each chunk in it as it is written, and continues a resumed run after its
+    chunks that were written. A partial output is kept when the run fails, for it to be resumed
+    """
+    BUFFER_SIZE = 2**23  # 8MB
+
+    def __init__(self, path: str, header: str, compression: str = "none", manifest: RunManifest = None):
+        self.path = path
+        self.compression = compression
+        self.manifest = manifest
+        self.name = os.path.basename(path)  # in manifest
+        self.next_chunk = 0
+        self.waiting = {}  # chunk number -> chunk, of chunks done before the next chunk to write
+        if manifest is not None and self.name in manifest.file_sizes:  # resumed
+            if not os.path.isfile(path) or os.path.getsize(path) < manifest.file_sizes[self.name]:
+                raise ValueError(f"{path} is shorter than its manifest records, and can't be resumed")
+            self.output_file = open(path, 'r+b', buffering=self.BUFFER_SIZE)
+            self.output_file.truncate(manifest.file_sizes[self.name])  # chunks written after the manifest was
+            self.output_file.seek(0, os.SEEK_END)
+            self.next_chunk = manifest.chunks_done
+        else:
+            self.output_file = open(path, 'wb', buffering=self.BUFFER_SIZE)
+            header_chunk = OutputChunk(compression)
+            header_chunk.append(header)
+            header_chunk.close()
+            self.output_file.write(header_chunk.data)
+            self.record()
+
+    @property
+    def backlog(self) -> int:
+        return len(self.waiting)
+
+    def add(self, chunk_number: int, chunk: OutputChunk):
+        self.waiting[chunk_number] = chunk
+        if self.next_chunk in self.waiting:
+            while self.next_chunk in self.waiting:
+                self.output_file.write(self.waiting.pop(self.next_chunk).data)
+                self.next_chunk += 1
+            self.record()
+
+    def record(self, complete: bool = False):
+        # records the chunks written in the manifest, once they are on disk. Complete runs are not resumed
+        if self.manifest is not None:
+            self.output_file.flush()
+            os.fsync(self.output_file.fileno())
+            self.manifest.record(self.next_chunk, {self.name: self.output_file.tell()}, complete)
+
+    def close(self):
+        if len(self.waiting) != 0:
+            self.discard()
+            raise RuntimeError(f"Chunks {sorted(self.waiting)} of {self.path} were done, but not all chunks before them were")
+        if self.compression == "bgzf":
+            self.output_file.write(BGZF_EOF)
+        self.record(complete=True)
+        self.output_file.close()
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        self.output_file.close()
+        if self.manifest is None:  # don't leave a partial output behind, that could be taken for a complete one
+            os.remove(self.path)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -1,14 +1,16 @@
 # cython: language_level=3
 import os
-from typing import List
+from typing import Iterator, List, Tuple
+import numpy as np
 from collections import namedtuple
-from pysam import AlignmentFile
+import multiprocessing, queue
 
-from src.IndelCalling.Locus import Locus
+from src.IndelCalling.Locus import Locus, LociBatch
 from src.IndelCalling.AlleleSet import AlleleSet
 from src.IndelCalling.Histogram import Histogram
-from src.IndelCalling.CallAlleles import calculate_alleles
-from src.IndelCalling.CallMutations import call_mutations, is_possible_mutation
+from src.IndelCalling.CallAlleles import calculate_alleles, calculate_alleles_batch, CoverageFilter, NO_COVERAGE_FILTER, is_skipped
+from src.IndelCalling.AlleleCache import AlleleCacheSettings, DEFAULT_CACHE_SETTINGS, worker_cache
+from src.IndelCalling.CallMutations import call_mutations, is_possible_mutation, sweep_calls, MutationThresholds, DEFAULT_THRESHOLDS
 from src.IndelCalling.FisherTest import Fisher
 from src.IndelCalling.MutationCall import MutationCall
 
@@ -16,85 +18,352 @@ from src.GenomicUtils.ReadsFetcher import ReadsFetcher
 from src.GenomicUtils.LocusFile import LociManager
 from src.GenomicUtils.NoiseTable import get_noise_table
 from . import BatchUtil
-from .FileBackedQueue import FileBackedQueue
+from .SingleFileBatches import HistogramSource
+from .HistogramStore import is_histogram_catalog
+from .OutputWriter import OutputChunk, OrderedWriter, output_path
+from .RunManifest import RunManifest, describe_input
+from .RegionPartitioner import get_chunk_sizes
 
 PairResults = namedtuple("PairResults", ['normal_alleles', 'tumor_alleles', 'decision'])
 
 
-def format_mutation_call(decision: MutationCall):
-    return f"{str(decision.normal_alleles.histogram.locus)}\t{str(decision.normal_alleles.histogram)}\t{str(decision.normal_alleles)}\t{str(decision.tumor_alleles.histogram)}\t{str(decision.tumor_alleles)}\t{str(decision)}"
+def format_mutation_call(decision: MutationCall, ks_calls: List[str] = None):
+    return f"{str(decision.normal_alleles.histogram.locus)}\t{str(decision.normal_alleles.histogram)}\t{str(decision.normal_alleles)}\t{str(decision.tumor_alleles.histogram)}\t{str(decision.tumor_alleles)}\t{decision.format(ks_calls)}"
+
+
+def describe_pair_run(run: str, normal: str, tumor: str, loci_file: str, batch_start: int, batch_end: int, flanking: int, required_reads: int,
+                      integer_indels_only: bool, cache_settings: AlleleCacheSettings, ks_calls: List[str], contig_aliases: str,
+                      thresholds: MutationThresholds, compression: str, coverage_filter: CoverageFilter) -> dict:
+    # what a resumed pair run must have in common with the run it continues (see RunManifest)
+    return {"run": run, "inputs": [describe_input(normal), describe_input(tumor), describe_input(loci_file)], "batch": [batch_start, batch_end],
+            "settings": [flanking, required_reads, integer_indels_only, cache_settings.deterministic, ks_calls, contig_aliases, thresholds, compression,
+                         coverage_filter]}
+
+
+def balance_pair_cores(cores: int, num_chunks: int, decompression_threads: int, read_ahead_paths: List[str],
+                       paths: List[str]) -> Tuple[int, int, bool]:
+    # BatchUtil.balance_cores for pair workers, which read read_ahead_paths in a reader process (see PairHistograms), unless
+    # they are all histogram catalogs, and open the BAMs among paths
+    # :return: also whether workers read ahead: a worker without a core for its reader (ex. -c 1) reads its BAMs itself
+    processes = 1 if all(is_histogram_catalog(path) for path in read_ahead_paths) else 2
+    BAMs = sum(not is_histogram_catalog(path) for path in paths)
+    workers, decompression_threads = BatchUtil.balance_cores(cores, num_chunks, decompression_threads, processes, BAMs)
+    return workers, decompression_threads, processes == 2 and cores >= 2 * workers
 
 
 def run_full_pair(normal: str, tumor: str, loci_file: str, batch_start: int,
-                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only, output_prefix: str) -> str:
-    # returns path of output file
+                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only, output_prefix: str,
+                       cache_settings: AlleleCacheSettings = DEFAULT_CACHE_SETTINGS, ks_calls: List[str] = None, partition: str = 'regions',
+                       contig_aliases: str = None, thresholds: MutationThresholds = DEFAULT_THRESHOLDS, compression: str = 'none',
+                       resume: bool = False, decompression_threads: int = 0, reference: str = None,
+                       coverage_filter: CoverageFilter = NO_COVERAGE_FILTER) -> str:
+    # returns path of output file. resume: continue the run that wrote it, if it stopped (see RunManifest)
+    # decompression_threads: of each BAM a worker opens (0: cores no worker would use, see balance_pair_cores)
+    # reference: FASTA of CRAMs (see AlignmentFiles.open_alignment_file)
+    # coverage_filter: of loci with too few reads to call (see CallAlleles.CoverageFilter)
+    output_file = output_path(output_prefix + ".full.mut", compression)
+    manifest = RunManifest.start(output_file, describe_pair_run("full_pair", normal, tumor, loci_file, batch_start, batch_end, flanking, required_reads,
+                                                                integer_indels_only, cache_settings, ks_calls, contig_aliases, thresholds, compression,
+                                                                coverage_filter),
+                                 lambda: get_chunk_sizes(partition, loci_file, batch_start, batch_end, [normal, tumor], cores, contig_aliases), resume)
+    if manifest.complete:
+        return output_file
     loci_iterator = LociManager(loci_file, batch_start)
     noise_table = get_noise_table()
-    results: List[FileBackedQueue] = BatchUtil.run_batch(partial_full_pair, [normal, tumor, flanking, noise_table, required_reads, integer_indels_only], loci_iterator,
-                                  (batch_end - batch_start), cores, os.path.dirname(output_prefix))
     mutation_header = f"{Locus.header()}\t{Histogram.header(prefix='NORMAL_')}\t{AlleleSet.header(prefix='NORMAL_')}\t{Histogram.header(prefix='TUMOR_')}\t{AlleleSet.header(prefix='TUMOR_')}\t{MutationCall.header()}"
-    output_file = output_prefix + ".full.mut"
-    BatchUtil.write_queues_results(output_file, results, mutation_header)
-    return output_file+".tsv"
+    workers, decompression_threads, read_ahead = balance_pair_cores(cores, len(manifest.chunk_sizes) - manifest.chunks_done, decompression_threads, [normal, tumor], [normal, tumor])
+    with OrderedWriter(output_file, mutation_header, compression, manifest) as writer:
+        BatchUtil.run_batch(partial_full_pair, [normal, tumor, flanking, noise_table, required_reads, integer_indels_only, cache_settings, ks_calls, contig_aliases, thresholds, compression,
+                                                decompression_threads, read_ahead, reference, coverage_filter],
+                            loci_iterator, (batch_end - batch_start), workers, os.path.dirname(output_prefix), manifest.chunk_sizes, writer)
+    return output_file
+
+
+def serve_block_histograms(paths: List[str], flanking: int, integer_indels_only: bool, contig_aliases: str, decompression_threads: int,
+                           reference: str, min_reads: int, requests, histograms_queue):
+    # reader process of PairHistograms, which lasts as long as the worker that started it: for each chunk of loci requested
+    # (None stops it), puts the repeat lengths of each block's histograms from each path in the queue, or the error reading them
+    try:
+        sources = [HistogramSource(path, flanking, integer_indels_only, contig_aliases, decompression_threads, reference) for path in paths]
+    except Exception as error:
+        histograms_queue.put(error)
+        return
+    for loci in iter(requests.get, None):
+        try:
+            for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+                block = loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]
+                histograms_queue.put([[dict(histogram.repeat_lengths) for histogram in source_histograms]
+                                      for source_histograms in get_covered_histograms(sources, block, min_reads)])
+        except Exception as error:
+            histograms_queue.put(error)
+
+
+_worker_reader = None  # settings, process, requests and histograms queue of the reader process of this worker
+
+
+def worker_reader(settings: tuple) -> tuple:
+    # the reader process of this worker (see serve_block_histograms) for settings, which is started when it is first needed
+    # and kept for the chunks after. Returns the process, and its requests and histograms queues
+    global _worker_reader
+    if _worker_reader is not None and (_worker_reader[0] != settings or not _worker_reader[1].is_alive()):
+        stop_worker_reader()
+    if _worker_reader is None:
+        requests, histograms_queue = multiprocessing.Queue(), multiprocessing.Queue(maxsize=PairHistograms.READ_AHEAD_BLOCKS)
+        reader = multiprocessing.Process(target=serve_block_histograms, args=settings + (requests, histograms_queue), daemon=True)
+        reader.start()
+        _worker_reader = (settings, reader, requests, histograms_queue)
+    return _worker_reader[1:]
+
+
+def stop_worker_reader(terminate: bool = False):
+    # terminate: the reader may be in the middle of a chunk (ex. its caller stopped early)
+    global _worker_reader
+    if _worker_reader is not None:
+        _, reader, requests, _ = _worker_reader
+        if terminate and reader.is_alive():
+            reader.terminate()
+        elif reader.is_alive():
+            requests.put(None)
+        reader.join()
+        _worker_reader = None
+
+
+def get_covered_histograms(sources: List[HistogramSource], block: LociBatch, min_reads: int) -> List[List[Histogram]]:
+    # histograms of block from each source. Loci with fewer than min_reads reads in the first source are not read from the
+    # others, and have empty histograms in them
+    first_histograms = sources[0].get_batch_histograms(block)
+    if min_reads == 0:
+        return [first_histograms] + [source.get_batch_histograms(block) for source in sources[1:]]
+    covered = [i for i, histogram in enumerate(first_histograms) if histogram.num_reads >= min_reads]
+    block_histograms = [first_histograms]
+    for source in sources[1:]:
+        histograms = [Histogram(histogram.locus, histogram.integer_indels_only) for histogram in first_histograms]
+        covered_histograms = source.get_histograms([first_histograms[i].locus for i in covered], block.lines()[covered])
+        for i, histogram in zip(covered, covered_histograms):
+            histograms[i] = histogram
+        block_histograms.append(histograms)
+    return block_histograms
+
+
+class PairHistograms:
+    """
+    Blocks of LOCUS_BLOCK_SIZE loci of a chunk, with their histograms from each of paths (the normal and tumor BAMs of a
+    pair), which a reader process builds while the caller calls the alleles and mutations of the blocks before them.
+    Reading the BAMs is about half the work of a pair, and is mostly python (so threads would not run it concurrently),
+    so a worker of a pair run keeps 2 processes busy (and is given 2 cores, see balance_pair_cores), and is about as fast
+    as 2 workers of a single file run. Each worker has one reader, which keeps its BAMs open between chunks
+    The repeat lengths of histograms are sent back, in the order they were seen, and put in histograms of the caller's loci
+    Histogram catalogs are read by the caller: they are faster to read than to send. Without read_ahead (ex. a run on one
+    core), the caller reads the BAMs itself
+    Loci with fewer than min_reads reads in the first path (the normal) are not read from the others (see CoverageFilter)
+    """
+    READ_AHEAD_BLOCKS = 2
+
+    def __init__(self, paths: List[str], flanking: int, integer_indels_only: bool, contig_aliases: str, decompression_threads: int = 1,
+                 reference: str = None, min_reads: int = 0, read_ahead: bool = True):
+        self.paths = paths
+        self.flanking = flanking
+        self.integer_indels_only = integer_indels_only
+        self.contig_aliases = contig_aliases
+        self.decompression_threads = decompression_threads  # of each BAM (see HistogramSource)
+        self.reference = reference
+        self.min_reads = min_reads
+        self.read_ahead = read_ahead
+
+    def read_blocks(self, loci: LociBatch) -> Iterator[Tuple[LociBatch, List[List[Histogram]]]]:
+        if not self.read_ahead or all(is_histogram_catalog(path) for path in self.paths):
+            sources = [HistogramSource(path, self.flanking, self.integer_indels_only, self.contig_aliases, self.decompression_threads, self.reference)
+                       for path in self.paths]
+            for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+                block = loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]
+                yield block, get_covered_histograms(sources, block, self.min_reads)
+            return
+        reader, requests, histograms_queue = worker_reader((tuple(self.paths), self.flanking, self.integer_indels_only, self.contig_aliases,
+                                                            self.decompression_threads, self.reference, self.min_reads))
+        requests.put(loci)
+        read_chunk = False
+        try:
+            for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+                block = loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]
+                repeat_lengths = self.get_block(histograms_queue, reader)
+                block_histograms = []
+                for source_repeat_lengths in repeat_lengths:
+                    histograms = [Histogram(locus, self.integer_indels_only) for locus in block]
+                    for histogram, lengths in zip(histograms, source_repeat_lengths):
+                        histogram.repeat_lengths.update(lengths)
+                    block_histograms.append(histograms)
+                yield block, block_histograms
+            read_chunk = True
+        finally:
+            if not read_chunk:  # the caller stopped early, or reading failed: the next chunk starts a new reader
+                stop_worker_reader(terminate=True)
+
+    @staticmethod
+    def get_block(histograms_queue, reader) -> list:
+        while True:
+            try:
+                repeat_lengths = histograms_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not reader.is_alive():
+                    raise RuntimeError(f"Reader process of BAMs exited with code {reader.exitcode}")
+        if isinstance(repeat_lengths, Exception):
+            raise repeat_lengths
+        return repeat_lengths
 
 
 def get_alleles(locus: Locus, reads_fetcher: ReadsFetcher, flanking: int, noise_table, required_reads: int, integer_indels_only: bool) -> AlleleSet:
     histogram = Histogram(locus, integer_indels_only)
-    reads = reads_fetcher.get_reads(locus.chromosome, locus.start - flanking, locus.end + flanking)
+    reads = reads_fetcher.get_reads(locus.contig, locus.start - flanking, locus.end + flanking)
     histogram.add_reads(reads)
     alleles = calculate_alleles(histogram, noise_table, required_read_support=required_reads)
     return alleles
 
 
 def partial_full_pair(loci: List[Locus], normal: str, tumor: str, flanking: int, noise_table, required_reads: int,
-                      integer_indels_only: bool, results_dir: str) -> FileBackedQueue:
-    calls = FileBackedQueue(out_file_dir=results_dir, max_memory=10**7)  # 10MB
+                      integer_indels_only: bool, cache_settings: AlleleCacheSettings, ks_calls: List[str], contig_aliases: str,
+                      thresholds: MutationThresholds, compression: str, decompression_threads: int, read_ahead: bool, reference: str,
+                      coverage_filter: CoverageFilter, results_dir: str) -> OutputChunk:
+    calls = OutputChunk(compression)
     if len(loci) != 0:
-        normal_fetcher = ReadsFetcher(AlignmentFile(normal, "rb"), loci[0].chromosome)
-        tumor_fetcher = ReadsFetcher(AlignmentFile(tumor, "rb"), loci[0].chromosome)
         fisher = Fisher()
-        for locus in loci:
-            normal_alleles = get_alleles(locus, normal_fetcher, flanking, noise_table, required_reads, integer_indels_only)
-            tumor_alleles = get_alleles(locus, tumor_fetcher, flanking, noise_table, required_reads, integer_indels_only)
-            calls.append(format_mutation_call(call_mutations(normal_alleles, tumor_alleles, noise_table, fisher)))
+        allele_cache = worker_cache(cache_settings)
+        pair_histograms = PairHistograms([normal, tumor], flanking, integer_indels_only, contig_aliases, decompression_threads, reference,
+                                         coverage_filter.min_reads, read_ahead)
+        for block, (normal_histograms, tumor_histograms) in pair_histograms.read_blocks(loci):
+            normal_block_alleles = calculate_alleles_batch(normal_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                           min_reads=coverage_filter.min_reads)
+            tumor_block_alleles = calculate_alleles_batch(tumor_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                          min_reads=coverage_filter.min_reads)
+            for normal_alleles, tumor_alleles in zip(normal_block_alleles, tumor_block_alleles):
+                if not is_skipped(coverage_filter, normal_alleles.histogram, tumor_alleles.histogram):
+                    calls.append(format_mutation_call(call_mutations(normal_alleles, tumor_alleles, noise_table, fisher, thresholds), ks_calls))
     calls.close()
     return calls
 
 
 def run_mutations_pair(normal: str, tumor: str, loci_file: str, batch_start: int,
-                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only: bool, output_prefix: str):
-    # returns output file
+                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only: bool, output_prefix: str,
+                       cache_settings: AlleleCacheSettings = DEFAULT_CACHE_SETTINGS, ks_calls: List[str] = None, partition: str = 'regions',
+                       contig_aliases: str = None, thresholds: MutationThresholds = DEFAULT_THRESHOLDS, compression: str = 'none',
+                       resume: bool = False, decompression_threads: int = 0, reference: str = None,
+                       coverage_filter: CoverageFilter = NO_COVERAGE_FILTER):
+    # returns output file. resume: continue the run that wrote it, if it stopped (see RunManifest)
+    # decompression_threads: of each BAM a worker opens (0: cores no worker would use, see balance_pair_cores)
+    # reference: FASTA of CRAMs (see AlignmentFiles.open_alignment_file)
+    # coverage_filter: of loci with too few reads to call (see CallAlleles.CoverageFilter)
+    output_file = output_path(output_prefix + ".partial.mut", compression)
+    manifest = RunManifest.start(output_file, describe_pair_run("mutations_pair", normal, tumor, loci_file, batch_start, batch_end, flanking, required_reads,
+                                                                integer_indels_only, cache_settings, ks_calls, contig_aliases, thresholds, compression,
+                                                                coverage_filter),
+                                 lambda: get_chunk_sizes(partition, loci_file, batch_start, batch_end, [normal, tumor], cores, contig_aliases), resume)
+    if manifest.complete:
+        return output_file
     loci_iterator = LociManager(loci_file, batch_start)
     noise_table = get_noise_table()
-    results: List[FileBackedQueue] = BatchUtil.run_batch(partial_mutations_pair, [normal, tumor, flanking, noise_table,
-                                                                                  required_reads, integer_indels_only],
-                                                     loci_iterator,
-                                                     (batch_end - batch_start), cores, result_dir=os.path.dirname(output_prefix))
     mutation_header = f"{Locus.header()}\t{Histogram.header(prefix='NORMAL_')}\t{AlleleSet.header(prefix='NORMAL_')}\t{Histogram.header(prefix='TUMOR_')}\t{AlleleSet.header(prefix='TUMOR_')}\t{MutationCall.header()}"
-    output_file = output_prefix + ".partial.mut"
-    BatchUtil.write_queues_results(output_file, results, mutation_header)
-    return output_file+".tsv"
+    workers, decompression_threads, read_ahead = balance_pair_cores(cores, len(manifest.chunk_sizes) - manifest.chunks_done, decompression_threads, [normal], [normal, tumor])
+    with OrderedWriter(output_file, mutation_header, compression, manifest) as writer:
+        BatchUtil.run_batch(partial_mutations_pair, [normal, tumor, flanking, noise_table,
+                                                     required_reads, integer_indels_only, cache_settings, ks_calls, contig_aliases, thresholds, compression,
+                                                     decompression_threads, read_ahead, reference, coverage_filter],
+                            loci_iterator,
+                            (batch_end - batch_start), workers, result_dir=os.path.dirname(output_prefix),
+                            batch_sizes=manifest.chunk_sizes, writer=writer)
+    return output_file
 
 
 def get_tumor_alleles(reads_fetcher: ReadsFetcher, locus: Locus, flanking: int, noise_table, required_reads=6, integer_indels_only=False) -> AlleleSet:
     histogram = Histogram(locus, integer_indels_only=integer_indels_only)
-    reads = reads_fetcher.get_reads(locus.chromosome, locus.start - flanking, locus.end + flanking)
+    reads = reads_fetcher.get_reads(locus.contig, locus.start - flanking, locus.end + flanking)
     histogram.add_reads(reads)
     current_alleles = calculate_alleles(histogram, noise_table, required_read_support=required_reads)
     return current_alleles
 
 
 def partial_mutations_pair(loci: List[Locus], normal: str, tumor: str, flanking: int, noise_table, required_reads: int,
-                           integer_indels_only: bool, results_dir: str) -> FileBackedQueue:
-    calls = FileBackedQueue(out_file_dir=results_dir, max_memory=10**7) # 10MB
+                           integer_indels_only: bool, cache_settings: AlleleCacheSettings, ks_calls: List[str], contig_aliases: str,
+                           thresholds: MutationThresholds, compression: str, decompression_threads: int, read_ahead: bool, reference: str,
+                           coverage_filter: CoverageFilter, results_dir: str) -> OutputChunk:
+    calls = OutputChunk(compression)
     if len(loci) != 0:
-        normal_fetcher = ReadsFetcher(AlignmentFile(normal, "rb"), loci[0].chromosome)
-        tumor_fetcher = ReadsFetcher(AlignmentFile(tumor, "rb"), loci[0].chromosome)
+        tumor_source = HistogramSource(tumor, flanking, integer_indels_only, contig_aliases, decompression_threads, reference)
         fisher = Fisher()
-        for locus in loci:
-            normal_alleles = get_alleles(locus, normal_fetcher, flanking, noise_table, required_reads, integer_indels_only)
-            if is_possible_mutation(normal_alleles):
-                tumor_alleles = get_alleles(locus, tumor_fetcher, flanking, noise_table, required_reads, integer_indels_only)
-                calls.append(format_mutation_call(call_mutations(normal_alleles, tumor_alleles, noise_table, fisher)))
+        allele_cache = worker_cache(cache_settings)
+        normal_source = PairHistograms([normal], flanking, integer_indels_only, contig_aliases, decompression_threads, reference,
+                                       coverage_filter.min_reads, read_ahead)
+        # tumor histograms are only built for candidates, which the normal alleles of each block decide
+        for block, (normal_histograms,) in normal_source.read_blocks(loci):
+            normal_block_alleles = calculate_alleles_batch(normal_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                           min_reads=coverage_filter.min_reads)
+            candidate_loci = [i for i, alleles in enumerate(normal_block_alleles) if is_possible_mutation(alleles, thresholds.p_equal)]
+            candidates = [normal_block_alleles[i] for i in candidate_loci]
+            tumor_histograms = tumor_source.get_histograms([alleles.histogram.locus for alleles in candidates], block.lines()[candidate_loci])
+            tumor_block_alleles = calculate_alleles_batch(tumor_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                          min_reads=coverage_filter.min_reads)
+            for normal_alleles, tumor_alleles in zip(candidates, tumor_block_alleles):
+                if not is_skipped(coverage_filter, normal_alleles.histogram, tumor_alleles.histogram):
+                    calls.append(format_mutation_call(call_mutations(normal_alleles, tumor_alleles, noise_table, fisher, thresholds), ks_calls))
     calls.close()
     return calls
+
+
+# columns of call counts in sweep output
+SWEEP_CALLS = [MutationCall.MUTATION, MutationCall.NOT_MUTATION, MutationCall.BORDERLINE_NONMUTATION, MutationCall.REVERTED_TO_REFERENCE,
+               MutationCall.TOO_MANY_ALLELES, MutationCall.INSUFFICIENT, MutationCall.NO_ALLELES]
+
+
+def run_sweep_pair(normal: str, tumor: str, loci_file: str, batch_start: int,
+                   batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only: bool, output_prefix: str,
+                   thresholds: List[MutationThresholds], cache_settings: AlleleCacheSettings = DEFAULT_CACHE_SETTINGS,
+                   partition: str = 'regions', contig_aliases: str = None, decompression_threads: int = 0,
+                   reference: str = None, coverage_filter: CoverageFilter = NO_COVERAGE_FILTER) -> str:
+    """
+    Calls every locus under each of thresholds, and writes how many loci got each call, per thresholds, to
+    [output_prefix].sweep.tsv. Alleles of each locus are called once, and its tests once for all thresholds (see CallMutations.LocusTests)
+    :param decompression_threads: of each BAM a worker opens (0: cores no worker would use, see balance_pair_cores)
+    :param reference: FASTA of CRAMs (see AlignmentFiles.open_alignment_file)
+    :param coverage_filter: of loci with too few reads to call (see CallAlleles.CoverageFilter). Skipped loci are not counted
+    :return: path of output file
+    """
+    loci_iterator = LociManager(loci_file, batch_start)
+    noise_table = get_noise_table()
+    batch_sizes = get_chunk_sizes(partition, loci_file, batch_start, batch_end, [normal, tumor], cores, contig_aliases)
+    workers, decompression_threads, read_ahead = balance_pair_cores(cores, len(batch_sizes), decompression_threads, [normal, tumor], [normal, tumor])
+    results: List[np.array] = BatchUtil.run_batch(partial_sweep_pair, [normal, tumor, flanking, noise_table, required_reads, integer_indels_only,
+                                                                       cache_settings, contig_aliases, thresholds, decompression_threads, read_ahead, reference,
+                                                                       coverage_filter], loci_iterator,
+                                                  (batch_end - batch_start), workers, os.path.dirname(output_prefix), batch_sizes)
+    call_counts = np.sum(results, axis=0, dtype=np.int64) if len(results) != 0 else np.zeros((len(thresholds), len(SWEEP_CALLS)), dtype=np.int64)
+    output_file = output_prefix + ".sweep.tsv"
+    with open(output_file, 'w+') as sweep_file:
+        sweep_file.write("LOR_RATIO\tFISHER_THRESHOLD\tP_EQUAL\t" + "\t".join(MutationCall.call_abbreviation(call) for call in SWEEP_CALLS) + "\n")
+        for locus_thresholds, counts in zip(thresholds, call_counts.tolist()):
+            sweep_file.write("\t".join(str(value) for value in list(locus_thresholds) + counts) + "\n")
+    return output_file
+
+
+def partial_sweep_pair(loci: List[Locus], normal: str, tumor: str, flanking: int, noise_table, required_reads: int,
+                       integer_indels_only: bool, cache_settings: AlleleCacheSettings, contig_aliases: str,
+                       thresholds: List[MutationThresholds], decompression_threads: int, read_ahead: bool, reference: str,
+                       coverage_filter: CoverageFilter, results_dir: str) -> np.array:
+    # number of loci (thresholds x SWEEP_CALLS) that got each call under each thresholds
+    call_counts = np.zeros((len(thresholds), len(SWEEP_CALLS)), dtype=np.int64)
+    if len(loci) != 0:
+        fisher = Fisher()
+        allele_cache = worker_cache(cache_settings)
+        columns = {call: column for column, call in enumerate(SWEEP_CALLS)}
+        rows = np.arange(len(thresholds))
+        pair_histograms = PairHistograms([normal, tumor], flanking, integer_indels_only, contig_aliases, decompression_threads, reference,
+                                         coverage_filter.min_reads, read_ahead)
+        for block, (normal_histograms, tumor_histograms) in pair_histograms.read_blocks(loci):
+            normal_block_alleles = calculate_alleles_batch(normal_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                           min_reads=coverage_filter.min_reads)
+            tumor_block_alleles = calculate_alleles_batch(tumor_histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                          min_reads=coverage_filter.min_reads)
+            for normal_alleles, tumor_alleles in zip(normal_block_alleles, tumor_block_alleles):
+                if is_skipped(coverage_filter, normal_alleles.histogram, tumor_alleles.histogram):
+                    continue
+                calls = sweep_calls(normal_alleles, tumor_alleles, noise_table, fisher, thresholds)
+                call_counts[rows, [columns[call] for call in calls]] += 1
+    return call_counts
@@ -0,0 +1,131 @@
+# cython: language_level=3
+from typing import Dict, List, Tuple
+from collections import namedtuple
+import numpy as np
+
+from src.GenomicUtils.AlignmentFiles import is_cram, open_alignment_file
+from src.GenomicUtils.ContigTable import ContigTable
+from src.GenomicUtils.LocusFile import LociManager, read_loci_positions
+from src.Entry.BatchUtil import get_batch_sizes
+from src.Entry.HistogramStore import is_histogram_catalog
+
+WINDOW_SIZE = 100_000  # bp; resolution of the estimate of how many reads are between loci
+LOCUS_COST = 3_000  # estimated cost of calling one locus, in compressed BAM bytes (about as long as sweeping 3KB of reads takes)
+CHUNKS_PER_CORE = 4  # more chunks than cores, so the pool can even out chunks that were estimated badly
+MAX_CHUNK_SIZE = 100_000  # loci; bounds the memory a chunk takes
+
+Shard = namedtuple("Shard", ["start", "end", "load"])  # [start, end) lines (0-indexed) of loci file, and fraction of estimated cost of run
+
+
+class ReadsDensity:
+    """
+    Estimates how much of a BAM lies before a position from its .bai index: fetching a position seeks to the first read
+    that overlaps it, so the difference between the (compressed) file offsets of two positions is about the size of their reads
+    Offsets are sampled at the edges of WINDOW_SIZE windows that have loci in them, and interpolated in between
+    CRAMs are estimated the same way from their .crai, at the resolution of their containers of reads
+    """
+    def __init__(self, BAM: str, contig_aliases: str = None):
+        self.BAM_handle = open_alignment_file(BAM)
+        self.offset_shift = 0 if is_cram(BAM) else 16  # CRAM offsets are of the container the read is in
+        self.contigs = ContigTable.from_bam(self.BAM_handle, contig_aliases)
+        self.offsets: Dict[Tuple[str, int], int] = {}  # (chromosome, window edge) -> compressed offset
+
+    def file_offset(self, chromosome: str, position: int) -> int:
+        # compressed offset of the first read that ends after position, or None if there is none on chromosome
+        if not self.contigs.has_contig(chromosome):
+            return None
+        reads_iterator = self.BAM_handle.fetch(tid=self.contigs.get_tid(chromosome), start=position, multiple_iterators=False)
+        if next(reads_iterator, None) is None:
+            return None
+        return self.BAM_handle.tell() >> self.offset_shift  # BAM virtual offset: compressed offset of BGZF block << 16 | offset in block
+
+    def window_offsets(self, chromosome: str, window_edges: np.array) -> np.array:
+        # offsets of the given (sorted) window edges. Edges past the last read get the offset of the last edge before them
+        offsets = np.zeros(len(window_edges), dtype=np.float64)
+        last_offset = 0
+        for i, edge in enumerate(window_edges):
+            key = (chromosome, int(edge))
+            if key not in self.offsets:
+                self.offsets[key] = self.file_offset(chromosome, int(edge))
+            if self.offsets[key] is not None:
+                last_offset = max(last_offset, self.offsets[key])
+            offsets[i] = last_offset
+        return offsets
+
+    def reads_before(self, chromosome: str, positions: np.array) -> np.array:
+        windows = np.unique(positions // WINDOW_SIZE)
+        window_edges = np.union1d(windows, windows + 1) * WINDOW_SIZE
+        return np.interp(positions, window_edges, self.window_offsets(chromosome, window_edges))
+
+
+def chromosome_runs(chromosomes: List[str]) -> List[Tuple[int, int]]:
+    # (start, end) of each run of consecutive loci on the same chromosome
+    runs = []
+    run_start = 0
+    for i in range(1, len(chromosomes) + 1):
+        if i == len(chromosomes) or chromosomes[i] != chromosomes[run_start]:
+            runs.append((run_start, i))
+            run_start = i
+    return runs
+
+
+def estimate_loci_costs(chromosomes: List[str], starts: np.array, BAMs: List[str], contig_aliases: str = None) -> np.array:
+    # estimated cost of each locus: the reads between it and the previous locus (which the ReadsFetcher sweeps through),
+    # summed over the BAMs, plus the cost of calling it
+    costs = np.full(len(starts), LOCUS_COST, dtype=np.float64)
+    runs = chromosome_runs(chromosomes)
+    for BAM in BAMs:
+        density = ReadsDensity(BAM, contig_aliases)
+        for run_start, run_end in runs:
+            reads_before = density.reads_before(chromosomes[run_start], starts[run_start:run_end])
+            costs[run_start + 1:run_end] += np.clip(np.diff(reads_before), 0, None)  # first locus of chromosome: only LOCUS_COST
+    return costs
+
+
+def partition_loci(loci_path: str, batch_start: int, batch_end: int, BAMs: List[str], cores: int, contig_aliases: str = None) -> List[int]:
+    """
+    Splits loci batch_start (0-indexed, inclusive) to batch_end (exclusive) into chunks of consecutive loci, to be run by
+    BatchUtil.run_batch. Chunks never straddle chromosomes, and are balanced by the estimated reads in them rather than
+    by number of loci, so a chunk over a high coverage region is made of fewer loci
+    :return: number of loci in each chunk, in order
+    """
+    chromosomes, starts = read_loci_positions(LociManager(loci_path, batch_start).get_slice(batch_end - batch_start))
+    if len(starts) == 0:
+        return []
+    costs = estimate_loci_costs(chromosomes, starts, BAMs, contig_aliases)
+    target_cost = costs.sum() / (cores * CHUNKS_PER_CORE)
+    chunk_sizes = []
+    for run_start, run_end in chromosome_runs(chromosomes):
+        # loci go to chunk number (cost of loci before them on chromosome) // target_cost
+        chunk_numbers = (np.cumsum(costs[run_start:run_end]) - costs[run_start:run_end]) // target_cost
+        for chunk_size in np.diff(np.flatnonzero(np.diff(chunk_numbers, prepend=-1, append=np.inf))):
+            chunk_sizes.extend(get_batch_sizes(int(chunk_size), MAX_CHUNK_SIZE))
+    return chunk_sizes
+
+
+def partition_shards(loci_path: str, batch_start: int, batch_end: int, BAMs: List[str], num_shards: int, contig_aliases: str = None) -> List[Shard]:
+    """
+    Splits loci batch_start (0-indexed, inclusive) to batch_end (exclusive) into num_shards ranges of consecutive loci, to
+    be run independently (see --shard, and msmutect scatter), balanced by the estimated reads in them as partition_loci
+    balances chunks. The same loci, BAMs and contig aliases always give the same shards, so each shard's run finds its own
+    Shards split chromosomes wherever their cost does (a chromosome may be more than a shard's share of the reads), and
+    are empty if there are fewer loci than shards. Histogram catalogs given instead of BAMs have no reads to balance
+    """
+    chromosomes, starts = read_loci_positions(LociManager(loci_path, batch_start).get_slice(batch_end - batch_start))
+    costs = estimate_loci_costs(chromosomes, starts, [BAM for BAM in BAMs if not is_histogram_catalog(BAM)], contig_aliases)
+    costs_before = np.cumsum(costs) - costs
+    total_cost = costs.sum()
+    # loci go to shard number (cost of loci before them) * num_shards // total cost
+    edges = [0] + np.searchsorted(costs_before, total_cost * np.arange(1, num_shards) / num_shards).tolist() + [len(costs)]
+    return [Shard(batch_start + start, batch_start + end, float(costs[start:end].sum() / total_cost) if total_cost != 0 else 0.0)
+            for start, end in zip(edges[:-1], edges[1:])]
+
+
+def get_chunk_sizes(partition: str, loci_path: str, batch_start: int, batch_end: int, BAMs: List[str], cores: int,
+                    contig_aliases: str = None) -> List[int]:
+    # partition is 'regions' (partition_loci) or 'lines' (chunks of MAX_CHUNK_SIZE loci). A single core runs chunks in
+    # order anyway, so there is nothing to balance. Histogram catalogs given instead of BAMs have no reads to balance
+    BAMs = [BAM for BAM in BAMs if not is_histogram_catalog(BAM)]
+    if partition == 'regions' and cores > 1 and len(BAMs) != 0:
+        return partition_loci(loci_path, batch_start, batch_end, BAMs, cores, contig_aliases)
+    return get_batch_sizes(batch_end - batch_start, MAX_CHUNK_SIZE)
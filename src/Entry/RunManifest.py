@@ -0,0 +1,73 @@
+# cython: language_level=3
+import json, os
+from typing import Callable, Dict, List
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_path: str) -> str:
+    # path of manifest of output file (or catalog)
+    return output_path + ".manifest.json"
+
+
+def describe_input(path: str) -> list:
+    # identifies an input of a run: a run can't be resumed against an input that changed since it started
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def read_manifest(output_path: str) -> dict:
+    # manifest of output, as RunManifest.record writes it, or None if it has none
+    if not os.path.isfile(manifest_path(output_path)):
+        return None
+    with open(manifest_path(output_path)) as manifest_file:
+        return json.load(manifest_file)
+
+
+class RunManifest:
+    """
+    Record of a run, kept next to its output (see manifest_path): the settings and inputs of the run, its chunk sizes,
+    how many chunks (from the first) are written to the output, and the size of each output file after them. The writer of
+    the output records each chunk it writes (see OutputWriter.OrderedWriter), so a run that is stopped can be resumed
+    (--resume) from its first chunk that is not written, by truncating its files to the recorded sizes
+    The manifest is replaced atomically, and only records data that is already on disk
+    """
+    def __init__(self, path: str, run: dict, chunk_sizes: List[int] = None):
+        self.path = path
+        self.run = json.loads(json.dumps(run))  # as it is read back: tuples are lists
+        self.chunk_sizes = chunk_sizes
+        self.chunks_done = 0
+        self.file_sizes: Dict[str, int] = {}
+        self.complete = False
+
+    @staticmethod
+    def start(output_path: str, run: dict, chunk_sizes: Callable[[], List[int]], resume: bool = False) -> 'RunManifest':
+        """
+        Manifest of a run writing output_path. If resume, and a manifest of the same run is there, the run continues where
+        it stopped, with the chunks it started with (a complete run is not run again). Otherwise, the run starts from the
+        beginning, with chunk_sizes(). Raises ValueError if the manifest there is of a run with other settings or inputs
+        """
+        manifest = RunManifest(manifest_path(output_path), run)
+        recorded = read_manifest(output_path) if resume else None
+        if recorded is None or (recorded["complete"] and not os.path.exists(output_path)):  # (output of complete run was removed)
+            manifest.chunk_sizes = [int(size) for size in chunk_sizes()]
+            return manifest
+        if recorded["version"] != MANIFEST_VERSION or recorded["run"] != manifest.run:
+            raise ValueError(f"{output_path} was written by a run with other settings or inputs, and can't be resumed. "
+                             f"Its run: {recorded['run']}")
+        manifest.chunk_sizes = recorded["chunk_sizes"]
+        manifest.chunks_done = recorded["chunks_done"]
+        manifest.file_sizes = recorded["file_sizes"]
+        manifest.complete = recorded["complete"]
+        return manifest
+
+    def record(self, chunks_done: int, file_sizes: Dict[str, int], complete: bool = False):
+        # file_sizes: size of each file of the output (named relative to the output's directory), after chunks_done chunks
+        self.chunks_done, self.file_sizes, self.complete = chunks_done, file_sizes, complete
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump({"version": MANIFEST_VERSION, "run": self.run, "chunk_sizes": self.chunk_sizes, "chunks_done": chunks_done,
+                       "file_sizes": file_sizes, "complete": complete}, manifest_file, indent=1)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,163 @@
+# cython: language_level=3
+import gzip, os, re, sys
+from typing import Dict, List, TextIO, Tuple
+
+from src.GenomicUtils.LocusFile import LociManager, read_loci
+from src.Entry.RegionPartitioner import Shard, partition_shards
+from src.Entry.OutputWriter import OutputChunk, OrderedWriter
+from src.Entry.RunManifest import read_manifest
+
+GATHERED_CHUNK_LINES = 100_000  # lines of shard outputs handed to the writer at a time
+
+
+def shard_prefix(output_prefix: str, shard: int, num_shards: int) -> str:
+    # output prefix of shard (1-indexed) of a run split into num_shards (see --shard)
+    return f"{output_prefix}.shard{shard}of{num_shards}"
+
+
+def format_shards(loci_path: str, shards: List[Shard]) -> str:
+    # a line for each shard: its --shard, its -b and -e, and its first and last loci
+    lines = ["SHARD\tBATCH_START\tBATCH_END\tLOCI\tFIRST_LOCUS\tLAST_LOCUS\tESTIMATED_LOAD"]
+    for number, shard in enumerate(shards, 1):
+        if shard.end == shard.start:
+            first_locus = last_locus = "."
+        else:
+            first_locus, last_locus = (f"{locus.contig}:{locus.start}" for locus in
+                                       [read_loci(LociManager(loci_path, line).get_slice(1))[0] for line in [shard.start, shard.end - 1]])
+        lines.append(f"{number}/{len(shards)}\t{shard.start + 1}\t{shard.end}\t{shard.end - shard.start}\t{first_locus}\t{last_locus}\t{shard.load:.4f}")
+    return "\n".join(lines) + "\n"
+
+
+def write_shards(loci_path: str, batch_start: int, batch_end: int, BAMs: List[str], num_shards: int, contig_aliases: str, output: str = None):
+    # writes the shards of a run (see format_shards) to output, or stdout
+    shards_table = format_shards(loci_path, partition_shards(loci_path, batch_start, batch_end, BAMs, num_shards, contig_aliases))
+    if output is None:
+        sys.stdout.write(shards_table)
+    else:
+        with open(output, 'w') as output_file:
+            output_file.write(shards_table)
+
+
+def find_shard_outputs(output_prefix: str) -> Dict[str, List[str]]:
+    """
+    Outputs of the shards of a run (see shard_prefix): suffix of output (ex. .full.mut.tsv) -> its shards, in order
+    Raises ValueError if any shard of an output is missing. Manifests and histogram catalogs are not gathered
+    """
+    directory, name = os.path.split(os.path.abspath(output_prefix))
+    shard_output = re.compile(re.escape(name) + r"\.shard(\d+)of(\d+)(\..+)$")
+    found: Dict[Tuple[str, int], Dict[int, str]] = {}  # (suffix, number of shards) -> shard -> path
+    for file_name in sorted(os.listdir(directory)):
+        match = shard_output.match(file_name)
+        path = os.path.join(directory, file_name)
+        if match is None or file_name.endswith((".manifest.json", ".tmp")) or os.path.isdir(path):
+            continue
+        found.setdefault((match[3], int(match[2])), {})[int(match[1])] = path
+    outputs = {}
+    for (suffix, num_shards), shards in found.items():
+        missing = [shard for shard in range(1, num_shards + 1) if shard not in shards]
+        if len(missing) != 0:
+            raise ValueError(f"Shards {', '.join(map(str, missing))} of {num_shards} of {output_prefix}{suffix} are missing")
+        if suffix in outputs:
+            raise ValueError(f"Shards of {output_prefix}{suffix} of runs split into different numbers of shards")
+        outputs[suffix] = [shards[shard] for shard in range(1, num_shards + 1)]
+    return outputs
+
+
+def check_shard_manifests(shard_outputs: List[str]):
+    # shards must be complete runs with the same settings, of consecutive loci. Raises ValueError otherwise
+    manifests = [read_manifest(path) for path in shard_outputs]
+    if any(manifest is None for manifest in manifests):  # ex. vcf files, which are converted from tsv outputs
+        return
+    for path, manifest, next_manifest in zip(shard_outputs, manifests, manifests[1:] + [None]):
+        if not manifest["complete"]:
+            raise ValueError(f"Shard {path} is not complete. Run it again with --resume")
+        if next_manifest is not None:
+            if {**manifest["run"], "batch": None} != {**next_manifest["run"], "batch": None}:
+                raise ValueError(f"Shards {path} and the one after it were run with different settings or inputs")
+            if manifest["run"]["batch"][1] != next_manifest["run"]["batch"][0]:
+                raise ValueError(f"Shard {path} and the one after it are not of consecutive loci")
+
+
+def open_output(path: str) -> TextIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def output_compression(path: str) -> str:
+    # compression of output (see OutputWriter.OUTPUT_COMPRESSIONS): bgzf blocks are gzip members with a BC extra field
+    if not path.endswith(".gz"):
+        return "none"
+    with open(path, 'rb') as output_file:
+        header = output_file.read(14)
+    return "bgzf" if len(header) == 14 and header[3] & 4 and header[12:14] == b"BC" else "gzip"
+
+
+def read_header(output_file: TextIO, is_vcf: bool) -> str:
+    # header of tsv output (its first line), or of vcf (its ## lines, and the #CHROM line)
+    header = [output_file.readline().rstrip("\n")]
+    while is_vcf and header[-1].startswith("##"):
+        header.append(output_file.readline().rstrip("\n"))
+    return "\n".join(header)
+
+
+def gather_lines(shard_outputs: List[str], output_path: str):
+    # concatenates the lines of shard outputs under one header, compressed as they are
+    is_vcf = output_path.endswith(".vcf")
+    compression = output_compression(shard_outputs[0])
+    with open_output(shard_outputs[0]) as first_shard:
+        header = read_header(first_shard, is_vcf)
+    with OrderedWriter(output_path, header, compression) as writer:
+        chunk_number = 0
+        for path in shard_outputs:
+            with open_output(path) as shard_file:
+                if read_header(shard_file, is_vcf) != header:
+                    raise ValueError(f"Header of shard {path} is not that of shard {shard_outputs[0]}")
+                chunk = OutputChunk(compression)
+                for i, line in enumerate(shard_file, 1):
+                    chunk.append(line.rstrip("\n"))
+                    if i % GATHERED_CHUNK_LINES == 0:
+                        chunk.close()
+                        writer.add(chunk_number, chunk)
+                        chunk_number, chunk = chunk_number + 1, OutputChunk(compression)
+                chunk.close()
+                writer.add(chunk_number, chunk)
+                chunk_number += 1
+
+
+def gather_sweeps(shard_outputs: List[str], output_path: str):
+    # sums the call counts of shard sweeps (see PairFileBatches.run_sweep_pair), which have the same thresholds in each row
+    with open(shard_outputs[0]) as first_shard:
+        rows = [line.rstrip("\n").split("\t") for line in first_shard]
+    for path in shard_outputs[1:]:
+        with open(path) as shard_file:
+            shard_rows = [line.rstrip("\n").split("\t") for line in shard_file]
+        if len(shard_rows) != len(rows) or any(shard_row[:3] != row[:3] for shard_row, row in zip(shard_rows, rows)):
+            raise ValueError(f"Thresholds of shard {path} are not those of shard {shard_outputs[0]}")
+        for row, shard_row in zip(rows[1:], shard_rows[1:]):
+            row[3:] = [str(int(count) + int(shard_count)) for count, shard_count in zip(row[3:], shard_row[3:])]
+    with open(output_path, 'w') as output_file:
+        output_file.write("".join("\t".join(row) + "\n" for row in rows))
+
+
+def gather_outputs(output_prefix: str, force: bool = False) -> List[str]:
+    """
+    Merges the outputs of each kind of the shards of a run (run with --shard k/N and output_prefix) into one output of
+    output_prefix, as the run would have written without shards: tsv and vcf outputs are concatenated in order of shard,
+    under one header (the loci file is sorted, and shards are consecutive loci), and sweeps are summed
+    Raises ValueError if shards are missing, incomplete, or of different runs, or if an output exists and not force
+    :return: paths of merged outputs
+    """
+    shard_outputs = find_shard_outputs(output_prefix)
+    if len(shard_outputs) == 0:
+        raise ValueError(f"No shard outputs of {output_prefix} (ex. {shard_prefix(output_prefix, 1, 2)}.partial.mut.tsv)")
+    for suffix, paths in shard_outputs.items():
+        check_shard_manifests(paths)
+        if os.path.exists(output_prefix + suffix) and not force:
+            raise ValueError(f"{output_prefix + suffix} would be overwritten. To force overwrite, use -f flag")
+    for suffix, paths in shard_outputs.items():
+        if suffix.endswith(".sweep.tsv"):
+            gather_sweeps(paths, output_prefix + suffix)
+        else:
+            gather_lines(paths, output_prefix + suffix)
+    return [output_prefix + suffix for suffix in shard_outputs]
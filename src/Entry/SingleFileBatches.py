@@ -3,17 +3,23 @@
 
 import os
 from typing import List
-from pysam import AlignmentFile
+import numpy as np
 
+from src.GenomicUtils.AlignmentFiles import open_alignment_file
 from src.GenomicUtils.LocusFile import LociManager
 from src.GenomicUtils.ReadsFetcher import ReadsFetcher
+from src.GenomicUtils.ContigTable import ContigTable
 from src.GenomicUtils.NoiseTable import get_noise_table
-from src.IndelCalling.Histogram import Histogram
+from src.IndelCalling.Histogram import Histogram, add_read_columns_batch
 from src.IndelCalling.AlleleSet import AlleleSet
-from src.IndelCalling.Locus import Locus
-from src.IndelCalling.CallAlleles import calculate_alleles
+from src.IndelCalling.Locus import Locus, LociBatch
+from src.IndelCalling.CallAlleles import calculate_alleles_batch, CoverageFilter, NO_COVERAGE_FILTER, is_skipped
+from src.IndelCalling.AlleleCache import AlleleCacheSettings, DEFAULT_CACHE_SETTINGS, worker_cache
 from src.Entry import BatchUtil
-from src.Entry.FileBackedQueue import FileBackedQueue
+from src.Entry.RegionPartitioner import get_chunk_sizes
+from src.Entry.OutputWriter import OutputChunk, OrderedWriter, output_path
+from src.Entry.RunManifest import RunManifest, describe_input
+from src.Entry.HistogramStore import HistogramShard, HistogramCatalogWriter, is_histogram_catalog, open_histogram_catalog
 
 
 def format_alleles(alleles: AlleleSet) -> str: # List[AlleleSet] not declared to avoid circular import
@@ -21,54 +27,140 @@ def format_alleles(alleles: AlleleSet) -> str: # List[AlleleSet] not declared to
 
 
 def run_single_allelic(BAM: str, loci_file: str, batch_start: int,
-                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only: bool, output_prefix: str) -> None:
+                       batch_end: int, cores: int, flanking: int, required_reads: int, integer_indels_only: bool, output_prefix: str,
+                       cache_settings: AlleleCacheSettings = DEFAULT_CACHE_SETTINGS, partition: str = 'regions', contig_aliases: str = None,
+                       compression: str = 'none', resume: bool = False, decompression_threads: int = 0,
+                       reference: str = None, coverage_filter: CoverageFilter = NO_COVERAGE_FILTER) -> None:
+    # resume: continue the run that wrote the output, if it stopped (see RunManifest)
+    # decompression_threads: of each BAM a worker opens (0: cores no worker would use, see BatchUtil.balance_cores)
+    # reference: FASTA of a CRAM (see AlignmentFiles.open_alignment_file)
+    # coverage_filter: of loci with too few reads to call (see CallAlleles.CoverageFilter)
+    output_file = output_path(output_prefix + ".all", compression)
+    run = {"run": "single_allelic", "inputs": [describe_input(BAM), describe_input(loci_file)], "batch": [batch_start, batch_end],
+           "settings": [flanking, required_reads, integer_indels_only, cache_settings.deterministic, contig_aliases, compression, coverage_filter]}
+    manifest = RunManifest.start(output_file, run, lambda: get_chunk_sizes(partition, loci_file, batch_start, batch_end, [BAM], cores, contig_aliases), resume)
+    if manifest.complete:
+        return
     loci_iterator = LociManager(loci_file, batch_start)
     noise_table = get_noise_table()
-    results = BatchUtil.run_batch(partial_single_allelic, [BAM, flanking, noise_table, required_reads, integer_indels_only],
-                                                           loci_iterator,  (batch_end - batch_start), cores, os.path.dirname(output_prefix))
     header = f"{Locus.header()}\t{Histogram.header()}\t{AlleleSet.header()}"
-    BatchUtil.write_queues_results(output_prefix + ".all", results, header)
+    workers, decompression_threads = BatchUtil.balance_cores(cores, len(manifest.chunk_sizes) - manifest.chunks_done, decompression_threads)
+    with OrderedWriter(output_file, header, compression, manifest) as writer:
+        BatchUtil.run_batch(partial_single_allelic, [BAM, flanking, noise_table, required_reads, integer_indels_only, cache_settings, contig_aliases, compression,
+                                                     decompression_threads, reference, coverage_filter],
+                            loci_iterator,  (batch_end - batch_start), workers, os.path.dirname(output_prefix), manifest.chunk_sizes, writer)
 
 
 def partial_single_allelic(loci: List[Locus], BAM: str, flanking: int, noise_table, required_reads: int, integer_indels_only: bool,
-                           results_dir: str) -> FileBackedQueue:
-    allelic_results = FileBackedQueue(out_file_dir=results_dir, max_memory=10**7) # 10MB
-    BAM_handle = AlignmentFile(BAM, "rb")
+                           cache_settings: AlleleCacheSettings, contig_aliases: str, compression: str, decompression_threads: int,
+                           reference: str, coverage_filter: CoverageFilter, results_dir: str) -> OutputChunk:
+    allelic_results = OutputChunk(compression)
     if len(loci) != 0:
-        reads_fetcher = ReadsFetcher(BAM_handle, loci[0].chromosome)
-        for locus in loci:
-            current_histogram = Histogram(locus, integer_indels_only)
-            reads = reads_fetcher.get_reads(locus.chromosome, locus.start - flanking, locus.end + flanking)
-            current_histogram.add_reads(reads)
-            current_alleles = calculate_alleles(current_histogram, noise_table, required_read_support=required_reads)
-            allelic_results.append(format_alleles(current_alleles))
+        histogram_source = HistogramSource(BAM, flanking, integer_indels_only, contig_aliases, decompression_threads, reference)
+        allele_cache = worker_cache(cache_settings)
+        for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+            block = loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]
+            histograms = histogram_source.get_batch_histograms(block)
+            for current_alleles in calculate_alleles_batch(histograms, noise_table, required_read_support=required_reads, cache=allele_cache,
+                                                           min_reads=coverage_filter.min_reads):
+                if not is_skipped(coverage_filter, current_alleles.histogram):
+                    allelic_results.append(format_alleles(current_alleles))
     allelic_results.close()
     return allelic_results
 
 
 def run_single_histogram(BAM: str, loci_file: str, batch_start: int,
-                         batch_end: int, cores: int, flanking: int, integer_indels_only: bool, output_prefix: str) -> None:
+                         batch_end: int, cores: int, flanking: int, integer_indels_only: bool, output_prefix: str,
+                         partition: str = 'regions', contig_aliases: str = None, histogram_format: str = 'tsv', compression: str = 'none',
+                         resume: bool = False, decompression_threads: int = 0, reference: str = None) -> None:
+    # histogram_format: 'tsv' writes [output_prefix].hist.tsv, 'binary' writes all of each histogram into a HistogramCatalog, [output_prefix].hist.hcat
+    # resume: continue the run that wrote the output, if it stopped (see RunManifest)
+    # decompression_threads: of each BAM a worker opens (0: cores no worker would use, see BatchUtil.balance_cores)
+    # reference: FASTA of a CRAM (see AlignmentFiles.open_alignment_file)
+    output_file = output_prefix + ".hist.hcat" if histogram_format == 'binary' else output_path(output_prefix + ".hist", compression)
+    run = {"run": "single_histogram", "inputs": [describe_input(BAM), describe_input(loci_file)], "batch": [batch_start, batch_end],
+           "settings": [flanking, integer_indels_only, contig_aliases, histogram_format, compression]}
+    manifest = RunManifest.start(output_file, run, lambda: get_chunk_sizes(partition, loci_file, batch_start, batch_end, [BAM], cores, contig_aliases), resume)
+    if manifest.complete:
+        return
     loci_iterator = LociManager(loci_file, batch_start)
-    results = BatchUtil.run_batch(partial_single_histogram, [BAM, flanking, integer_indels_only], loci_iterator,
-                                  (batch_end - batch_start), cores, os.path.dirname(output_prefix))
-    header = f"{Locus.header()}\t{Histogram.header()}"
-    BatchUtil.write_queues_results(output_prefix + ".hist", results, header)
+    workers, decompression_threads = BatchUtil.balance_cores(cores, len(manifest.chunk_sizes) - manifest.chunks_done, decompression_threads)
+    if histogram_format == 'binary':
+        batch_function, args = partial_binary_histogram, [BAM, flanking, integer_indels_only, contig_aliases, decompression_threads, reference]
+        writer = HistogramCatalogWriter(output_file, batch_start, manifest)
+    else:
+        batch_function, args = partial_single_histogram, [BAM, flanking, integer_indels_only, contig_aliases, compression, decompression_threads, reference]
+        writer = OrderedWriter(output_file, f"{Locus.header()}\t{Histogram.header()}", compression, manifest)
+    with writer:
+        BatchUtil.run_batch(batch_function, args, loci_iterator, (batch_end - batch_start), workers, os.path.dirname(output_prefix), manifest.chunk_sizes, writer)
+
+
+def get_histograms(loci: List[Locus], reads_fetcher: ReadsFetcher, flanking: int, integer_indels_only: bool) -> List[Histogram]:
+    # the reads of each run of loci on a contig are decoded once, into columns (see ReadsFetcher.get_block_reads)
+    histograms = [Histogram(locus, integer_indels_only) for locus in loci]  # loci may be a LociBatch, which makes a Locus per iteration
+    contigs = [histogram.locus.contig for histogram in histograms]
+    starts = np.array([histogram.locus.start for histogram in histograms], dtype=np.int64) - flanking
+    ends = np.array([histogram.locus.end for histogram in histograms], dtype=np.int64) + flanking
+    run_start = 0
+    for run_end in range(1, len(histograms) + 1):
+        if run_end == len(histograms) or contigs[run_end] != contigs[run_start]:
+            reads, num_reads, histogram_reads = reads_fetcher.get_block_reads(contigs[run_start], starts[run_start:run_end], ends[run_start:run_end])
+            add_read_columns_batch(histograms[run_start:run_end], reads, num_reads, histogram_reads)
+            run_start = run_end
+    return histograms
+
+
+class HistogramSource:
+    """
+    Histograms of loci, built from the reads of a BAM (or CRAM, see AlignmentFiles.open_alignment_file), or read from the HistogramCatalog an earlier run wrote (see
+    --histogram_format), so alleles and mutations can be called again without the BAM. Flanking and contig aliases only
+    apply to BAMs; a catalog has the histograms as its run built them
+    A BAM is decompressed by a pool of decompression_threads htslib threads, if more than 1 (see BatchUtil.balance_cores)
+    """
+    def __init__(self, path: str, flanking: int, integer_indels_only: bool, contig_aliases: str, decompression_threads: int = 1,
+                 reference: str = None):
+        self.flanking = flanking
+        self.integer_indels_only = integer_indels_only
+        if is_histogram_catalog(path):
+            self.catalog, self.reads_fetcher = open_histogram_catalog(path), None
+        else:
+            BAM_handle = open_alignment_file(path, reference, decompression_threads)
+            self.catalog, self.reads_fetcher = None, ReadsFetcher(BAM_handle, ContigTable.from_bam(BAM_handle, contig_aliases))
+
+    def get_histograms(self, loci: List[Locus], lines: np.array) -> List[Histogram]:
+        # lines: lines of loci in loci file (see LociBatch.lines)
+        if self.catalog is not None:
+            return self.catalog.get_histograms(loci, lines, self.integer_indels_only)
+        return get_histograms(loci, self.reads_fetcher, self.flanking, self.integer_indels_only)
+
+    def get_batch_histograms(self, loci: LociBatch) -> List[Histogram]:
+        return self.get_histograms(loci, loci.lines())
 
 
 def format_histogram(histogram: Histogram) -> str:
     return f"{str(histogram.locus)}\t{str(histogram)}"
 
 
-def partial_single_histogram(loci: List[Locus], BAM: str, flanking: int, integer_indels_only: bool, results_dir: str) -> FileBackedQueue:
-    histograms = FileBackedQueue(out_file_dir=results_dir, max_memory=10**7)  # 10MB
-    BAM_handle = AlignmentFile(BAM, "rb")
+def partial_single_histogram(loci: List[Locus], BAM: str, flanking: int, integer_indels_only: bool, contig_aliases: str,
+                             compression: str, decompression_threads: int, reference: str, results_dir: str) -> OutputChunk:
+    histograms = OutputChunk(compression)
+    if len(loci) != 0:
+        histogram_source = HistogramSource(BAM, flanking, integer_indels_only, contig_aliases, decompression_threads, reference)
+        for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+            for histogram in histogram_source.get_batch_histograms(loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]):
+                histograms.append(format_histogram(histogram))
+    histograms.close()
+    return histograms
+
+
+def partial_binary_histogram(loci: List[Locus], BAM: str, flanking: int, integer_indels_only: bool, contig_aliases: str,
+                             decompression_threads: int, reference: str, results_dir: str) -> HistogramShard:
+    histograms = HistogramShard()
     if len(loci) != 0:
-        reads_fetcher = ReadsFetcher(BAM_handle, loci[0].chromosome)
-        for locus in loci:
-            current_histogram = Histogram(locus, integer_indels_only)
-            reads = reads_fetcher.get_reads(locus.chromosome, locus.start - flanking, locus.end + flanking)
-            current_histogram.add_reads(reads)
-            histograms.append(format_histogram(current_histogram))
+        histogram_source = HistogramSource(BAM, flanking, integer_indels_only, contig_aliases, decompression_threads, reference)
+        for block_start in range(0, len(loci), BatchUtil.LOCUS_BLOCK_SIZE):
+            for histogram in histogram_source.get_batch_histograms(loci[block_start:block_start + BatchUtil.LOCUS_BLOCK_SIZE]):
+                histograms.append(histogram)
     histograms.close()
     return histograms
 
@@ -1,53 +1,101 @@
-import argparse
+import argparse, sys, itertools
 
 from src.Entry.SingleFileBatches import run_single_allelic, run_single_histogram
-from src.Entry.PairFileBatches import run_full_pair, run_mutations_pair
-from src.Entry.InputHandler import create_parser, validate_input
+from src.Entry.PairFileBatches import run_full_pair, run_mutations_pair, run_sweep_pair
+from src.Entry.InputHandler import create_parser, create_index_loci_parser, validate_input, validate_index_loci_input, validate_histogram_catalogs, \
+    is_threshold_sweep, create_scatter_parser, create_gather_parser, validate_scatter_input, exit_on
+from src.Entry.IndexLoci import write_loci_catalog
+from src.Entry.RegionPartitioner import partition_shards
+from src.Entry.ScatterGather import write_shards, gather_outputs
 from src.Entry.convert_tsv_to_vcf import convert_tsv_to_vcf
-
-
-def count_lines(file: str):
-    return sum(1 for _ in open(file, 'rb'))
+from src.GenomicUtils.LocusFile import open_loci_index
+from src.IndelCalling.AlleleCache import AlleleCacheSettings
+from src.IndelCalling.CallMutations import MutationThresholds
+from src.IndelCalling.CallAlleles import CoverageFilter
 
 
 def run_msmutect(args: argparse.Namespace):
     validate_input(args)  # will exit with error message if invalid combination of flags is given
     if args.batch_end:
         batch_end = args.batch_end
-    else:  # slight performance hit: ~ 1 sec / 2*10^6 loci
-        batch_end = count_lines(args.loci_file)
+    else:  # the loci file's index or catalog knows its number of loci (an index is built on first use: ~ 1 sec / 10^7 loci)
+        batch_end = open_loci_index(args.loci_file).num_lines
+    if args.shard:  # of the loci of the run, that were chosen as the others' are
+        shard, num_shards = args.shard
+        BAMs = [path for path in [args.normal_file, args.tumor_file, args.single_file] if path]
+        shard_loci = partition_shards(args.loci_file, args.batch_start - 1, batch_end, BAMs, num_shards, args.contig_aliases)[shard - 1]
+        args.batch_start, batch_end = shard_loci.start + 1, shard_loci.end
+    validate_histogram_catalogs(args, batch_end)
+    cache_settings = AlleleCacheSettings(args.allele_cache, args.allele_cache_memory * 10**6, args.deterministic)
+    coverage_filter = CoverageFilter(args.min_coverage, args.skip_low_coverage)
+    thresholds = [MutationThresholds(*values) for values in itertools.product(args.LOR_ratio, args.fisher_threshold, args.p_equal)]
     if args.single_file:
         if args.allele or not args.histogram:
             run_single_allelic(args.single_file, args.loci_file, args.batch_start - 1,
-                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix)
+                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix, cache_settings, args.partition, args.contig_aliases, args.compress, args.resume, args.decompression_threads, args.reference, coverage_filter)
         else:
             run_single_histogram(args.single_file, args.loci_file, args.batch_start - 1,
-                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix)
+                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix, args.partition, args.contig_aliases, args.histogram_format, args.compress, args.resume, args.decompression_threads, args.reference)
 
     else:
         if args.histogram and not args.mutation:
             run_single_histogram(args.normal_file, args.loci_file, args.batch_start - 1,
-                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix + ".normal")
+                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix + ".normal", args.partition, args.contig_aliases, args.histogram_format, args.compress, args.resume, args.decompression_threads, args.reference)
             run_single_histogram(args.tumor_file, args.loci_file, args.batch_start - 1,
-                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix + ".tumor")
+                                 batch_end, args.cores, args.flanking, args.integer, args.output_prefix + ".tumor", args.partition, args.contig_aliases, args.histogram_format, args.compress, args.resume, args.decompression_threads, args.reference)
         elif args.allele and not args.mutation:
             run_single_allelic(args.normal_file, args.loci_file, args.batch_start - 1,
-                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix + ".normal")
+                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix + ".normal", cache_settings, args.partition, args.contig_aliases, args.compress, args.resume, args.decompression_threads, args.reference, coverage_filter)
             run_single_allelic(args.tumor_file, args.loci_file, args.batch_start - 1,
-                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix + ".tumor")
+                               batch_end, args.cores, args.flanking, args.read_level, args.integer, args.output_prefix + ".tumor", cache_settings, args.partition, args.contig_aliases, args.compress, args.resume, args.decompression_threads, args.reference, coverage_filter)
+        elif is_threshold_sweep(args):
+            run_sweep_pair(args.normal_file, args.tumor_file, args.loci_file, args.batch_start-1, batch_end, args.cores, args.flanking,
+                           args.read_level, args.integer, args.output_prefix, thresholds, cache_settings, args.partition, args.contig_aliases,
+                           args.decompression_threads, args.reference, coverage_filter)
         else: # args.mutation=True
             if args.histogram or args.allele:
                 mut_file = run_full_pair(args.normal_file, args.tumor_file, args.loci_file, args.batch_start-1, batch_end,
-                              args.cores, args.flanking, args.read_level, args.integer, args.output_prefix)
+                              args.cores, args.flanking, args.read_level, args.integer, args.output_prefix, cache_settings, args.ks_calls, args.partition, args.contig_aliases, thresholds[0], args.compress, args.resume, args.decompression_threads, args.reference, coverage_filter)
 
             else:  # args.mutation=True, just mutations
                 mut_file = run_mutations_pair(args.normal_file, args.tumor_file, args.loci_file, args.batch_start-1, batch_end,
-                                args.cores, args.flanking, args.read_level, args.integer, args.output_prefix)
+                                args.cores, args.flanking, args.read_level, args.integer, args.output_prefix, cache_settings, args.ks_calls, args.partition, args.contig_aliases, thresholds[0], args.compress, args.resume, args.decompression_threads, args.reference, coverage_filter)
             if args.vcf:
                 convert_tsv_to_vcf(mut_file, args.output_prefix+".vcf")
 
 
+def run_index_loci(args: argparse.Namespace):
+    validate_index_loci_input(args)
+    write_loci_catalog(args.loci_file, args.output)
+
+
+def run_scatter(args: argparse.Namespace):
+    validate_scatter_input(args)
+    batch_end = args.batch_end if args.batch_end else open_loci_index(args.loci_file).num_lines
+    BAMs = [path for path in [args.normal_file, args.tumor_file, args.single_file] if path]
+    write_shards(args.loci_file, args.batch_start - 1, batch_end, BAMs, args.shards, args.contig_aliases, args.output)
+
+
+def run_gather(args: argparse.Namespace):
+    try:
+        for output in gather_outputs(args.output_prefix, args.force):
+            print(f"Gathered {output}", file=sys.stderr)
+    except ValueError as error:
+        exit_on(str(error))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "index-loci":
+        run_index_loci(create_index_loci_parser().parse_args(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "scatter":
+        run_scatter(create_scatter_parser().parse_args(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "gather":
+        run_gather(create_gather_parser().parse_args(sys.argv[2:]))
+    else:
+        parser: argparse.ArgumentParser = create_parser()
+        arguments = parser.parse_args()
+        run_msmutect(arguments)
+
+
 if __name__ == "__main__":
-    parser: argparse.ArgumentParser = create_parser()
-    arguments = parser.parse_args()
-    run_msmutect(arguments)
+    main()
@@ -0,0 +1,51 @@
+# cython: language_level=3
+import os
+from typing import List
+from pysam import AlignmentFile
+
+
+class CRAM_FIELDS:
+    # fields of reads (SAM_* of htslib's sam.h) a CRAM decoder can be told to decode (its required_fields option)
+    QNAME = 0x1
+    FLAG = 0x2
+    RNAME = 0x4
+    POS = 0x8
+    MAPQ = 0x10
+    CIGAR = 0x20
+    RNEXT = 0x40
+    PNEXT = 0x80
+    TLEN = 0x100
+    SEQ = 0x200
+    QUAL = 0x400
+    AUX = 0x800
+
+
+# what ReadsFetcher uses of a read: its flag, contig, start and cigar (which gives its end and indels). Without the sequence,
+# a CRAM's reads are decoded without its reference, which is neither fetched nor held in memory
+REQUIRED_FIELDS = CRAM_FIELDS.FLAG | CRAM_FIELDS.RNAME | CRAM_FIELDS.POS | CRAM_FIELDS.CIGAR
+
+
+def is_cram(path: str) -> bool:
+    # CRAM files start with "CRAM", whatever they are named
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as alignment_file:
+        return alignment_file.read(4) == b"CRAM"
+
+
+def index_paths(path: str) -> List[str]:
+    # paths an index of BAM (.bai) or CRAM (.crai) file may have, as htslib looks for them
+    extension = ".crai" if is_cram(path) else ".bai"
+    return [path + extension, os.path.splitext(path)[0] + extension]
+
+
+def open_alignment_file(path: str, reference: str = None, threads: int = 1) -> AlignmentFile:
+    """
+    Opens a BAM or CRAM file for reading. CRAMs decode only the REQUIRED_FIELDS of reads, so reads have no sequence,
+    qualities or tags. reference: FASTA the CRAM was compressed against, which htslib loads only if it needs it
+    :param threads: htslib threads that decompress the file, if more than 1
+    """
+    if is_cram(path):
+        return AlignmentFile(path, "rc", reference_filename=reference, threads=threads,
+                             format_options=[f"required_fields={REQUIRED_FIELDS}".encode(), b"decode_md=0"])
+    return AlignmentFile(path, "rb", threads=threads)
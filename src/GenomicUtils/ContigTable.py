@@ -0,0 +1,70 @@
+# cython: language_level=3
+import csv
+from typing import Dict, Tuple
+
+from src.IndelCalling.Locus import parse_chromosome
+
+PREFIXES = ('chr', 'Chr', 'CHR')
+BUILT_IN_ALIASES = {'MT': 'M'}  # names of the same contig, given as they are after dropping prefixes (ex. GRCh38 chrM, and b37 MT)
+
+
+def read_contig_aliases(aliases_path: str) -> Dict[str, str]:
+    # alias file: name of contig in loci file, and the name of the same contig in BAMs, separated by a tab. One contig per line
+    if aliases_path is None:
+        return {}
+    with open(aliases_path) as aliases_file:
+        return {fields[0]: fields[1] for fields in csv.reader(aliases_file, dialect="excel-tab") if len(fields) >= 2}
+
+
+def unprefixed(contig: str) -> str:
+    # chr16 -> 16, chrM -> M, MT -> M
+    for prefix in PREFIXES:
+        if contig.startswith(prefix) and len(contig) > len(prefix):
+            contig = contig[len(prefix):]
+            break
+    return BUILT_IN_ALIASES.get(contig, contig)
+
+
+class ContigTable:
+    """
+    Resolves names of contigs in the loci file to tids (index of contig in BAM header), once per name. A name resolves to
+    1. the contig it is aliased to (see read_contig_aliases), or the contig of the same name, if it is in the BAM
+    2. otherwise, the contig it is equal to besides a chr/Chr/CHR prefix, or the M/MT naming of the mitochondrial chromosome
+    3. otherwise, as (2) for the name as the loci file's chromosome column is printed (see Locus.parse_chromosome)
+    """
+    def __init__(self, references: Tuple[str], aliases: Dict[str, str] = None):
+        self.references = references
+        self.aliases = aliases if aliases is not None else {}
+        self.exact_tids = {contig: tid for tid, contig in enumerate(references)}
+        self.unprefixed_tids = {}
+        for tid, contig in enumerate(references):
+            self.unprefixed_tids.setdefault(unprefixed(contig), tid)  # first of (unusual) contigs that differ only in prefix
+        self.tids = {}  # resolved names
+
+    @staticmethod
+    def from_bam(BAM_handle, aliases_path: str = None) -> 'ContigTable':
+        return ContigTable(BAM_handle.references, read_contig_aliases(aliases_path))
+
+    def resolve(self, contig: str) -> int:
+        contig = self.aliases.get(contig, contig)
+        if contig in self.exact_tids:
+            return self.exact_tids[contig]
+        if unprefixed(contig) in self.unprefixed_tids:
+            return self.unprefixed_tids[unprefixed(contig)]
+        try:
+            return self.unprefixed_tids.get(unprefixed(parse_chromosome(contig)))
+        except RuntimeError:  # not parseable
+            return None
+
+    def get_tid(self, contig: str) -> int:
+        """ tid of contig of loci file in BAM. Raises ValueError if it is not in the BAM """
+        tid = self.tids.get(contig)
+        if tid is None:
+            tid = self.resolve(contig)
+            if tid is None:
+                raise ValueError(f"Contig {contig} of loci file is not in BAM. If it is there under another name, see --contig_aliases")
+            self.tids[contig] = tid
+        return tid
+
+    def has_contig(self, contig: str) -> bool:
+        return contig in self.tids or self.resolve(contig) is not None
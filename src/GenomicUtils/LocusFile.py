@@ -1,35 +1,189 @@
 # cython: language_level=3
-import csv
-from typing import List
+import csv, os
+from typing import List, Tuple
+from collections import namedtuple
+import numpy as np
 
-from src.IndelCalling.Locus import Locus
+from src.IndelCalling.Locus import LociBatch
 
+# loci [start, end) of a loci file: a byte range of a tsv loci file, or a range of rows of a loci catalog (see LociCatalog)
+# line is the line (0-indexed) the slice starts at
+LociSlice = namedtuple("LociSlice", ["path", "start", "end", "line"])
 
-class LociManager:
-    def __init__(self, loci_path: str, start: int = 0):
-        self.loci_file = open(loci_path)
-        self.iterator = csv.reader(self.loci_file, dialect="excel-tab")
-        self.prime_iterator(start)
 
-    def prime_iterator(self, n: int):
-        for i in range(n):
-            _ = next(self.iterator)
+def read_slice_fields(loci_slice: LociSlice) -> List[List[str]]:
+    # fields of the lines of a slice of a tsv loci file
+    with open(loci_slice.path, 'rb') as loci_file:
+        loci_file.seek(loci_slice.start)
+        lines = loci_file.read(loci_slice.end - loci_slice.start).decode().splitlines()
+    return list(csv.reader(lines, dialect="excel-tab"))
+
+
+def read_loci(loci_slice: LociSlice) -> LociBatch:
+    # parses the loci of a slice of a loci file. Workers get slices rather than pickled loci, and parse them themselves
+    if is_loci_catalog(loci_slice.path):
+        return open_loci_catalog(loci_slice.path).get_loci(loci_slice.start, loci_slice.end)
+    return LociBatch.from_fields(read_slice_fields(loci_slice), loci_slice.line)
+
+
+def read_loci_positions(loci_slice: LociSlice) -> Tuple[List[str], np.array]:
+    # chromosome (as in loci file) and start of the loci of a slice
+    if is_loci_catalog(loci_slice.path):
+        return open_loci_catalog(loci_slice.path).get_positions(loci_slice.start, loci_slice.end)
+    fields = read_slice_fields(loci_slice)
+    return [locus[0] for locus in fields], np.array([int(locus[3]) for locus in fields], dtype=np.int64)
+
+
+class LociIndex:
+    """
+    Byte offset of every STRIDE-th line of a loci file, so any line can be reached with a seek and at most STRIDE reads
+    Indexes of large files are built once and kept next to them (<loci file>.lidx), and rebuilt if the loci file changes
+    """
+    STRIDE = 1_000
+    MIN_SAVED_LINES = 100_000  # smaller files are indexed quickly enough to not leave an index file behind
+    READ_SIZE = 2**24  # 16MB
+
+    def __init__(self, loci_path: str):
+        self.loci_path = loci_path
+        self.index_path = loci_path + ".lidx"
+        loci_stat = os.stat(loci_path)
+        self.file_size = loci_stat.st_size
+        self.file_mtime = loci_stat.st_mtime_ns
+        if not self.load():
+            self.build()
+            if self.num_lines >= self.MIN_SAVED_LINES:
+                self.save()
+
+    def build(self):
+        line_starts = [np.zeros(1, dtype=np.int64)]  # offsets of the lines after every STRIDE newlines
+        num_lines = 0
+        with open(self.loci_path, 'rb') as loci_file:
+            for read_start in range(0, self.file_size, self.READ_SIZE):
+                newlines = np.flatnonzero(np.frombuffer(loci_file.read(self.READ_SIZE), dtype=np.uint8) == ord('\n'))
+                # newline number (num_lines + i + 1) ends a stride when it is a multiple of STRIDE
+                first = (-num_lines - 1) % self.STRIDE
+                line_starts.append(newlines[first::self.STRIDE].astype(np.int64) + read_start + 1)
+                num_lines += len(newlines)
+        self.offsets = np.concatenate(line_starts)
+        if self.offsets[-1] == self.file_size:  # last newline ends the file, and is not the start of another line
+            self.offsets = self.offsets[:-1]
+        last_line_unterminated = self.file_size != 0 and self.last_byte() != b'\n'
+        self.num_lines = num_lines + int(last_line_unterminated)
+
+    def last_byte(self) -> bytes:
+        with open(self.loci_path, 'rb') as loci_file:
+            loci_file.seek(-1, os.SEEK_END)
+            return loci_file.read(1)
+
+    def load(self) -> bool:
+        # loads index file, if there is one for the current loci file
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                saved = np.load(index_file)
+        except (OSError, ValueError):
+            return False
+        if len(saved) < 3 or saved[0] != self.file_size or saved[1] != self.file_mtime:
+            return False
+        self.num_lines = int(saved[2])
+        self.offsets = saved[3:]
+        return True
+
+    def save(self):
+        # [file size, file modification time, number of lines, offsets...]. Written to a temporary file first, so concurrent
+        # runs never see a partial index. An unwritable directory only means the index is rebuilt next time
+        temporary_path = f"{self.index_path}.{os.getpid()}"
+        try:
+            with open(temporary_path, 'wb') as index_file:
+                np.save(index_file, np.concatenate([[self.file_size, self.file_mtime, self.num_lines], self.offsets]).astype(np.int64))
+            os.replace(temporary_path, self.index_path)
+        except OSError:
+            pass
+
+    def line_offset(self, line: int) -> int:
+        # byte offset of start of line (0-indexed), or size of file if there are no more lines
+        if line >= self.num_lines:
+            return self.file_size
+        with open(self.loci_path, 'rb') as loci_file:
+            loci_file.seek(int(self.offsets[line // self.STRIDE]))
+            for _ in range(line % self.STRIDE):
+                loci_file.readline()
+            return loci_file.tell()
+
 
-    def get_batch(self, batch_size: int = 10000) -> List[Locus]:
-        loci = []
-        for i in range(batch_size):
-            try:
-                locus = next(self.iterator)
-            except StopIteration:  # iterator is exhausted
-                return loci
-            loci.append(Locus(chromosome=locus[0], start=int(locus[3]), end=int(locus[4]), pattern=locus[12],
-                          repeats=float(locus[6]), sequence=locus[13]))
+class LociCatalog:
+    """
+    Loci file converted into memory mapped columns (see IndexLoci.write_loci_catalog), so opening it takes constant time,
+    and the workers of a run share its pages. A directory of .npy files:
+    chromosome (uint16 code into chromosome_names), start and end (int32), repeats (float64, so loci print exactly as they
+    are written in the tsv), pattern (int32 code into patterns), and sequences, ascii sequences concatenated into
+    sequences.bin at sequence_offsets (int64, one more than the number of loci)
+    Rows are used as line numbers, so a catalog can stand in for a LociIndex
+    """
+    COLUMNS = ["chromosome", "start", "end", "repeats", "pattern", "sequence_offsets"]
+    MARKER = "start.npy"
 
+    def __init__(self, catalog_path: str):
+        self.catalog_path = catalog_path
+        for column in self.COLUMNS:
+            setattr(self, column, np.load(os.path.join(catalog_path, column + ".npy"), mmap_mode='r'))
+        self.chromosome_names = np.load(os.path.join(catalog_path, "chromosome_names.npy")).tolist()
+        self.patterns = np.load(os.path.join(catalog_path, "patterns.npy")).tolist()
+        self.sequences = np.memmap(os.path.join(catalog_path, "sequences.bin"), dtype=np.uint8, mode='r') \
+            if self.sequence_offsets[-1] != 0 else np.zeros(0, dtype=np.uint8)  # numpy can't map empty files
+        self.num_lines = len(self.start)
+
+    def line_offset(self, line: int) -> int:
+        return min(line, self.num_lines)
+
+    def get_positions(self, start: int, end: int) -> Tuple[List[str], np.array]:
+        return [self.chromosome_names[code] for code in self.chromosome[start:end]], np.array(self.start[start:end], dtype=np.int64)
+
+    def get_loci(self, start: int, end: int) -> LociBatch:
+        # views of the mapped columns; nothing is read until the loci are iterated over
+        return LociBatch(self.chromosome_names, self.chromosome[start:end], self.start[start:end], self.end[start:end],
+                         self.repeats[start:end], self.patterns, self.pattern[start:end], self.sequences, self.sequence_offsets[start:end + 1], start)
+
+
+def is_loci_catalog(loci_path: str) -> bool:
+    return os.path.isfile(os.path.join(loci_path, LociCatalog.MARKER))
+
+
+_loci_catalogs = {}
+
+
+def open_loci_catalog(catalog_path: str) -> LociCatalog:
+    # one mapping of each catalog per process, kept between the batches a worker is given (unless the catalog was rewritten)
+    key = (catalog_path, os.stat(os.path.join(catalog_path, LociCatalog.MARKER)).st_ino)
+    if key not in _loci_catalogs:
+        _loci_catalogs[key] = LociCatalog(catalog_path)
+    return _loci_catalogs[key]
+
+
+def open_loci_index(loci_path: str):
+    # LociCatalog of a catalog, or LociIndex of a tsv loci file
+    if is_loci_catalog(loci_path):
+        return open_loci_catalog(loci_path)
+    return LociIndex(loci_path)
+
+
+class LociManager:
+    """
+    Hands out consecutive batches of loci of a loci file (tsv, or catalog), starting at line start (0-indexed)
+    Batches are either parsed (get_batch), or slices of the file for a worker to parse (get_slice)
+    """
+    def __init__(self, loci_path: str, start: int = 0):
+        self.loci_path = loci_path
+        self.index = open_loci_index(loci_path)
+        self.line = start
+        self.offset = self.index.line_offset(start)  # of line, in file (tsv), or catalog
 
-        return loci
+    def get_slice(self, batch_size: int = 10000) -> LociSlice:
+        slice_line, self.line = self.line, min(self.line + batch_size, self.index.num_lines)
+        slice_start, self.offset = self.offset, self.index.line_offset(self.line)
+        return LociSlice(self.loci_path, slice_start, self.offset, min(slice_line, self.line))
 
-    def __del__(self):
-        self.loci_file.close()
+    def get_batch(self, batch_size: int = 10000) -> LociBatch:
+        return read_loci(self.get_slice(batch_size))
 
 
 if __name__ == '__main__':
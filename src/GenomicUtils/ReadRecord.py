@@ -0,0 +1,96 @@
+# cython: language_level=3
+from typing import List, Tuple
+from itertools import chain
+import numpy as np
+from pysam import AlignedSegment
+
+from src.GenomicUtils.CigarOptions import CIGAR_OPTIONS
+
+# cigar ops that advance the position of the following indels (N does not, as it never has in Histogram.calculate_repeat_length)
+POSITION_ADVANCING = (CIGAR_OPTIONS.ALG_MATCH, CIGAR_OPTIONS.SEQ_MATCH, CIGAR_OPTIONS.SEQ_MISMATCH)
+
+
+class ReadRecord:
+    """
+    What a Histogram needs of an aligned read, decoded once by the ReadsFetcher and shared by every locus the read maps to
+    reference_start and reference_end are as in pysam. indels are (position, length) events in reference order:
+    +length at the (1-indexed) position following an insertion, and -length at the first position of a deletion
+    """
+    __slots__ = ['reference_start', 'reference_end', 'flag', 'indels']
+
+    def __init__(self, reference_start: int, reference_end: int, flag: int, indels: tuple):
+        self.reference_start = reference_start
+        self.reference_end = reference_end
+        self.flag = flag
+        self.indels = indels
+
+    @staticmethod
+    def from_read(read: AlignedSegment) -> 'ReadRecord':
+        return ReadRecord(read.reference_start, read.reference_end, read.flag, ReadRecord.indel_events(read))
+
+    @staticmethod
+    def indel_events(read: AlignedSegment) -> tuple:
+        cigar_string = read.cigarstring
+        if 'I' not in cigar_string and 'D' not in cigar_string:  # most reads; cigarstring is much cheaper than cigartuples
+            return ()
+        events = []
+        position = read.reference_start + 1
+        for operation, length in read.cigartuples:
+            if operation in POSITION_ADVANCING:
+                position += length
+            elif operation == CIGAR_OPTIONS.INSERTION:
+                events.append((position, length))
+            elif operation == CIGAR_OPTIONS.DELETION:
+                events.append((position, -length))
+                position += length
+        return tuple(events)
+
+
+class ReadColumns:
+    """
+    What Histograms need of many reads (see ReadRecord) as columns, rather than an object per read: reference_starts and
+    reference_ends of the reads, and the indel events of read i, event_positions and event_lengths[event_offsets[i]:event_offsets[i + 1]]
+    """
+    def __init__(self, reference_starts: np.array, reference_ends: np.array, event_offsets: np.array, event_positions: np.array,
+                 event_lengths: np.array):
+        self.reference_starts = reference_starts
+        self.reference_ends = reference_ends
+        self.event_offsets = event_offsets  # one more than number of reads
+        self.event_positions = event_positions
+        self.event_lengths = event_lengths
+
+    @staticmethod
+    def from_lists(reference_starts: List[int], reference_ends: List[int], event_reads: List[int], events: List[Tuple[int, int]]) -> 'ReadColumns':
+        # events: indel events of reads, in order of read. event_reads: the read of each event
+        event_offsets = np.zeros(len(reference_starts) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.array(event_reads, dtype=np.int64), minlength=len(reference_starts)), out=event_offsets[1:])
+        events = np.array(events, dtype=np.int64).reshape(-1, 2)
+        return ReadColumns(np.array(reference_starts, dtype=np.int64), np.array(reference_ends, dtype=np.int64), event_offsets,
+                           events[:, 0], events[:, 1])
+
+    @staticmethod
+    def from_records(reads: List[ReadRecord]) -> 'ReadColumns':
+        event_reads = [i for i, read in enumerate(reads) for _ in read.indels]
+        return ReadColumns.from_lists([read.reference_start for read in reads], [read.reference_end for read in reads], event_reads,
+                                      list(chain.from_iterable(read.indels for read in reads)))
+
+    def __len__(self):
+        return len(self.reference_starts)
+
+    def spanning(self, starts: np.array, ends: np.array) -> Tuple[np.array, np.array]:
+        """
+        Reads that span [starts[i], ends[i]] (as ReadsFetcher.get_reads), for each i, of reads sorted by reference start
+        :return: number of reads that span each range, and indices of the reads that span each range, concatenated, in order of read
+        """
+        if len(self) == 0:
+            return np.zeros(len(starts), dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # reads that start at or before a range's start, and not so long before it that they end before its end
+        last = np.searchsorted(self.reference_starts, starts - 1, side='right')
+        longest = int((self.reference_ends - self.reference_starts).max())
+        first = np.minimum(np.maximum(np.searchsorted(self.reference_starts, ends - longest, side='left'),
+                                      np.searchsorted(np.maximum.accumulate(self.reference_ends), ends, side='left')), last)
+        num_candidates = last - first
+        candidate_ranges = np.repeat(np.arange(len(starts)), num_candidates)
+        candidates = np.arange(int(num_candidates.sum())) + np.repeat(first - (np.cumsum(num_candidates) - num_candidates), num_candidates)
+        spans = self.reference_ends[candidates] >= ends[candidate_ranges]
+        return np.bincount(candidate_ranges[spans], minlength=len(starts)), candidates[spans]
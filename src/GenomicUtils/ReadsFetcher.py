@@ -1,61 +1,81 @@
 # cython: language_level=3
-from typing import List
+import heapq
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
 from pysam import AlignmentFile, AlignedSegment
 from pysam.libcalignmentfile import IteratorRowRegion
 
 from src.GenomicUtils.AlignmentFlags import FLAG_OPTIONS
+from src.GenomicUtils.CigarOptions import CIGAR_OPTIONS
+from src.GenomicUtils.ReadRecord import ReadRecord, ReadColumns, POSITION_ADVANCING
+from src.GenomicUtils.ContigTable import ContigTable
 
+FILTERED_FLAGS = FLAG_OPTIONS.SECONDARY_ALG | FLAG_OPTIONS.POOR_QUALITY | FLAG_OPTIONS.DUPLICATE_READ | FLAG_OPTIONS.SUPPLEMENTARY_ALG
 
-class ReadsFetcher:
+
+def decode_reads(reads: Iterator[AlignedSegment]) -> ReadColumns:
     """
-    ReadsFetcher fetches reads from the BAM file
-    ReadsFetcher stores what it last returned to a query, and checks these results for candidates for the current query
-    It can miss reads if the loci file is improperly sorted. These parts of the program are fairly tightly coupled, unfortunately
+    Decodes the aligned reads that pass ReadsFetcher.simple_filter into columns, reading only their flag, start, end and
+    cigar (the cigar's operations only for the few reads that have indels), without an object per read
     """
-    def __init__(self, BAM_handle: AlignmentFile, start_chromosome: str):
-        self.BAM_handle = BAM_handle
-        self.chromosome = start_chromosome
-        self.chromosome_prefix = self.get_prefix()
-        self.last_extracted_reads = []
-        self.reads_iterator: IteratorRowRegion = self.BAM_handle.fetch(f"{self.chromosome_prefix}{self.chromosome}", start=10_000, multiple_iterators=False)
-        self.last_unmapped_read: AlignedSegment = self.get_next_mapped_read()  #  will hold last non mapped read to previous query so will not be lost in the iterator
+    reference_starts, reference_ends, event_reads, events = [], [], [], []
+    insertion, deletion = CIGAR_OPTIONS.INSERTION, CIGAR_OPTIONS.DELETION
+    for read in reads:
+        if read.flag & FILTERED_FLAGS:
+            continue
+        reference_end = read.reference_end
+        if reference_end is None:  # unaligned
+            continue
+        reference_start = read.reference_start
+        cigar_string = read.cigarstring
+        if 'I' in cigar_string or 'D' in cigar_string:  # indel events, as ReadRecord.indel_events
+            read_number = len(reference_starts)
+            position = reference_start + 1
+            for operation, length in read.cigartuples:
+                if operation in POSITION_ADVANCING:
+                    position += length
+                elif operation == insertion:
+                    events.append((position, length))
+                    event_reads.append(read_number)
+                elif operation == deletion:
+                    events.append((position, -length))
+                    event_reads.append(read_number)
+                    position += length
+        reference_starts.append(reference_start)
+        reference_ends.append(reference_end)
+    return ReadColumns.from_lists(reference_starts, reference_ends, event_reads, events)
 
-    def get_prefix(self) -> str:
-        """ returns the prefix of contigs in the BAM (ex. Chr, nothing [''], or chr)"""
-        prefixes = ['', 'chr', 'Chr']
-        for prefix in prefixes:
-            try:
-                _ = self.BAM_handle.fetch(f"{prefix}{self.chromosome}", start=10_000, multiple_iterators=False)
-                return prefix
-            except ValueError:  # different prefix
-                continue
-        print("UNKNOWN CHROMOSOME PREFIX FOUND: PLEASE REPORT THIS TO THE DEVELOPERS")
-        raise ValueError
 
-    def reset_iterator(self, chromosome: str, start: int):
-        # changes chromosome and gets new iterator using .bai index file
-        self.chromosome = chromosome
-        self.reads_iterator: IteratorRowRegion = self.BAM_handle.fetch(f"{self.chromosome_prefix}{chromosome}",
-                                                                       start=start, multiple_iterators=False)
-        self.last_unmapped_read = self.get_next_mapped_read()
-        self.last_extracted_reads = []
+class ReadsFetcher:
+    """
+    ReadsFetcher sweeps through the reads of each chromosome once, in the order of the loci file (by chromosome, then locus end)
+    A read joins the active reads when the sweep reaches its start, and leaves once the sweep has passed its end
+    (active reads are kept in order of start, and in a heap by end), so each read is read, filtered and decoded once,
+    and each locus only looks at the active reads. Loci out of order on a chromosome restart its sweep
+    """
+    def __init__(self, BAM_handle: AlignmentFile, contigs: ContigTable = None):
+        self.BAM_handle = BAM_handle
+        self.contigs = contigs if contigs is not None else ContigTable.from_bam(BAM_handle)
+        self.tid = None  # of contig being swept
+        self.reads_iterator: IteratorRowRegion = None
+        self.next_read: AlignedSegment = None  # first read the sweep has not reached yet
+        self.active_reads: Dict[int, ReadRecord] = {}  # number of read in sweep -> read, in order of reference start
+        self.active_ends: List[Tuple[int, int]] = []  # heap of (reference end, number of read in sweep)
+        self.reads_swept = 0
+        self.last_end = -1
 
-    def backtrack_reads(self, start: int, end: int) -> List[AlignedSegment]:
-        # get reads that map from the last query
-        new_last_extracted_reads = []
-        ret = []
-        for read in self.last_extracted_reads:
-            if read.reference_start + 1 <= start and end <= read.reference_end:
-                ret.append(read)
-            elif end <= read.reference_end: # could theoretically map to the next locus if it's start and end are later
-                new_last_extracted_reads.append(read)
-        self.last_extracted_reads = new_last_extracted_reads
-        return ret
+    def start_sweep(self, tid: int, start: int):
+        # sweeps contig from start, using .bai index file
+        self.tid = tid
+        self.reads_iterator = self.BAM_handle.fetch(tid=tid, start=start, multiple_iterators=False)
+        self.next_read = self.get_next_mapped_read()
+        self.active_reads = {}
+        self.active_ends = []
+        self.last_end = -1
 
     @staticmethod
     def simple_filter(read: AlignedSegment) -> bool:
-        return not (read.flag & FLAG_OPTIONS.SECONDARY_ALG or read.flag & FLAG_OPTIONS.POOR_QUALITY
-                    or read.flag & FLAG_OPTIONS.DUPLICATE_READ or read.flag & FLAG_OPTIONS.SUPPLEMENTARY_ALG)
+        return not read.flag & FILTERED_FLAGS
 
     def get_next_mapped_read(self) -> AlignedSegment:
         cur_read = next(self.reads_iterator, None)
@@ -66,44 +86,41 @@ class ReadsFetcher:
                 return cur_read
         return None
 
-    def add_all_mapped(self, mapped_reads: List[AlignedSegment], cur_read: AlignedSegment, start: int, end: int) -> List[AlignedSegment]:
-        # this function is called once we have found the first mapped read and we now add all other mapped reads
-        while cur_read.reference_start + 1 <= start:
+    def sweep_to(self, start: int, end: int):
+        # activates all reads that start at or before start. Reads that end before end can't span this locus or any later one
+        cur_read = self.next_read
+        while cur_read is not None and cur_read.reference_start + 1 <= start:
             if end <= cur_read.reference_end and self.simple_filter(cur_read):
-                mapped_reads.append(cur_read)
+                self.active_reads[self.reads_swept] = ReadRecord.from_read(cur_read)
+                heapq.heappush(self.active_ends, (cur_read.reference_end, self.reads_swept))
+                self.reads_swept += 1
             cur_read = self.get_next_mapped_read()
-            if cur_read is None:  # reads iterator is exhausted
-                break
-        return self.remember_return(mapped_reads, cur_read)
-
-    @staticmethod
-    def strip_chromosome(chromosome: str):
-        """ return chromosome as only its name(ex. chr16 -> 16, chrX -> X) """
-        if chromosome.upper().find("X") != -1:
-            return "X"
-        elif chromosome.upper().find("Y") != -1:
-            return "Y"
-        else:
-            numeric_filter = filter(str.isdigit, chromosome)
-            return "".join(numeric_filter)
+        self.next_read = cur_read
+        while len(self.active_ends) != 0 and self.active_ends[0][0] < end:
+            del self.active_reads[heapq.heappop(self.active_ends)[1]]
 
-    def remember_return(self, mapped_reads: List[AlignedSegment], last_read: AlignedSegment) -> List[AlignedSegment]:
-        #  logs reads for use in for next reads fetch and returns them
-        self.last_unmapped_read = last_read
-        self.last_extracted_reads+=mapped_reads
+    def get_reads(self, contig: str, start: int, end: int) -> List[ReadRecord]:
+        # reads that span [start, end] of contig (as named in loci file), in the order they are in the BAM
+        tid = self.contigs.get_tid(contig)
+        if tid != self.tid or end < self.last_end:
+            self.start_sweep(tid, start)
+        self.last_end = end
+        self.sweep_to(start, end)
+        mapped_reads = []
+        for read in self.active_reads.values():  # all active reads end at or after end
+            if start < read.reference_start + 1:  # from pysam documentation: 'reference_end points to one past the last aligned residue'. Hence, no plus 1 even tho its 0 indexed and phobos is 1 indexed
+                break
+            mapped_reads.append(read)
         return mapped_reads
 
-    def get_reads(self, chromosome, start: int, end: int) -> List[AlignedSegment]:
-        chromosome = self.strip_chromosome(chromosome)
-        if chromosome != self.chromosome or self.last_unmapped_read is None or abs(start - self.last_unmapped_read.reference_start) > 7500:
-            self.reset_iterator(chromosome, start)
-        mapped_reads = self.backtrack_reads(start, end)
-        cur_read = self.last_unmapped_read
-        while cur_read is not None:
-            if start < cur_read.reference_start + 1:
-                return self.remember_return(mapped_reads, cur_read)
-            elif cur_read.reference_start + 1 <= start and end <= cur_read.reference_end: # from pysam documentation: 'reference_end points to one past the last aligned residue'. Hence, no plus 1 even tho its 0 indexed and phobos is 1 indexed
-                return self.add_all_mapped(mapped_reads, cur_read, start, end)
-            else:
-                cur_read = self.get_next_mapped_read()
-        return self.remember_return(mapped_reads, cur_read)
+    def get_block_reads(self, contig: str, starts: np.array, ends: np.array) -> Tuple[ReadColumns, np.array, np.array]:
+        """
+        get_reads for many ranges of contig at once (ex. of a block of loci, in any order): the reads that could span any of
+        them are fetched and decoded once (see decode_reads), and matched to the ranges they span (see ReadColumns.spanning)
+        :return: decoded reads, number of reads spanning each range, and indices of the reads spanning each range, concatenated
+        """
+        self.tid = None  # fetching ends a sweep of get_reads
+        start, stop = max(int(starts.min()) - 1, 0), int(starts.max())  # 0-based: spanning reads overlap [start - 1, start)
+        reads = decode_reads(self.BAM_handle.fetch(tid=self.contigs.get_tid(contig), start=start, stop=max(stop, start + 1),
+                                                   multiple_iterators=False))
+        return (reads,) + reads.spanning(starts, ends)
@@ -0,0 +1,75 @@
+# cython: language_level=3
+import sys, zlib
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+from src.IndelCalling.AlleleSet import AlleleSet
+from src.IndelCalling.Histogram import Histogram
+
+AlleleCacheSettings = namedtuple("AlleleCacheSettings", ["max_entries", "max_memory", "deterministic"])
+DEFAULT_CACHE_SETTINGS = AlleleCacheSettings(max_entries=100_000, max_memory=2*10**8, deterministic=False)  # 200MB
+
+
+class AlleleCache:
+    """
+    LRU cache of called alleles, keyed by everything calculate_alleles depends on (see CallAlleles.allele_cache_key)
+    Bounded by number of entries and by an estimate of the memory the entries use. max_entries=0 disables caching
+    In deterministic mode the EM restarts of a locus are seeded from its key, so an allele set is the same
+    whether it was computed for this locus, taken from the cache, or computed with caching disabled
+    """
+    ENTRY_OVERHEAD = 300  # estimated bytes per entry, besides its key and arrays (OrderedDict node, tuple, floats)
+
+    def __init__(self, settings: AlleleCacheSettings = DEFAULT_CACHE_SETTINGS):
+        self.settings = settings
+        self.max_entries = settings.max_entries
+        self.max_memory = settings.max_memory
+        self.deterministic = settings.deterministic
+        self.entries = OrderedDict()  # key -> (log likelihood, repeat lengths, frequencies, estimated size)
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"allele cache: {len(self)} entries, ~{self.memory // 1000}KB, {self.hits} hits, {self.misses} misses"
+
+    def get(self, key: tuple, histogram: Histogram):
+        # returns cached alleles rebound to given histogram, or None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        log_likelihood, repeat_lengths, frequencies, _ = entry
+        return AlleleSet(histogram=histogram, log_likelihood=log_likelihood, repeat_lengths=repeat_lengths,
+                         frequencies=frequencies, min_read_support=key[-2])
+
+    def put(self, key: tuple, alleles: AlleleSet):
+        if self.max_entries == 0 or key in self.entries:
+            return
+        size = self.ENTRY_OVERHEAD + sys.getsizeof(key[0]) + 2 * len(key[0]) * sys.getsizeof(0) + \
+            alleles.repeat_lengths.nbytes + alleles.frequencies.nbytes
+        self.entries[key] = (alleles.log_likelihood, alleles.repeat_lengths, alleles.frequencies, size)
+        self.memory += size
+        while len(self.entries) > self.max_entries or self.memory > self.max_memory:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory -= evicted[3]
+
+    @staticmethod
+    def random_state(key: tuple) -> np.random.RandomState:
+        # stable across processes and runs, unlike hash()
+        return np.random.RandomState(zlib.crc32(repr(key).encode()))
+
+
+_worker_cache = None
+
+
+def worker_cache(settings: AlleleCacheSettings) -> AlleleCache:
+    # one cache per process, kept between the batches a worker is given
+    global _worker_cache
+    if _worker_cache is None or _worker_cache.settings != settings:
+        _worker_cache = AlleleCache(settings)
+    return _worker_cache
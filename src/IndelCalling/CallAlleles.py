@@ -1,10 +1,24 @@
 # cython: language_level=3
+from typing import List
+from collections import defaultdict, namedtuple
 import scipy.stats as stats
 import numpy as np
 
 from src.IndelCalling.AlleleSet import AlleleSet
+from src.IndelCalling.AlleleCache import AlleleCache
 from src.IndelCalling.Histogram import Histogram
 
+# min_reads: loci with fewer reads in a sample (see Histogram.num_reads) are not called in it; they get no alleles, as loci
+# without supported lengths do. In pair runs, the tumor is not read for loci with fewer reads in the normal
+# skip: rows of loci with fewer than min_reads reads in any sample are left out of outputs
+CoverageFilter = namedtuple("CoverageFilter", ["min_reads", "skip"])
+NO_COVERAGE_FILTER = CoverageFilter(min_reads=0, skip=False)
+
+
+def is_skipped(coverage_filter: CoverageFilter, *histograms: Histogram) -> bool:
+    # whether the row of a locus, with its histogram in each sample, is left out of outputs
+    return coverage_filter.skip and any(histogram.num_reads < coverage_filter.min_reads for histogram in histograms)
+
 
 class AllelesMaximumLikelihood:
     def __init__(self, histogram: Histogram, proper_lengths: np.array, supported_lengths: np.array, noise_table: np.matrix, num_alleles: int):
@@ -84,18 +98,136 @@ class AllelesMaximumLikelihood:
                          repeat_lengths = self.best_alleles, frequencies=self.best_frequencies)
 
 
-def find_alleles(histogram: Histogram, proper_lengths: np.array, supported_repeat_lengths: np.array, noise_table: np.array, min_read_support: int = -1) -> AlleleSet:
-    lesser_alleles_set = AllelesMaximumLikelihood(histogram, proper_lengths, supported_repeat_lengths, noise_table, num_alleles=1).get_alleles()
+class VectorizedAllelesMaximumLikelihood:
+    """
+    Same EM as AllelesMaximumLikelihood, but every restart of every number of alleles (1 to max_alleles) is run at once
+    A run is one restart for one number of alleles of one locus. Intermediates are tensors of shape (run x allele x length),
+    runs with fewer alleles than max_alleles are padded with alleles of frequency 0, which contribute nothing to any sum
+    A batch of loci can be run together if they all have the same number of proper lengths, so no length is ever padded
+    and every sum over lengths is taken exactly as it is for a single locus. Supported lengths are padded per locus, and never chosen
+    Random starting alleles are drawn locus by locus in the same order as the loop implementation, so under a fixed seed the allele set
+    of the first locus (and of every locus, if the batch is a single locus) is the same as the loop implementation's
+    If random_states (one per locus) are given, the starting alleles of each locus are drawn from its own random state instead
+    """
+    def __init__(self, histograms: List[Histogram], proper_lengths: np.array, num_reads: np.array, supported_lengths: np.array,
+                 num_supported: np.array, noise_table: np.matrix, max_alleles: int = 4, restarts: int = 10, random_states: list = None):
+        # proper_lengths and num_reads are loci x length. supported_lengths is loci x candidate, padded after num_supported
+        self.histograms = histograms
+        self.random_states = random_states
+        self.repeat_lengths = proper_lengths
+        self.num_reads = num_reads
+        self.supported_repeat_lengths = supported_lengths
+        self.num_supported = num_supported
+        self.noise_table = noise_table
+        self.restarts = restarts
+        self.allele_counts = np.minimum(num_supported, max_alleles)  # per locus
+        self.max_alleles = int(self.allele_counts.max())
+        self.candidate_mask = np.arange(supported_lengths.shape[1])[None, :] < num_supported[:, None]
+        # log noise of every candidate allele at every length. Shared by all runs and iterations
+        self.log_candidate_noise = np.log(noise_table[supported_lengths[:, :, None], proper_lengths[:, None, :]] + 1e-10)
+
+    @staticmethod
+    def for_locus(histogram: Histogram, proper_lengths: np.array, supported_lengths: np.array, noise_table: np.matrix):
+        num_reads = np.array([histogram.rounded_repeat_lengths[length] for length in proper_lengths], dtype=np.int32)
+        return VectorizedAllelesMaximumLikelihood([histogram], proper_lengths[None, :], num_reads[None, :], supported_lengths[None, :],
+                                                  np.array([supported_lengths.size]), noise_table)
+
+    def initial_guesses(self):
+        # runs are ordered by locus, then number of alleles, then restart, which is the order the loop implementation draws them in
+        run_locus = np.repeat(np.arange(len(self.histograms)), self.allele_counts * self.restarts)
+        run_alleles = np.concatenate([np.repeat(np.arange(1, count + 1), self.restarts) for count in self.allele_counts])
+        if self.random_states is None:
+            draws = [np.random.permutation(self.num_supported[locus])[0:num_alleles] for locus, num_alleles in zip(run_locus.tolist(), run_alleles.tolist())]
+        else:
+            draws = [self.random_states[locus].permutation(self.num_supported[locus])[0:num_alleles] for locus, num_alleles in zip(run_locus.tolist(), run_alleles.tolist())]
+        allele_slots = np.arange(self.max_alleles)[None, :] < run_alleles[:, None]
+        candidate_indices = np.zeros((run_locus.size, self.max_alleles), dtype=np.int64)  # padding alleles are the first supported length
+        candidate_indices[allele_slots] = np.concatenate(draws)
+        alleles = np.take_along_axis(self.supported_repeat_lengths[run_locus], candidate_indices, axis=1)
+        frequencies = np.where(allele_slots, 1 / run_alleles[:, None], 0.0)
+        return alleles, frequencies, run_locus, run_alleles
+
+    @staticmethod
+    def sum_over_lengths(values: np.array) -> np.array:
+        # sums the last axis in length order, like the builtin sum of the loop implementation (np.sum would sum pairwise)
+        total = 0
+        for i in range(values.shape[-1]):
+            total = total + values[..., i]
+        return total
+
+    def log_likelihoods(self, alleles: np.array, frequencies: np.array, run_locus: np.array) -> np.array:
+        noise = self.noise_table[alleles[:, :, None], self.repeat_lengths[run_locus][:, None, :]]  # run x allele x length
+        mixture = np.sum(frequencies[:, :, None] * noise, axis=1)
+        return self.sum_over_lengths(self.num_reads[run_locus] * np.log(mixture + 1e-10))
+
+    def em_step(self, alleles: np.array, frequencies: np.array, run_alleles: np.array, run_locus: np.array):
+        num_reads = self.num_reads[run_locus]
+        noise = self.noise_table[alleles[:, :, None], self.repeat_lengths[run_locus][:, None, :]]  # run x allele x length
+        weighted = noise * frequencies[:, :, None]
+        padding = (np.arange(self.max_alleles)[None, :] < run_alleles[:, None]) * 1e-10
+        Z_i_j = weighted / np.sum(weighted + padding[:, :, None], axis=1)[:, None, :]
+        new_frequencies = np.sum(Z_i_j * num_reads[:, None, :], axis=2) / np.sum(num_reads, axis=1)[:, None]
+        # run x allele x candidate
+        theta_scores = self.sum_over_lengths(Z_i_j[:, :, None, :] * self.log_candidate_noise[run_locus][:, None, :, :] * num_reads[:, None, None, :])
+        theta_scores = np.where(self.candidate_mask[run_locus][:, None, :], theta_scores, -np.inf)
+        new_alleles = np.take_along_axis(self.supported_repeat_lengths[run_locus], theta_scores.argmax(axis=2), axis=1)
+        return new_alleles, new_frequencies
+
+    def get_allele_sets(self) -> List[List[AlleleSet]]:
+        # returns, for every locus, the maximum likelihood AlleleSet for 1, 2, ... max_alleles alleles
+        alleles, frequencies, run_locus, run_alleles = self.initial_guesses()
+        max_log_likelihoods = np.full(run_locus.size, -1e9)
+        prev_log_likelihoods = np.full(run_locus.size, 1e6)
+        active = np.arange(run_locus.size)
+        while active.size != 0:
+            new_alleles, new_frequencies = self.em_step(alleles[active], frequencies[active], run_alleles[active], run_locus[active])
+            alleles[active] = new_alleles
+            frequencies[active] = new_frequencies
+            log_likelihoods = self.log_likelihoods(new_alleles, new_frequencies, run_locus[active])
+            max_log_likelihoods[active] = np.maximum(max_log_likelihoods[active], log_likelihoods)
+            change = np.abs(prev_log_likelihoods[active] - log_likelihoods)
+            prev_log_likelihoods[active] = log_likelihoods
+            active = active[change > 1e-5]
+
+        allele_sets = []
+        first_run = 0
+        for locus, histogram in enumerate(self.histograms):
+            locus_allele_sets = []
+            for count in range(1, self.allele_counts[locus] + 1):
+                runs = slice(first_run, first_run + self.restarts)
+                first_run += self.restarts
+                best_run = max_log_likelihoods[runs].argmax()  # first restart to reach the maximum, as in the loop implementation
+                best_log_likelihood = max_log_likelihoods[runs][best_run]
+                if best_log_likelihood > -1e9:
+                    # the loop implementation keeps the final state of the best restart, not the state at its best iteration
+                    best_alleles = alleles[runs][best_run, :count]
+                    best_frequencies = frequencies[runs][best_run, :count]
+                else:
+                    best_alleles, best_frequencies = np.array([]), np.array([])
+                locus_allele_sets.append(AlleleSet(histogram=histogram, log_likelihood=best_log_likelihood,
+                                                   repeat_lengths=best_alleles, frequencies=best_frequencies))
+            allele_sets.append(locus_allele_sets)
+        return allele_sets
+
+
+def choose_allele_set(allele_set_for, num_supported_lengths: int, min_read_support: int = -1, chi2_density_for=None) -> AlleleSet:
+    # picks the number of alleles using a likelihood ratio test between i-1 and i alleles
+    # allele_set_for(i) returns the maximum likelihood AlleleSet with i alleles. It is only called for the counts that are needed
+    # chi2_density_for(i), if given, returns the already computed chi2 density of the likelihood increase from i-1 to i alleles
+    lesser_alleles_set = allele_set_for(1)
     lesser_alleles_set.min_read_support = min_read_support
     for i in range(2, 5):
-        greater_alleles_set = AllelesMaximumLikelihood(histogram, proper_lengths, supported_repeat_lengths, noise_table, num_alleles=i).get_alleles()
+        greater_alleles_set = allele_set_for(i)
         greater_alleles_set.min_read_support = min_read_support
         likelihood_increase = 2 * (greater_alleles_set.log_likelihood - lesser_alleles_set.log_likelihood)
         if likelihood_increase > 0:
-            p_value_i_alleles = stats.chi2.pdf(likelihood_increase, 2)
+            if chi2_density_for is None:
+                p_value_i_alleles = stats.chi2.pdf(likelihood_increase, 2)
+            else:
+                p_value_i_alleles = chi2_density_for(i)
             if p_value_i_alleles > 0.05:
                 return lesser_alleles_set
-            elif len(supported_repeat_lengths) == i:
+            elif num_supported_lengths == i:
                 return greater_alleles_set
             else:
                 lesser_alleles_set = greater_alleles_set
@@ -104,6 +236,18 @@ def find_alleles(histogram: Histogram, proper_lengths: np.array, supported_repea
     return lesser_alleles_set
 
 
+def find_alleles(histogram: Histogram, proper_lengths: np.array, supported_repeat_lengths: np.array, noise_table: np.array, min_read_support: int = -1) -> AlleleSet:
+    # original loop implementation. Kept as the reference for VectorizedAllelesMaximumLikelihood
+    def allele_set_for(num_alleles: int) -> AlleleSet:
+        return AllelesMaximumLikelihood(histogram, proper_lengths, supported_repeat_lengths, noise_table, num_alleles=num_alleles).get_alleles()
+    return choose_allele_set(allele_set_for, len(supported_repeat_lengths), min_read_support)
+
+
+def find_alleles_vectorized(histogram: Histogram, proper_lengths: np.array, supported_repeat_lengths: np.array, noise_table: np.array, min_read_support: int = -1) -> AlleleSet:
+    allele_sets = VectorizedAllelesMaximumLikelihood.for_locus(histogram, proper_lengths, supported_repeat_lengths, noise_table).get_allele_sets()[0]
+    return choose_allele_set(lambda num_alleles: allele_sets[num_alleles-1], len(supported_repeat_lengths), min_read_support)
+
+
 def repeat_threshold(ms_length: int):
     # number of repeats necessary for microsatellite of given length to be considered
     if ms_length == 1:
@@ -118,14 +262,108 @@ def passes_filter(motif_length: int, repeat_size: float):
     return repeat_threshold(motif_length) <= repeat_size <= 40
 
 
-def calculate_alleles(histogram: Histogram, noise_table: np.array, required_read_support):
+def proper_and_supported_lengths(histogram: Histogram, required_read_support):
     proper_motif_sizes = np.array([repeat_size for repeat_size in histogram.rounded_repeat_lengths if
                                          passes_filter(len(histogram.locus.pattern), repeat_size)])
     supported_proper_motifs = np.array([length for length in proper_motif_sizes
                                         if histogram.rounded_repeat_lengths[length]>=required_read_support])
+    return proper_motif_sizes, supported_proper_motifs
+
+
+def trivial_alleles(histogram: Histogram, supported_proper_motifs: np.array, required_read_support) -> AlleleSet:
+    # alleles of a locus with 0 or 1 supported lengths, which need no EM
     if supported_proper_motifs.size == 0:
         return AlleleSet(histogram, log_likelihood=-1, repeat_lengths=np.array([]), frequencies=np.array([-1]), min_read_support=required_read_support)
-    elif supported_proper_motifs.size == 1:
+    else:
         return AlleleSet(histogram=histogram,  log_likelihood=0, repeat_lengths=np.array(list(supported_proper_motifs)), frequencies=np.array([1]), min_read_support=required_read_support)
+
+
+def calculate_alleles(histogram: Histogram, noise_table: np.array, required_read_support):
+    proper_motif_sizes, supported_proper_motifs = proper_and_supported_lengths(histogram, required_read_support)
+    if supported_proper_motifs.size < 2:
+        return trivial_alleles(histogram, supported_proper_motifs, required_read_support)
     else:
-        return find_alleles(histogram, proper_motif_sizes, supported_proper_motifs, noise_table, required_read_support)
+        return find_alleles_vectorized(histogram, proper_motif_sizes, supported_proper_motifs, noise_table, required_read_support)
+
+
+def allele_cache_key(histogram: Histogram, proper_motif_sizes: np.array, required_read_support) -> tuple:
+    # everything the alleles of a locus depend on. Lengths that fail the motif length filter are never used, so only the
+    # filter's threshold is part of the key. Lengths are sorted, so the key doesn't depend on the order reads were added in
+    return (tuple(sorted((int(length), histogram.rounded_repeat_lengths[length]) for length in proper_motif_sizes)),
+            repeat_threshold(len(histogram.locus.pattern)), required_read_support, histogram.integer_indels_only)
+
+
+def calculate_alleles_batch(histograms: List[Histogram], noise_table: np.array, required_read_support, max_batch_size: int = 512,
+                            cache: AlleleCache = None, min_reads: int = 0) -> List[AlleleSet]:
+    """
+    calculate_alleles for many loci at once. Loci that need the EM are grouped by their number of proper lengths,
+    and each group is run as padded (locus x length) and (locus x supported length) matrices in one VectorizedAllelesMaximumLikelihood
+    (at most max_batch_size loci at a time, to bound the size of the intermediate tensors)
+    If a cache is given, loci whose key is cached (or repeats an earlier locus of the batch) skip the EM
+    Loci with fewer than min_reads reads (see CoverageFilter), or than required_read_support (so none of their lengths is
+    supported), get no alleles without their lengths being looked at
+    """
+    uncalled_below = max(min_reads, required_read_support)
+    no_lengths = np.array([])
+    results: List[AlleleSet] = [None] * len(histograms)
+    em_loci = defaultdict(list)  # number of proper lengths -> indices of loci
+    proper_lengths = []
+    supported_lengths = []
+    keys = []
+    first_with_key = {}  # key -> index of the first locus in the batch to need it
+    repeated_loci = []
+    for i, histogram in enumerate(histograms):
+        key = None
+        if histogram.num_reads < uncalled_below:
+            proper_motif_sizes, supported_proper_motifs = no_lengths, no_lengths
+        else:
+            proper_motif_sizes, supported_proper_motifs = proper_and_supported_lengths(histogram, required_read_support)
+        if supported_proper_motifs.size < 2:
+            results[i] = trivial_alleles(histogram, supported_proper_motifs, required_read_support)
+        elif cache is not None:
+            key = allele_cache_key(histogram, proper_motif_sizes, required_read_support)
+            if cache.deterministic:  # canonical order, so the result depends on the key alone
+                proper_motif_sizes, supported_proper_motifs = np.sort(proper_motif_sizes), np.sort(supported_proper_motifs)
+            if key in first_with_key:
+                repeated_loci.append(i)
+            else:
+                results[i] = cache.get(key, histogram)
+                if results[i] is None:
+                    first_with_key[key] = i
+                    em_loci[proper_motif_sizes.size].append(i)
+        else:
+            em_loci[proper_motif_sizes.size].append(i)
+        proper_lengths.append(proper_motif_sizes)
+        supported_lengths.append(supported_proper_motifs)
+        keys.append(key)
+
+    for num_lengths, loci in em_loci.items():
+        for batch_start in range(0, len(loci), max_batch_size):
+            batch = loci[batch_start:batch_start + max_batch_size]
+            num_supported = np.array([supported_lengths[i].size for i in batch])
+            padded_proper = np.array([proper_lengths[i] for i in batch])
+            padded_reads = np.array([[histograms[i].rounded_repeat_lengths[length] for length in proper_lengths[i]] for i in batch], dtype=np.int32)
+            padded_supported = np.zeros((len(batch), num_supported.max()), dtype=padded_proper.dtype)
+            for row, i in enumerate(batch):
+                padded_supported[row, :] = supported_lengths[i][0]
+                padded_supported[row, :num_supported[row]] = supported_lengths[i]
+            random_states = [cache.random_state(keys[i]) for i in batch] if cache is not None and cache.deterministic else None
+            allele_sets = VectorizedAllelesMaximumLikelihood([histograms[i] for i in batch], padded_proper, padded_reads, padded_supported,
+                                                             num_supported, noise_table, random_states=random_states).get_allele_sets()
+            # chi2 densities of every likelihood increase in the batch, in one call
+            likelihood_increases = [2 * (locus_sets[j].log_likelihood - locus_sets[j-1].log_likelihood)
+                                    for locus_sets in allele_sets for j in range(1, len(locus_sets))]
+            densities = stats.chi2.pdf(np.array(likelihood_increases), 2)
+            first_density = np.cumsum([0] + [len(locus_sets) - 1 for locus_sets in allele_sets])
+            for row, i in enumerate(batch):
+                results[i] = choose_allele_set(lambda num_alleles: allele_sets[row][num_alleles-1], num_supported[row], required_read_support,
+                                               lambda num_alleles: densities[first_density[row] + num_alleles - 2])
+                if cache is not None:
+                    cache.put(keys[i], results[i])
+
+    for i in repeated_loci:
+        first = results[first_with_key[keys[i]]]
+        cache.hits += 1
+        results[i] = AlleleSet(histogram=histograms[i], log_likelihood=first.log_likelihood, repeat_lengths=first.repeat_lengths,
+                               frequencies=first.frequencies, min_read_support=required_read_support)
+    return results
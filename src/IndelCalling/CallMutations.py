@@ -1,4 +1,6 @@
 # cython: language_level=3
+from typing import List
+from collections import namedtuple
 import numpy as np
 from scipy.stats import binom
 
@@ -13,9 +15,19 @@ from src.IndelCalling.AICs import AICs
 # ex. (5.0_4, 6.0_5) and (3.0_2, 5.0_1) -> first_set = [0, 4, 5], second_set = [2, 0, 1]
 from src.IndelCalling.hist2vecs import hist2vecs
 
+# LOR_ratio: how much lower (better) the AIC of a sample's histogram must be with the other sample's alleles than its own
+# fisher_threshold: p-value of Fisher's exact test below which tumor and normal histograms differ
+# p_equal: binomial p-value below which the support of two normal alleles is too unequal to call (INS)
+MutationThresholds = namedtuple("MutationThresholds", ["LOR_ratio", "fisher_threshold", "p_equal"])
+DEFAULT_THRESHOLDS = MutationThresholds(LOR_ratio=8.0, fisher_threshold=0.031, p_equal=0.3)
+
+
+def equal_support_p_value(first_allele_reads: int, second_allele_reads: int) -> float:
+    return binom.cdf(min(first_allele_reads, second_allele_reads), first_allele_reads + second_allele_reads, 0.5)
+
 
 def cdf_test(first_allele_reads: int, second_allele_reads: int, p_equal: float = 0.3):
-    p = binom.cdf(min(first_allele_reads, second_allele_reads), first_allele_reads + second_allele_reads, 0.5)
+    p = equal_support_p_value(first_allele_reads, second_allele_reads)
     if p < p_equal:
         return MutationCall.INSUFFICIENT
     else:
@@ -89,13 +101,15 @@ def equivalent_arrays(a: np.array, b: np.array) -> bool:
     return (a_sorted == b_sorted).all()
 
 
-def call_mutations(normal_alleles: AlleleSet, tumor_alleles: AlleleSet, noise_table: np.array, fisher_calculator: Fisher) -> MutationCall:
+def call_mutations(normal_alleles: AlleleSet, tumor_alleles: AlleleSet, noise_table: np.array, fisher_calculator: Fisher,
+                   thresholds: MutationThresholds = DEFAULT_THRESHOLDS) -> MutationCall:
     if len(normal_alleles) == 0 or len(tumor_alleles) == 0:
         return MutationCall(MutationCall.NO_ALLELES, normal_alleles, tumor_alleles, AICs())
     elif equivalent_arrays(normal_alleles.repeat_lengths, tumor_alleles.repeat_lengths):
         return MutationCall(MutationCall.NOT_MUTATION, normal_alleles, tumor_alleles, AICs())
     else:
-        return call_decision(normal_alleles, tumor_alleles, noise_table, fisher_calculator)
+        return call_decision(normal_alleles, tumor_alleles, noise_table, fisher_calculator, thresholds.LOR_ratio, thresholds.p_equal,
+                             thresholds.fisher_threshold)
 
 
 def is_possible_mutation(normal_alleles: AlleleSet, p_equal = 0.3) -> bool:
@@ -156,3 +170,85 @@ def call_verified_locus(normal_alleles: AlleleSet, tumor_alleles: AlleleSet, noi
             return MutationCall(MutationCall.BORDERLINE_NONMUTATION, normal_alleles, tumor_alleles, aic_values, p_value)
     else:
         return MutationCall(MutationCall.NOT_MUTATION, normal_alleles, tumor_alleles, aic_values)
+
+
+class LocusTests:
+    """
+    The statistics call_mutations decides a locus's call by, each calculated the first time a call needs it, so calls of
+    the same locus under many MutationThresholds (see sweep_calls) share them
+    """
+    def __init__(self, normal_alleles: AlleleSet, tumor_alleles: AlleleSet, noise_table: np.array, fisher_calculator: Fisher):
+        self.normal_alleles = normal_alleles
+        self.tumor_alleles = tumor_alleles
+        self.noise_table = noise_table
+        self.fisher_calculator = fisher_calculator
+        self._equal_support_p_value = None
+        self._aic_values = None
+        self._p_value = None
+        self._ref_removed = None  # tumor alleles without reference length, whether they are the normal alleles, and their AICs
+        self._ref_removed_p_value = None
+
+    def equal_support_p_value(self) -> float:
+        if self._equal_support_p_value is None:
+            first_allele, second_allele = self.normal_alleles.repeat_lengths[0], self.normal_alleles.repeat_lengths[1]
+            self._equal_support_p_value = equal_support_p_value(self.normal_alleles.histogram.repeat_lengths[first_allele],
+                                                                self.normal_alleles.histogram.repeat_lengths[second_allele])
+        return self._equal_support_p_value
+
+    def aic_values(self) -> AICs:
+        if self._aic_values is None:
+            self._aic_values = calculate_AICs(self.normal_alleles, self.tumor_alleles, self.noise_table)
+        return self._aic_values
+
+    def p_value(self) -> float:
+        if self._p_value is None:
+            self._p_value = fisher_test(self.normal_alleles, self.tumor_alleles, self.fisher_calculator)
+        return self._p_value
+
+    def ref_removed(self):
+        if self._ref_removed is None:
+            tumor_alleles_ref_removed = reconstruct_tumor_alleles_without_reference_length(self.tumor_alleles, self.noise_table,
+                                                                                            self.tumor_alleles.histogram.integer_indels_only)
+            equivalent = equivalent_arrays(self.normal_alleles.repeat_lengths, tumor_alleles_ref_removed.repeat_lengths)
+            aic_values = None if equivalent else calculate_AICs(self.normal_alleles, tumor_alleles_ref_removed, self.noise_table)
+            self._ref_removed = (tumor_alleles_ref_removed, equivalent, aic_values)
+        return self._ref_removed
+
+    def ref_removed_p_value(self) -> float:
+        if self._ref_removed_p_value is None:
+            self._ref_removed_p_value = fisher_test(self.normal_alleles, self.ref_removed()[0], self.fisher_calculator)
+        return self._ref_removed_p_value
+
+    def reversion_to_reference(self, thresholds: MutationThresholds) -> bool:
+        # as reversion_to_reference
+        if self.normal_alleles.histogram.locus.repeats not in self.tumor_alleles.repeat_lengths:
+            return False
+        _, equivalent, aic_values = self.ref_removed()
+        if equivalent or not passes_AICs(aic_values, thresholds.LOR_ratio):
+            return True
+        return not self.ref_removed_p_value() < thresholds.fisher_threshold
+
+    def call(self, thresholds: MutationThresholds) -> int:
+        # MutationCall.call of call_mutations(normal_alleles, tumor_alleles, noise_table, fisher_calculator, thresholds)
+        if len(self.normal_alleles) == 0 or len(self.tumor_alleles) == 0:
+            return MutationCall.NO_ALLELES
+        if equivalent_arrays(self.normal_alleles.repeat_lengths, self.tumor_alleles.repeat_lengths):
+            return MutationCall.NOT_MUTATION
+        if len(self.normal_alleles.repeat_lengths) > 2:
+            return MutationCall.TOO_MANY_ALLELES
+        if len(self.normal_alleles.repeat_lengths) == 2 and self.equal_support_p_value() < thresholds.p_equal:
+            return MutationCall.INSUFFICIENT
+        if not passes_AICs(self.aic_values(), thresholds.LOR_ratio):
+            return MutationCall.NOT_MUTATION
+        if not self.p_value() < thresholds.fisher_threshold:
+            return MutationCall.BORDERLINE_NONMUTATION
+        if self.reversion_to_reference(thresholds):
+            return MutationCall.REVERTED_TO_REFERENCE
+        return MutationCall.MUTATION
+
+
+def sweep_calls(normal_alleles: AlleleSet, tumor_alleles: AlleleSet, noise_table: np.array, fisher_calculator: Fisher,
+                thresholds: List[MutationThresholds]) -> List[int]:
+    # MutationCall.call of the locus under each of thresholds, with each of its tests run at most once
+    tests = LocusTests(normal_alleles, tumor_alleles, noise_table, fisher_calculator)
+    return [tests.call(locus_thresholds) for locus_thresholds in thresholds]
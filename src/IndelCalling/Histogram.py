@@ -1,12 +1,56 @@
 # cython: language_level=3
 from typing import Dict, List
-from collections import defaultdict
+from itertools import chain
+from collections import defaultdict, Counter
+import numpy as np
 from pysam import AlignedSegment
 
 from src.Entry.FormatUtil import format_list
 from src.GenomicUtils.CigarOptions import CIGAR_OPTIONS
+from src.GenomicUtils.ReadRecord import ReadRecord, ReadColumns
 from src.IndelCalling.Locus import Locus
 
+def locus_indel_bases(positions: np.array, lengths: np.array, locus_starts: np.array, locus_ends: np.array) -> np.array:
+    # bases each indel event (see ReadRecord) adds to (+) or removes from (-) its locus, as in Histogram.calculate_repeat_length:
+    # insertions count if they are inside the locus, deletions count for the part of them that overlaps it
+    deleted = np.minimum(locus_ends - positions + 1, np.where(positions < locus_starts, np.maximum(positions - lengths - locus_starts, 0), -lengths))
+    return np.where(lengths > 0, np.where((locus_starts <= positions) & (positions <= locus_ends), lengths, 0),
+                    np.where(positions <= locus_ends, -deleted, 0))
+
+
+def add_reads_batch(histograms: List['Histogram'], reads: List[List[ReadRecord]]) -> None:
+    # Histogram.add_reads for many histograms (reads[i] are added to histograms[i]), with the indel events of all reads in one pass
+    num_reads = np.array([len(histogram_reads) for histogram_reads in reads], dtype=np.int64)
+    all_reads = list(chain.from_iterable(reads))
+    add_read_columns_batch(histograms, ReadColumns.from_records(all_reads), num_reads, np.arange(len(all_reads)))
+
+
+def add_read_columns_batch(histograms: List['Histogram'], reads: ReadColumns, num_reads: np.array, histogram_reads: np.array) -> None:
+    """
+    add_reads_batch for reads decoded into columns (see ReadsFetcher.get_block_reads): the reads of histograms[i] are
+    reads histogram_reads[sum(num_reads[:i]):sum(num_reads[:i + 1])]. A read can be in several histograms
+    """
+    if len(histogram_reads) == 0:
+        return
+    read_histograms = np.repeat(np.arange(len(histograms)), num_reads)
+    num_events = reads.event_offsets[histogram_reads + 1] - reads.event_offsets[histogram_reads]
+    indel_bases = np.zeros(len(histogram_reads), dtype=np.int64)
+    if num_events.sum() != 0:
+        event_reads = np.repeat(np.arange(len(histogram_reads)), num_events)  # of histogram_reads
+        events = np.arange(int(num_events.sum())) + np.repeat(reads.event_offsets[histogram_reads] - (np.cumsum(num_events) - num_events), num_events)
+        event_loci = read_histograms[event_reads]
+        locus_starts = np.array([histogram.locus.start for histogram in histograms], dtype=np.int64)
+        locus_ends = np.array([histogram.locus.end for histogram in histograms], dtype=np.int64)
+        event_bases = locus_indel_bases(reads.event_positions[events], reads.event_lengths[events], locus_starts[event_loci], locus_ends[event_loci])
+        indel_bases = np.bincount(event_reads, weights=event_bases, minlength=len(histogram_reads)).astype(np.int64)
+    locus_repeats = np.array([histogram.locus.repeats for histogram in histograms], dtype=np.float64)
+    pattern_lengths = np.array([len(histogram.locus.pattern) for histogram in histograms], dtype=np.int64)
+    repeat_lengths = (locus_repeats[read_histograms] + indel_bases / pattern_lengths[read_histograms]).tolist()
+    first_read = 0
+    for histogram, histogram_num_reads in zip(histograms, num_reads.tolist()):
+        histogram.add_repeat_lengths(repeat_lengths[first_read:first_read + histogram_num_reads])
+        first_read += histogram_num_reads
+
 
 class Histogram:
     def __init__(self, locus: Locus, integer_indels_only: bool):
@@ -17,6 +61,7 @@ class Histogram:
         self.integer_indels_only = integer_indels_only
 
     def calculate_repeat_length(self, read: AlignedSegment) -> float:
+        # repeat length of one read, from its cigar. add_reads_batch calculates the same from ReadRecord indel events
         read_position = read.reference_start+1
         indel_bases = 0 # number of added/deleted bases in MS locus
         for cigar_op in read.cigartuples:
@@ -56,10 +101,16 @@ class Histogram:
                 read_position+=cigar_op[1]
         return max(self.locus.repeats + indel_bases/len(self.locus.pattern), 0) # so is never negative
 
-    def add_reads(self, reads: List[AlignedSegment]) -> None:
-        for read in reads:
-            repeat_length = self.calculate_repeat_length(read)
-            self.repeat_lengths[repeat_length]+=1
+    def add_repeat_lengths(self, repeat_lengths: List[float]) -> None:
+        if len(repeat_lengths) == 0:
+            return
+        if min(repeat_lengths) < 0:
+            repeat_lengths = [max(repeat_length, 0) for repeat_length in repeat_lengths]  # so is never negative (int 0, as in calculate_repeat_length)
+        for repeat_length, count in Counter(repeat_lengths).items():  # first seen first, so ties in __str__ are ordered as reads are
+            self.repeat_lengths[repeat_length] += count
+
+    def add_reads(self, reads: List[ReadRecord]) -> None:
+        add_reads_batch([self], [reads])
 
     def build_rounded(self):
 
@@ -78,6 +129,11 @@ class Histogram:
                 self._rounded_repeats[round(length)] += self.repeat_lengths[length]
         self.built_rounded = True
 
+    @property
+    def num_reads(self) -> int:
+        # reads that span the locus (its coverage)
+        return sum(self.repeat_lengths.values())
+
     @property
     def rounded_repeat_lengths(self) -> defaultdict:
         # round all repeat lengths in histogram to nearest integer
@@ -0,0 +1,58 @@
+# cython: language_level=3
+import math
+from functools import lru_cache
+from typing import Tuple
+import numpy as np
+from scipy.stats import ks_2samp, distributions
+
+from src.IndelCalling.Histogram import Histogram
+
+try:
+    from scipy.stats._stats_py import _attempt_exact_2kssamp  # private, so may move between scipy versions
+except ImportError:
+    _attempt_exact_2kssamp = None
+
+MAX_EXACT_N = 10_000  # as in ks_2samp(method='auto'): exact p-value if both samples are at most this size
+
+
+def hist2counts(histogram_a: Histogram, histogram_b: Histogram) -> Tuple[np.array, np.array, np.array]:
+    # ex. (5_4, 6_5) and (3_2, 5_1) -> lengths = [3, 5, 6], counts_a = [0, 4, 5], counts_b = [2, 1, 0]
+    lengths = np.array(sorted(set(histogram_a.rounded_repeat_lengths) | set(histogram_b.rounded_repeat_lengths)))
+    counts_a = np.array([histogram_a.rounded_repeat_lengths.get(length, 0) for length in lengths], dtype=np.int64)
+    counts_b = np.array([histogram_b.rounded_repeat_lengths.get(length, 0) for length in lengths], dtype=np.int64)
+    return lengths, counts_a, counts_b
+
+
+def ks_statistic(counts_a: np.array, counts_b: np.array) -> float:
+    # largest distance between the ECDFs of two samples given as read counts over the same sorted lengths
+    # same arithmetic as ks_2samp on the expanded samples (count of values <= x, divided by sample size)
+    cdf_differences = np.cumsum(counts_a) / counts_a.sum() - np.cumsum(counts_b) / counts_b.sum()
+    max_difference = cdf_differences.max()
+    min_difference = np.clip(-cdf_differences.min(), 0, 1)
+    return min_difference if min_difference > max_difference else max_difference
+
+
+@lru_cache(maxsize=100_000)
+def ks_p_value(n1: int, n2: int, d: float) -> Tuple[float, float]:
+    # two sided p-value of ks_2samp, which depends only on the sample sizes and the statistic
+    # returns the p-value and the statistic as ks_2samp reports it (the exact method rounds it to a multiple of 1/lcm(n1, n2))
+    if max(n1, n2) <= MAX_EXACT_N:
+        success, d, prob = _attempt_exact_2kssamp(n1, n2, math.gcd(n1, n2), d, 'two-sided')
+        if success:
+            return np.clip(prob, 0, 1), np.float64(d)
+    # ks_2samp switches to the asymptotic distribution (with a warning) when the exact calculation fails
+    m, n = sorted([float(n1), float(n2)], reverse=True)
+    return np.clip(distributions.kstwo.sf(d, np.round(m * n / (m + n))), 0, 1), np.float64(d)
+
+
+def ks_test(histogram_a: Histogram, histogram_b: Histogram) -> Tuple[float, float]:
+    # same p-value and statistic as ks_2samp(*hist2samps(histogram_a, histogram_b)), without expanding histograms into reads
+    # returns -1, -1 if either histogram is empty
+    lengths, counts_a, counts_b = hist2counts(histogram_a, histogram_b)
+    n1, n2 = int(counts_a.sum()), int(counts_b.sum())
+    if n1 == 0 or n2 == 0:
+        return -1, -1
+    if _attempt_exact_2kssamp is None:
+        ks_test_result = ks_2samp(np.repeat(lengths, counts_a), np.repeat(lengths, counts_b))
+        return ks_test_result.pvalue, ks_test_result.statistic
+    return ks_p_value(n1, n2, float(ks_statistic(counts_a, counts_b)))
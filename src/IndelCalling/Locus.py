@@ -1,10 +1,33 @@
 # cython: language_level=3
+from functools import lru_cache
+from typing import List
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def parse_chromosome(chromosome: str) -> str:
+    if len(chromosome) < 3:
+        return chromosome
+    else:
+        tokens = list(chromosome)
+        numerical_chromosome = ''.join([token for token in tokens if token.isdigit()])
+        if len(numerical_chromosome) != 0:
+            return numerical_chromosome
+        else:
+            if chromosome[-1].upper() == 'X' or chromosome[-1].upper() == 'Y' or chromosome[-1].upper() == 'M':
+                return chromosome[-1].upper()
+            else:
+                raise RuntimeError(f"Could not parse locus with chromosome {chromosome}")
+
 
 class Locus:
+    __slots__ = ['chromosome', 'contig', 'start', 'end', 'pattern', 'sequence', 'repeats']
+
     def __init__(self, chromosome: str,  start: int,  end: int,  pattern: str,  repeats: float, sequence: str):
         self.chromosome = self.parse_chromosome(chromosome)
         if self.chromosome is None:
             raise RuntimeError(f"couldn't parse chromosome: {chromosome}")
+        self.contig = chromosome  # as named in loci file, which the ContigTable of each BAM resolves
         self.start = start
         self.end = end
         self.pattern = pattern
@@ -13,22 +36,79 @@ class Locus:
 
     @staticmethod
     def parse_chromosome(chromosome: str) -> str:
-        if len(chromosome) < 3:
-            return chromosome
-        else:
-            tokens = list(chromosome)
-            numerical_chromosome = ''.join([token for token in tokens if token.isdigit()])
-            if len(numerical_chromosome) != 0:
-                return numerical_chromosome
-            else:
-                if chromosome[-1].upper() == 'X' or chromosome[-1].upper() == 'Y' or chromosome[-1].upper() == 'M':
-                    return chromosome[-1].upper()
-                else:
-                    raise RuntimeError(f"Could not parse locus with chromosome {chromosome}")
+        # parsed once per distinct chromosome name
+        return parse_chromosome(chromosome)
 
     def __str__(self):
         return f"{self.chromosome}\t{self.start}\t{self.end}\t{self.pattern}\t{self.sequence}\t{self.repeats}"
 
     @staticmethod
     def header():
-        return "CHROMOSOME\tSTART\tEND\tPATTERN\tREFERENCE_SEQUENCE\tREFERENCE_REPEATS"
\ No newline at end of file
+        return "CHROMOSOME\tSTART\tEND\tPATTERN\tREFERENCE_SEQUENCE\tREFERENCE_REPEATS"
+
+
+class LociBatch:
+    """
+    Loci of a batch stored as columns, rather than as a Locus object each: chromosomes and patterns are codes into tables
+    of names, and sequences are (utf-8) bytes concatenated into one array, with each locus's at sequence_offsets[i:i+2]
+    Behaves as a read only list of loci. Slices are views of the same columns, and Locus objects are only made for the
+    loci being iterated over (or indexed), so a worker holds its whole batch compactly and objects for a block at a time
+    first_line is the line (0-indexed) of the first locus in the loci file, which numbers loci in histogram catalogs
+    """
+    def __init__(self, chromosome_names: List[str], chromosomes: np.array, starts: np.array, ends: np.array, repeats: np.array,
+                 pattern_names: List[str], patterns: np.array, sequences: np.array, sequence_offsets: np.array, first_line: int = 0):
+        self.chromosome_names = chromosome_names
+        self.chromosomes = chromosomes
+        self.starts = starts
+        self.ends = ends
+        self.repeats = repeats
+        self.pattern_names = pattern_names
+        self.patterns = patterns
+        self.sequences = sequences
+        self.sequence_offsets = sequence_offsets  # one more than number of loci
+        self.first_line = first_line
+
+    @staticmethod
+    def from_fields(loci_fields: List[List[str]], first_line: int = 0) -> 'LociBatch':
+        # from fields of loci file lines: chromosome, start, end, repeats, pattern and sequence are fields 0, 3, 4, 6, 12 and 13
+        chromosome_codes, pattern_codes = {}, {}
+        chromosomes = np.array([chromosome_codes.setdefault(fields[0], len(chromosome_codes)) for fields in loci_fields], dtype=np.int32)
+        patterns = np.array([pattern_codes.setdefault(fields[12], len(pattern_codes)) for fields in loci_fields], dtype=np.int32)
+        sequences = [fields[13].encode() for fields in loci_fields]
+        sequence_offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(sequence) for sequence in sequences], dtype=np.int64), out=sequence_offsets[1:])
+        return LociBatch(list(chromosome_codes), chromosomes, np.array([int(fields[3]) for fields in loci_fields], dtype=np.int64),
+                         np.array([int(fields[4]) for fields in loci_fields], dtype=np.int64),
+                         np.array([float(fields[6]) for fields in loci_fields], dtype=np.float64), list(pattern_codes), patterns,
+                         np.frombuffer(b"".join(sequences), dtype=np.uint8), sequence_offsets, first_line)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("LociBatch only supports contiguous slices")
+            stop = max(start, stop)
+            return LociBatch(self.chromosome_names, self.chromosomes[start:stop], self.starts[start:stop], self.ends[start:stop],
+                             self.repeats[start:stop], self.pattern_names, self.patterns[start:stop], self.sequences,
+                             self.sequence_offsets[start:stop + 1], self.first_line + start)
+        if not -len(self) <= index < len(self):
+            raise IndexError("LociBatch index out of range")
+        index %= len(self)
+        return next(iter(self[index:index + 1]))
+
+    def lines(self) -> np.array:
+        # lines of the loci in the loci file
+        return np.arange(self.first_line, self.first_line + len(self), dtype=np.int64)
+
+    def __iter__(self):
+        first_sequence = int(self.sequence_offsets[0])
+        sequences = self.sequences[first_sequence:int(self.sequence_offsets[-1])].tobytes()
+        sequence_offsets = (self.sequence_offsets - first_sequence).tolist()
+        chromosome_names, pattern_names = self.chromosome_names, self.pattern_names
+        for i, (chromosome, start, end, repeats, pattern) in enumerate(zip(self.chromosomes.tolist(), self.starts.tolist(), self.ends.tolist(),
+                                                                           self.repeats.tolist(), self.patterns.tolist())):
+            yield Locus(chromosome=chromosome_names[chromosome], start=start, end=end, pattern=pattern_names[pattern], repeats=repeats,
+                        sequence=sequences[sequence_offsets[i]:sequence_offsets[i + 1]].decode())
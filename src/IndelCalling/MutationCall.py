@@ -1,9 +1,8 @@
-from typing import Tuple
+from typing import Tuple, Collection
 
-from scipy.stats import ks_2samp
 from src.IndelCalling.AlleleSet import AlleleSet
 from src.IndelCalling.AICs import AICs
-from src.IndelCalling.hist2vecs import hist2samps
+from src.IndelCalling.KSTest import ks_test
 
 
 class MutationCall:
@@ -29,7 +28,8 @@ class MutationCall:
         else:
             return str(self.p_value)
 
-    def call_abbreviation(self, call: int) -> str:
+    @staticmethod
+    def call_abbreviation(call: int) -> str:
         abbreviations = {
                          MutationCall.REVERTED_TO_REFERENCE: "RR",
                          MutationCall.NO_ALLELES: "AN", # either tumor or normal lacks alleles
@@ -41,18 +41,19 @@ class MutationCall:
         return abbreviations[call]
 
     def ks_test_value(self) -> Tuple[float, float]:
-        reads_samps = hist2samps(self.tumor_alleles.histogram, self.normal_alleles.histogram)  # order is important for Fisher test
-        if len(reads_samps[0]) == 0 or len(reads_samps[1])== 0:
-            return -1, -1
-        else:
-            ks_test_result = ks_2samp(reads_samps[0], reads_samps[1])
-            return ks_test_result.pvalue, ks_test_result.statistic
-
+        return ks_test(self.tumor_alleles.histogram, self.normal_alleles.histogram)
 
     @staticmethod
     def header():
         return f"CALL\tFISHER_TEST_P_VALUE\t{AICs.header()}\tKS_TEST_PVALUE\tKS_TEST_STATISTIC"
 
     def __str__(self):
-        p_val, statistic = self.ks_test_value()
+        return self.format()
+
+    def format(self, ks_calls: Collection[str] = None) -> str:
+        # ks_calls: abbreviations of the calls to run the KS test for (all calls if None). Other calls get NA
+        if ks_calls is None or self.call_abbreviation(self.call) in ks_calls:
+            p_val, statistic = self.ks_test_value()
+        else:
+            p_val, statistic = 'NA', 'NA'
         return f"{self.call_abbreviation(self.call)}\t{self.format_pval()}\t{str(self.aic_values)}\t{p_val}\t{statistic}"
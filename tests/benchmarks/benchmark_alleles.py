@@ -0,0 +1,69 @@
+import sys, time
+import numpy as np
+from collections import defaultdict
+from typing import List
+
+from src.GenomicUtils.NoiseTable import get_noise_table
+from src.IndelCalling.Histogram import Histogram
+from src.IndelCalling.Locus import Locus
+from src.IndelCalling.CallAlleles import find_alleles, find_alleles_vectorized, passes_filter
+from tests.testing_utils.generate_histograms import get_allele_histograms, get_mutation_histograms
+from tests.testing_utils.read_results import ResultsReader
+
+# compares the loop EM (find_alleles) to the vectorized EM (find_alleles_vectorized)
+# usage: python -m tests.benchmarks.benchmark_alleles [recorded.hist.tsv] [max_loci]
+# with no arguments, the histograms in tests/testing_utils/generate_histograms.py are used
+
+
+def read_recorded_histograms(hist_file: str, max_loci: int) -> List[Histogram]:
+    histograms = []
+    for line in ResultsReader(hist_file):
+        locus = Locus(line.chromosome, line.start, line.end, line.pattern, line.num_ref_repeats, line.ref_seq)
+        histogram = Histogram(locus, integer_indels_only=False)
+        histogram.repeat_lengths = defaultdict(int, zip(line.motif_repeats, line.motif_repeat_support))
+        histograms.append(histogram)
+        if len(histograms) == max_loci:
+            break
+    return histograms
+
+
+def em_inputs(histogram: Histogram, required_read_support: int):
+    # same filtering as calculate_alleles; returns None for loci that never reach the EM
+    proper = np.array([length for length in histogram.rounded_repeat_lengths if passes_filter(len(histogram.locus.pattern), length)])
+    supported = np.array([length for length in proper if histogram.rounded_repeat_lengths[length] >= required_read_support])
+    if supported.size < 2:
+        return None
+    return proper, supported
+
+
+def time_engine(engine, inputs, noise_table, seed: int):
+    results = []
+    start = time.perf_counter()
+    for histogram, proper, supported in inputs:
+        np.random.seed(seed)
+        results.append(engine(histogram, proper, supported, noise_table, 5))
+    return time.perf_counter() - start, results
+
+
+def run_benchmark(histograms: List[Histogram], required_read_support: int = 5, seed: int = 0):
+    noise_table = get_noise_table()
+    inputs = []
+    for histogram in histograms:
+        lengths = em_inputs(histogram, required_read_support)
+        if lengths is not None:
+            inputs.append((histogram,) + lengths)
+    loop_time, loop_results = time_engine(find_alleles, inputs, noise_table, seed)
+    vectorized_time, vectorized_results = time_engine(find_alleles_vectorized, inputs, noise_table, seed)
+    mismatches = sum(1 for a, b in zip(loop_results, vectorized_results) if not (a == b and (a.repeat_lengths == b.repeat_lengths).all()))
+    print(f"loci reaching EM: {len(inputs)}")
+    print(f"loop:       {loop_time:.3f}s")
+    print(f"vectorized: {vectorized_time:.3f}s ({loop_time / max(vectorized_time, 1e-9):.1f}x)")
+    print(f"mismatching allele sets: {mismatches}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        max_loci = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+        run_benchmark(read_recorded_histograms(sys.argv[1], max_loci))
+    else:
+        run_benchmark(get_allele_histograms() + get_mutation_histograms())
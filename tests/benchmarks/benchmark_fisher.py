@@ -0,0 +1,41 @@
+import sys, time
+import numpy as np
+
+from src.IndelCalling.FisherTest import Fisher
+
+# compares the log space Fisher test (Fisher.test) to the exact big integer calculation (Fisher.exact_test)
+# usage: python -m tests.benchmarks.benchmark_fisher [tests_per_depth]
+DEPTHS = [10, 30, 100, 300, 1_000, 3_000, 10_000]
+
+
+def random_sets(depth: int, num_tests: int, seed: int = 0):
+    # pairs of tumor/normal read count vectors over 2-6 repeat lengths, with about depth reads in each sample
+    rng = np.random.RandomState(seed)
+    sets = []
+    for _ in range(num_tests):
+        num_lengths = rng.randint(2, 7)
+        first_set = rng.multinomial(depth, rng.dirichlet(np.ones(num_lengths))).astype(np.float64)
+        second_set = rng.multinomial(depth, rng.dirichlet(np.ones(num_lengths))).astype(np.float64)
+        sets.append((first_set, second_set))
+    return sets
+
+
+def time_test(test, sets):
+    start = time.perf_counter()
+    p_values = [test(first_set, second_set) for first_set, second_set in sets]
+    return time.perf_counter() - start, np.array(p_values)
+
+
+def run_benchmark(tests_per_depth: int = 200):
+    print("depth\texact (s)\tlog space (s)\tspeedup\tmax relative error")
+    for depth in DEPTHS:
+        sets = random_sets(depth, tests_per_depth)
+        exact_time, exact_p_values = time_test(Fisher().exact_test, sets)
+        log_time, log_p_values = time_test(Fisher().test, sets)
+        positive = exact_p_values > 0
+        max_error = np.max(np.abs(log_p_values[positive] - exact_p_values[positive]) / exact_p_values[positive], initial=0)
+        print(f"{depth}\t{exact_time:.4f}\t{log_time:.4f}\t{exact_time / max(log_time, 1e-9):.1f}x\t{max_error:.2e}")
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
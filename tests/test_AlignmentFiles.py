@@ -0,0 +1,32 @@
+import os, random, tempfile, unittest
+
+from src.Entry.SingleFileBatches import HistogramSource
+from src.GenomicUtils.AlignmentFiles import index_paths, is_cram, open_alignment_file
+from src.IndelCalling.Locus import LociBatch
+from tests.testing_utils.write_bam_file import write_indexed_bam, write_reference
+
+
+class TestAlignmentFiles(unittest.TestCase):
+    def test_cram_histograms_match_bam(self):
+        loci = LociBatch.from_fields([["1", ".", ".", str(start), str(start + 20), ".", "10.0", ".", ".", ".", ".", ".", "AC", "AC" * 10]
+                                      for start in range(10_000, 12_000, 25)])
+        with tempfile.TemporaryDirectory() as directory:
+            bam_path, cram_path, reference = (os.path.join(directory, name) for name in ["reads.bam", "reads.cram", "reference.fa"])
+            rng = random.Random(0)
+            read_starts = [(0, rng.randint(9_900, 12_000)) for _ in range(3_000)]
+            write_reference(reference)
+            write_indexed_bam(bam_path, read_starts, 1)
+            write_indexed_bam(cram_path, read_starts, 1, reference)
+            self.assertEqual((is_cram(bam_path), is_cram(cram_path)), (False, True))
+            self.assertEqual(index_paths(cram_path)[0], cram_path + ".crai")
+            self.assertTrue(os.path.isfile(index_paths(cram_path)[0]))
+            read = next(open_alignment_file(cram_path).fetch("1"))
+            self.assertIsNone(read.query_sequence)  # only the fields histograms need are decoded
+            expected = [str(histogram) for histogram in HistogramSource(bam_path, 10, False, None).get_batch_histograms(loci)]
+            self.assertGreater(len(set(expected)), 1)
+            os.rename(reference, reference + ".moved")  # which they are decoded without
+            self.assertEqual([str(histogram) for histogram in HistogramSource(cram_path, 10, False, None).get_batch_histograms(loci)], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest, copy
+
+from src.GenomicUtils.NoiseTable import get_noise_table
+from src.IndelCalling.AlleleCache import AlleleCache, AlleleCacheSettings
+from src.IndelCalling.CallAlleles import calculate_alleles_batch
+from tests.testing_utils.generate_histograms import get_allele_histograms, get_mutation_histograms
+
+
+class TestAlleleCache(unittest.TestCase):
+
+    def test_deterministic_cached_matches_uncached(self):
+        noise_table = get_noise_table()
+        histograms = get_allele_histograms() + get_mutation_histograms()
+        uncached = calculate_alleles_batch(histograms, noise_table, 5, cache=AlleleCache(AlleleCacheSettings(0, 10**6, True)))
+        cache = AlleleCache(AlleleCacheSettings(100, 10**6, True))
+        first_pass = calculate_alleles_batch(histograms, noise_table, 5, cache=cache)
+        second_pass = calculate_alleles_batch([copy.deepcopy(histogram) for histogram in histograms], noise_table, 5, cache=cache)
+        self.assertGreater(cache.hits, 0)
+        for uncached_alleles, first_alleles, second_alleles in zip(uncached, first_pass, second_pass):
+            self.assertEqual(uncached_alleles, first_alleles)
+            self.assertEqual(uncached_alleles, second_alleles)
+
+    def test_repeated_histograms_in_batch_hit(self):
+        noise_table = get_noise_table()
+        histogram = get_mutation_histograms()[0]
+        cache = AlleleCache(AlleleCacheSettings(100, 10**6, False))
+        alleles = calculate_alleles_batch([histogram, copy.deepcopy(histogram), copy.deepcopy(histogram)], noise_table, 5, cache=cache)
+        self.assertEqual((cache.misses, cache.hits), (1, 2))
+        self.assertTrue((alleles[0].repeat_lengths == alleles[2].repeat_lengths).all())
+
+    def test_bounded_entries_and_memory(self):
+        noise_table = get_noise_table()
+        histograms = get_allele_histograms() + get_mutation_histograms()
+        cache = AlleleCache(AlleleCacheSettings(2, 10**6, False))
+        calculate_alleles_batch(histograms, noise_table, 5, cache=cache)
+        self.assertLessEqual(len(cache), 2)
+        cache = AlleleCache(AlleleCacheSettings(100, 1, False))
+        calculate_alleles_batch(histograms, noise_table, 5, cache=cache)
+        self.assertEqual((len(cache), cache.memory), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,22 @@
 import unittest
 
 from src.Entry.BatchUtil import *
+from tests.testing_utils.self_contained_utils import locus_file_path
+
+
+def loci_starts(loci: list, offset: int, result_dir: str) -> List[int]:
+    return [locus.start + offset for locus in loci]
+
+
+class ListWriter:
+    # keeps results handed to it, and the order they were handed in
+    def __init__(self, next_chunk: int = 0):
+        self.results = {}
+        self.backlog = 0
+        self.next_chunk = next_chunk  # chunks before it are skipped, as in a resumed run
+
+    def add(self, chunk_number: int, result):
+        self.results[chunk_number] = result
 
 
 class TestBatchUtil(unittest.TestCase):
@@ -9,6 +25,38 @@ class TestBatchUtil(unittest.TestCase):
         self.assertEqual(get_batch_sizes(100_001, 100_000)[0], 100_000)
         self.assertEqual(get_batch_sizes(100_001, 100_000)[1], 1)
 
+    def test_run_batch_keeps_order(self):
+        batch_sizes = [1, 1, 2]  # 4 loci in file
+        expected = run_batch(loci_starts, [5], LociManager(locus_file_path()), 4, 1, "", batch_sizes)
+        self.assertEqual([len(result) for result in expected], batch_sizes)
+        self.assertEqual(run_batch(loci_starts, [5], LociManager(locus_file_path()), 4, 2, "", batch_sizes), expected)
+        for cores in [1, 2]:
+            writer = ListWriter()
+            self.assertEqual(run_batch(loci_starts, [5], LociManager(locus_file_path()), 4, cores, "", batch_sizes, writer), [])
+            self.assertEqual([writer.results[chunk_number] for chunk_number in range(len(batch_sizes))], expected)
+            resumed = ListWriter(next_chunk=2)
+            run_batch(loci_starts, [5], LociManager(locus_file_path()), 4, cores, "", batch_sizes, resumed)
+            self.assertEqual(resumed.results, {2: expected[2]})
+
+    def test_balance_cores(self):
+        self.assertEqual(balance_cores(1, 10), (1, 1))
+        self.assertEqual(balance_cores(8, 40), (8, 1))
+        self.assertEqual(balance_cores(32, 4), (4, 8))  # cores without chunks decompress for the others
+        self.assertEqual(balance_cores(8, 3), (3, 2))
+        self.assertEqual(balance_cores(8, 0), (1, 8))
+        self.assertEqual(balance_cores(8, 40, 4), (2, 4))
+        self.assertEqual(balance_cores(2, 40, 4), (1, 4))
+        self.assertEqual(balance_cores(16, 2, 4), (2, 4))
+
+    def test_balance_pair_cores(self):
+        # pair workers keep 2 processes busy (the worker and its reader), and open 2 BAMs
+        self.assertEqual(balance_cores(32, 40, 0, 2, 2), (16, 1))
+        self.assertEqual(balance_cores(1, 40, 0, 2, 2), (1, 1))
+        self.assertEqual(balance_cores(32, 4, 0, 2, 2), (4, 4))  # 2 processes and 2 BAMs of 3 more threads each
+        self.assertEqual(balance_cores(32, 40, 4, 2, 2), (4, 4))  # 8 cores a worker: 2 BAMs of 4 threads
+        self.assertEqual(balance_cores(4, 40, 4, 2, 2), (1, 4))
+        self.assertEqual(balance_cores(8, 3, 0, 1, 0), (3, 1))  # histogram catalogs, read by the worker
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,7 @@
 import unittest, numpy as np
 
 from src.GenomicUtils.NoiseTable import get_noise_table
-from tests.testing_utils.generate_histograms import get_allele_histograms
+from tests.testing_utils.generate_histograms import get_allele_histograms, get_mutation_histograms
 from src.IndelCalling.CallAlleles import *
 
 
@@ -27,6 +27,51 @@ class TestCalcAlleles(unittest.TestCase):
         alleles_3 = calculate_alleles(histograms[3], noise_table, 5)
         self.assertEqual(len(alleles_3.repeat_lengths), 0)
 
+    def test_vectorized_matches_loop_under_fixed_seed(self):
+        noise_table = get_noise_table()
+        for histogram in get_allele_histograms() + get_mutation_histograms():
+            proper = np.array([length for length in histogram.rounded_repeat_lengths if passes_filter(len(histogram.locus.pattern), length)])
+            supported = np.array([length for length in proper if histogram.rounded_repeat_lengths[length] >= 5])
+            if supported.size < 2:
+                continue
+            np.random.seed(3)
+            loop_alleles = find_alleles(histogram, proper, supported, noise_table, 5)
+            np.random.seed(3)
+            vectorized_alleles = find_alleles_vectorized(histogram, proper, supported, noise_table, 5)
+            self.assertEqual(loop_alleles, vectorized_alleles)
+            self.assertTrue((loop_alleles.repeat_lengths == vectorized_alleles.repeat_lengths).all())
+
+    def test_batch_matches_single_locus_calls(self):
+        noise_table = get_noise_table()
+        histograms = get_allele_histograms() + get_mutation_histograms()
+        batch_alleles = calculate_alleles_batch(histograms, noise_table, 5)
+        self.assertEqual(len(batch_alleles), len(histograms))
+        for histogram in histograms:
+            np.random.seed(3)
+            single_alleles = calculate_alleles(histogram, noise_table, 5)
+            np.random.seed(3)
+            self.assertEqual(single_alleles, calculate_alleles_batch([histogram], noise_table, 5)[0])
+        for histogram, alleles in zip(histograms, batch_alleles):
+            self.assertIs(alleles.histogram, histogram)
+
+    def test_min_reads(self):
+        noise_table = get_noise_table()
+        histograms = get_allele_histograms() + get_mutation_histograms()
+        min_reads = int(np.median([histogram.num_reads for histogram in histograms]))
+        np.random.seed(3)
+        all_alleles = calculate_alleles_batch(histograms, noise_table, 5)
+        np.random.seed(3)
+        covered_alleles = calculate_alleles_batch(histograms, noise_table, 5, min_reads=min_reads)
+        self.assertTrue(any(histogram.num_reads < min_reads for histogram in histograms))
+        for histogram, alleles, covered in zip(histograms, all_alleles, covered_alleles):
+            if histogram.num_reads < min_reads:
+                self.assertEqual(len(covered), 0)
+                self.assertEqual(str(covered), str(trivial_alleles(histogram, np.array([]), 5)))
+            else:
+                self.assertEqual(str(covered), str(alleles))
+            self.assertEqual(is_skipped(CoverageFilter(min_reads, skip=True), histogram), histogram.num_reads < min_reads)
+            self.assertFalse(is_skipped(CoverageFilter(min_reads, skip=False), histogram))
+
 
 
         # alleles_6 = calculate_alleles(histograms[5], noise_table=noise_table)
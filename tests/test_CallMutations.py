@@ -1,7 +1,20 @@
-import unittest
+import unittest, itertools
 
 from tests.testing_utils.generate_histograms import get_allele_histograms
 from src.IndelCalling.CallMutations import *
+from src.IndelCalling.CallAlleles import calculate_alleles
+from src.IndelCalling.Locus import Locus
+from src.GenomicUtils.NoiseTable import get_noise_table
+
+
+def pair_alleles(normal_lengths: dict, tumor_lengths: dict, noise_table):
+    # alleles of normal and tumor histograms of one locus, with 10 repeats of A
+    alleles = []
+    for lengths in [normal_lengths, tumor_lengths]:
+        histogram = Histogram(Locus("1", 100, 109, "A", 10.0, "A" * 10), False)
+        histogram.add_repeat_lengths(list(itertools.chain.from_iterable([length] * reads for length, reads in lengths.items())))
+        alleles.append(calculate_alleles(histogram, noise_table, required_read_support=5))
+    return alleles
 
 
 class TestCalcAlleles(unittest.TestCase):
@@ -11,6 +24,24 @@ class TestCalcAlleles(unittest.TestCase):
         vecs = hist2vecs(histograms[0], histograms[1])
         self.assertTrue(0 in vecs.first_set and 0 in vecs.second_set)
 
+    def test_sweep_calls_match_call_mutations(self):
+        noise_table = get_noise_table()
+        fisher = Fisher()
+        pairs = [({10.0: 30}, {10.0: 30}), ({10.0: 30}, {10.0: 15, 8.0: 15}), ({10.0: 30}, {10.0: 25, 8.0: 6}),
+                 ({10.0: 20, 9.0: 6}, {10.0: 15, 12.0: 15}), ({10.0: 12, 11.0: 12}, {10.0: 12, 11.0: 6, 7.0: 12}),
+                 ({10.0: 30, 9.0: 30, 8.0: 30}, {10.0: 30}), ({10.0: 30}, {10.0: 2}), ({8.0: 30}, {10.0: 20, 8.0: 5, 7.0: 10}), ({8.0: 30}, {10.0: 25, 8.0: 25})]
+        thresholds = [MutationThresholds(*values) for values in itertools.product([2.0, 8.0, 30.0], [0.001, 0.031, 0.5], [0.01, 0.3, 0.9])]
+        calls = set()
+        for normal_lengths, tumor_lengths in pairs:
+            normal_alleles, tumor_alleles = pair_alleles(normal_lengths, tumor_lengths, noise_table)
+            np.random.seed(0)  # tumor alleles without the reference length are called again
+            swept = sweep_calls(normal_alleles, tumor_alleles, noise_table, fisher, thresholds)
+            for locus_thresholds, call in zip(thresholds, swept):
+                np.random.seed(0)
+                self.assertEqual(call, call_mutations(normal_alleles, tumor_alleles, noise_table, fisher, locus_thresholds).call)
+            calls.update(swept)
+        self.assertEqual(len(calls), 7)  # every call is made under some thresholds
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,27 @@
+import os, tempfile, unittest
+
+from src.GenomicUtils.ContigTable import ContigTable, read_contig_aliases
+
+
+class TestContigTable(unittest.TestCase):
+
+    def test_resolves_prefixes_and_mitochondria(self):
+        contigs = ContigTable(("chr1", "chr2", "chrX", "chrM", "chr1_KI270706v1_random"))
+        self.assertEqual([contigs.get_tid(contig) for contig in ["1", "chr1", "Chr2", "X", "chrX", "MT", "M", "chr1_KI270706v1_random"]],
+                         [0, 0, 1, 2, 2, 3, 3, 4])
+        contigs = ContigTable(("1", "2", "MT", "GL000192.1"))
+        self.assertEqual([contigs.get_tid(contig) for contig in ["chr1", "2", "chrM", "M", "GL000192.1"]], [0, 1, 2, 2, 3])
+        self.assertFalse(contigs.has_contig("chr3"))
+        self.assertRaises(ValueError, contigs.get_tid, "chr3")
+
+    def test_aliases(self):
+        with tempfile.TemporaryDirectory() as directory:
+            aliases_path = os.path.join(directory, "aliases.tsv")
+            with open(aliases_path, 'w') as aliases_file:
+                aliases_file.write("chr1\tNC_000001.11\nchrUn_decoy\ths38d1\n")
+            contigs = ContigTable(("NC_000001.11", "hs38d1", "1"), read_contig_aliases(aliases_path))
+            self.assertEqual([contigs.get_tid(contig) for contig in ["chr1", "chrUn_decoy", "1"]], [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
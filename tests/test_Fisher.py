@@ -37,6 +37,17 @@ class TestHistogram(unittest.TestCase):
         self.assertAlmostEqual(fisher.big_divide(1_000, 200_000), .005)
         self.assertAlmostEqual(fisher.big_divide(2**3000, 2**3002), .25)
 
+    def test_log_space_matches_exact(self):
+        fisher = Fisher()
+        rng = np.random.RandomState(0)
+        for depth in [10, 100, 1_000, 10_000]:
+            for _ in range(20):
+                first_set = rng.multinomial(depth, [0.5, 0.3, 0.2]).astype(np.float64)
+                second_set = rng.multinomial(depth, [0.2, 0.3, 0.5]).astype(np.float64)
+                exact = fisher.exact_test(first_set, second_set)
+                self.assertLessEqual(abs(fisher.test(first_set, second_set) - exact), 1e-9 * exact)
+        self.assertGreater(fisher.log_factorials.size, 20_000)
+
 
 if __name__ == '__main__':
     unittest.main()
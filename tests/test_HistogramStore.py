@@ -0,0 +1,88 @@
+import unittest, os, tempfile
+import numpy as np
+
+from src.Entry.HistogramStore import HistogramShard, HistogramCatalog, HistogramCatalogWriter
+from src.Entry.RunManifest import RunManifest
+from src.IndelCalling.Histogram import Histogram
+from src.IndelCalling.Locus import Locus
+
+
+def make_shards(histograms: list, chunk_sizes: list) -> list:
+    shards = []
+    for chunk_start, chunk_size in zip(np.cumsum([0] + chunk_sizes).tolist(), chunk_sizes):
+        shard = HistogramShard()
+        for histogram in histograms[chunk_start:chunk_start + chunk_size]:
+            shard.append(histogram)
+        shard.close()
+        shards.append(shard)
+    return shards
+
+
+def make_histograms(num_loci: int):
+    # every third locus has no reads, the rest have a few repeat lengths, some tied in support
+    histograms = []
+    for i in range(num_loci):
+        histogram = Histogram(Locus("1", 1000 * i, 1000 * i + 20, "AC", 10.0, "AC" * 10), False)
+        if i % 3 != 0:
+            histogram.add_repeat_lengths([10.0, 10.5 + i, 9.0, 10.0, 9.0, 0] + [8.0] * (i % 4))
+        histograms.append(histogram)
+    return histograms
+
+
+class TestHistogramStore(unittest.TestCase):
+    def test_shards_merge_into_catalog(self):
+        histograms = make_histograms(20)
+        with tempfile.TemporaryDirectory() as directory:
+            shards = make_shards(histograms, [7, 0, 1, 12])
+            catalog_path = os.path.join(directory, "run.hist.hcat")
+            with HistogramCatalogWriter(catalog_path, 100) as writer:
+                for chunk_number in [2, 0, 3, 1]:
+                    writer.add(chunk_number, shards[chunk_number])
+            self.assertEqual(sorted(os.listdir(directory)), ["run.hist.hcat"])
+            catalog = HistogramCatalog(catalog_path)
+            self.assertEqual((catalog.first_locus, catalog.end_locus), (100, 120))
+            self.assertEqual(len(catalog.loci), len([i for i in range(20) if i % 3 != 0]))
+            loci = [histogram.locus for histogram in histograms]
+            for start, end in [(0, 20), (5, 9), (8, 8)]:
+                from_catalog = catalog.get_histograms(loci[start:end], np.arange(100 + start, 100 + end), False)
+                self.assertEqual([str(histogram) for histogram in from_catalog], [str(histogram) for histogram in histograms[start:end]])
+            some_loci = [1, 3, 4, 9, 19]
+            from_catalog = catalog.get_histograms([loci[i] for i in some_loci], np.array(some_loci) + 100, False)
+            self.assertEqual([str(histogram) for histogram in from_catalog], [str(histograms[i]) for i in some_loci])
+            with self.assertRaises(ValueError):
+                catalog.get_histograms(loci, np.arange(99, 119), False)
+
+    def test_resumed_run(self):
+        histograms = make_histograms(20)
+        chunk_sizes = [5, 6, 0, 9]
+        shards = make_shards(histograms, chunk_sizes)
+        with tempfile.TemporaryDirectory() as directory:
+            catalog_path = os.path.join(directory, "run.hist.hcat")
+            with self.assertRaises(KeyboardInterrupt):
+                with HistogramCatalogWriter(catalog_path, 100, RunManifest.start(catalog_path, {}, lambda: chunk_sizes)) as writer:
+                    for chunk_number in [0, 2, 1]:
+                        writer.add(chunk_number, shards[chunk_number])
+                    raise KeyboardInterrupt()
+            self.assertFalse(os.path.exists(catalog_path))
+            manifest = RunManifest.start(catalog_path, {}, lambda: [], resume=True)
+            self.assertEqual(manifest.chunks_done, 3)
+            with HistogramCatalogWriter(catalog_path, 100, manifest) as writer:
+                writer.add(3, shards[3])
+            self.assertEqual(sorted(os.listdir(directory)), ["run.hist.hcat", "run.hist.hcat.manifest.json"])
+            catalog = HistogramCatalog(catalog_path)
+            from_catalog = catalog.get_histograms([histogram.locus for histogram in histograms], np.arange(100, 120), False)
+            self.assertEqual([str(histogram) for histogram in from_catalog], [str(histogram) for histogram in histograms])
+
+    def test_empty_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shard = HistogramShard()
+            shard.close()
+            catalog_path = os.path.join(directory, "run.hist.hcat")
+            with HistogramCatalogWriter(catalog_path, 0) as writer:
+                writer.add(0, shard)
+            catalog = HistogramCatalog(catalog_path)
+            self.assertEqual(len(catalog.get_histograms([], [], False)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
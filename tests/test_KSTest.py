@@ -0,0 +1,38 @@
+import unittest, warnings
+import numpy as np
+from collections import defaultdict
+from scipy.stats import ks_2samp
+
+from src.IndelCalling.Histogram import Histogram
+from src.IndelCalling.Locus import Locus
+from src.IndelCalling.KSTest import ks_test
+from src.IndelCalling.hist2vecs import hist2samps
+
+
+def random_histogram(rng: np.random.RandomState, depth: int) -> Histogram:
+    histogram = Histogram(Locus("1", 11, 21, "A", 10, "AAAAAAAAAA"), integer_indels_only=False)
+    lengths = rng.choice(np.arange(5, 16), size=rng.randint(1, 5), replace=False)
+    histogram.repeat_lengths = defaultdict(int, zip(lengths.astype(float), rng.multinomial(depth, np.ones(lengths.size) / lengths.size)))
+    return histogram
+
+
+class TestKSTest(unittest.TestCase):
+
+    def test_matches_ks_2samp(self):
+        rng = np.random.RandomState(0)
+        for depth_a, depth_b in [(1, 1), (3, 40), (25, 25), (60, 200), (1_000, 3_000), (12_000, 500)]:
+            for _ in range(10):
+                histogram_a, histogram_b = random_histogram(rng, depth_a), random_histogram(rng, depth_b)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    expected = ks_2samp(*hist2samps(histogram_a, histogram_b))
+                self.assertEqual(ks_test(histogram_a, histogram_b), (expected.pvalue, expected.statistic))
+
+    def test_empty_histogram(self):
+        rng = np.random.RandomState(0)
+        empty = Histogram(Locus("1", 11, 21, "A", 10, "AAAAAAAAAA"), integer_indels_only=False)
+        self.assertEqual(ks_test(empty, random_histogram(rng, 10)), (-1, -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
-import unittest, time
+import unittest, time, os, tempfile
 from tests.testing_utils.self_contained_utils import locus_file_path
-from src.GenomicUtils.LocusFile import LociManager
+from src.GenomicUtils.LocusFile import LociManager, LociIndex
+from src.Entry.IndexLoci import write_loci_catalog
+from src.IndelCalling.Locus import Locus, LociBatch
 
 
 class TestHistogram(unittest.TestCase):
@@ -18,6 +20,46 @@ class TestHistogram(unittest.TestCase):
         l = manager.get_batch(1)[0]
         self.assertTrue(True)
 
+    def test_index_seeks_to_line(self):
+        with open(locus_file_path()) as sample_loci:
+            sample_lines = sample_loci.read().splitlines()
+        with tempfile.TemporaryDirectory() as directory:
+            loci_path = os.path.join(directory, "loci.tsv")
+            lines = [sample_lines[i % len(sample_lines)] for i in range(2 * LociIndex.STRIDE + 7)]
+            with open(loci_path, 'w') as loci_file:
+                loci_file.write("\n".join(lines) + "\n")
+            self.assertEqual(LociIndex(loci_path).num_lines, len(lines))
+            for start in [0, 1, LociIndex.STRIDE - 1, LociIndex.STRIDE, 2 * LociIndex.STRIDE + 3]:
+                manager = LociManager(loci_path, start)
+                loci = list(manager.get_batch(5)) + list(manager.get_batch(10**6))
+                self.assertEqual(len(loci), len(lines) - start)
+                self.assertEqual(loci[0].start, int(lines[start].split("\t")[3]))
+                self.assertEqual(len(manager.get_batch(1)), 0)
+
+    def test_catalog_matches_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            catalog_path = os.path.join(directory, "loci.lcat")
+            write_loci_catalog(locus_file_path(), catalog_path)
+            for start in range(4):
+                from_file, from_catalog = LociManager(locus_file_path(), start), LociManager(catalog_path, start)
+                self.assertEqual([str(locus) for locus in from_file.get_batch(2)], [str(locus) for locus in from_catalog.get_batch(2)])
+                self.assertEqual([str(locus) for locus in from_file.get_batch(5)], [str(locus) for locus in from_catalog.get_batch(5)])
+
+    def test_loci_batch_views(self):
+        with open(locus_file_path()) as sample_loci:
+            fields = [line.split("\t") for line in sample_loci.read().splitlines()]
+        batch = LociBatch.from_fields(fields)
+        loci = [str(locus) for locus in batch]
+        self.assertEqual(len(batch), len(fields))
+        self.assertEqual(loci[0], str(Locus(fields[0][0], int(fields[0][3]), int(fields[0][4]), fields[0][12], float(fields[0][6]), fields[0][13])))
+        self.assertEqual([str(locus) for locus in batch[1:3]], loci[1:3])
+        self.assertEqual([str(locus) for locus in batch[2:][1:]], loci[3:])
+        self.assertEqual(str(batch[-1]), loci[-1])
+        self.assertEqual(len(batch[3:1]), 0)
+        self.assertEqual(batch[2:][1:].lines().tolist(), [3])
+        manager = LociManager(locus_file_path(), 1)
+        self.assertEqual((manager.get_batch(2).first_line, manager.get_batch(2).first_line), (1, 3))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+import unittest, os, tempfile, gzip
+from pysam.libcbgzf import BGZFile
+
+from src.Entry.OutputWriter import OutputChunk, OrderedWriter, OUTPUT_COMPRESSIONS, BGZF_BLOCK_SIZE, output_path
+from src.Entry.RunManifest import RunManifest
+
+
+def make_chunk(lines, compression: str) -> OutputChunk:
+    chunk = OutputChunk(compression)
+    for line in lines:
+        chunk.append(line)
+    chunk.close()
+    return chunk
+
+
+class TestOutputWriter(unittest.TestCase):
+    def test_chunks_written_in_order(self):
+        # chunks of several bgzf blocks, flushed several times, and empty chunks
+        chunk_lines = [[f"{chunk}\tline {i}\t" + "ACGT" * (i % 50) for i in range(size)] for chunk, size in enumerate([30_000, 0, 5, 12_000, 0])]
+        expected = "HEADER\n" + "".join(line + "\n" for lines in chunk_lines for line in lines)
+        self.assertGreater(len(expected), 3 * BGZF_BLOCK_SIZE)
+        with tempfile.TemporaryDirectory() as directory:
+            for compression in OUTPUT_COMPRESSIONS:
+                path = output_path(os.path.join(directory, "out"), compression)
+                with OrderedWriter(path, "HEADER", compression) as writer:
+                    for chunk_number in [3, 1, 0, 4, 2]:
+                        writer.add(chunk_number, make_chunk(chunk_lines[chunk_number], compression))
+                    self.assertEqual(writer.backlog, 0)
+                if compression == "none":
+                    with open(path) as output_file:
+                        self.assertEqual(output_file.read(), expected)
+                else:
+                    with gzip.open(path, 'rt') as output_file:
+                        self.assertEqual(output_file.read(), expected)
+                if compression == "bgzf":
+                    self.assertEqual(BGZFile(path, 'rb').read().decode(), expected)
+
+    def test_failed_run_leaves_no_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "out.tsv")
+            with self.assertRaises(RuntimeError):
+                with OrderedWriter(path, "HEADER") as writer:
+                    writer.add(1, make_chunk(["a"], "none"))
+            self.assertFalse(os.path.exists(path))
+
+    def test_resumed_run(self):
+        chunk_lines = [[f"{chunk}\tline {i}" for i in range(size)] for chunk, size in enumerate([3, 0, 4, 2])]
+        run = {"run": "test", "settings": [1, (2, 3)]}
+        with tempfile.TemporaryDirectory() as directory:
+            for compression in OUTPUT_COMPRESSIONS:
+                path = output_path(os.path.join(directory, "out"), compression)
+                with OrderedWriter(path, "HEADER", compression) as writer:
+                    for chunk_number, lines in enumerate(chunk_lines):
+                        writer.add(chunk_number, make_chunk(lines, compression))
+                with open(path, 'rb') as output_file:
+                    expected = output_file.read()
+                os.remove(path)
+                # stopped after chunks 0 and 1 were written (and chunk 3 was done), with some of chunk 2 written after the manifest was
+                with self.assertRaises(KeyboardInterrupt):
+                    with OrderedWriter(path, "HEADER", compression, RunManifest.start(path, run, lambda: [3, 0, 4, 2])) as writer:
+                        for chunk_number in [0, 3, 1]:
+                            writer.add(chunk_number, make_chunk(chunk_lines[chunk_number], compression))
+                        raise KeyboardInterrupt()
+                with open(path, 'ab') as output_file:
+                    output_file.write(make_chunk(chunk_lines[2][:2], compression).data)
+                with self.assertRaises(ValueError):
+                    RunManifest.start(path, {"run": "other"}, lambda: [], resume=True)
+                for _ in range(2):  # resuming a complete run leaves it as it is
+                    manifest = RunManifest.start(path, run, lambda: [9], resume=True)
+                    if not manifest.complete:
+                        self.assertEqual((manifest.chunk_sizes, manifest.chunks_done), ([3, 0, 4, 2], 2))
+                        with OrderedWriter(path, "HEADER", compression, manifest) as writer:
+                            for chunk_number in [3, 2]:
+                                writer.add(chunk_number, make_chunk(chunk_lines[chunk_number], compression))
+                    with open(path, 'rb') as output_file:
+                        self.assertEqual(output_file.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
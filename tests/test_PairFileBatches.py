@@ -0,0 +1,72 @@
+import os, random, tempfile, unittest
+
+from src.Entry import PairFileBatches
+from src.Entry.BatchUtil import LOCUS_BLOCK_SIZE
+from src.Entry.PairFileBatches import PairHistograms
+from src.Entry.SingleFileBatches import HistogramSource
+from src.IndelCalling.Locus import LociBatch
+from tests.testing_utils.write_bam_file import write_indexed_bam
+
+
+def make_loci(num_loci: int) -> LociBatch:
+    # fields of loci file lines: chromosome, start, end, repeats, pattern and sequence are fields 0, 3, 4, 6, 12 and 13
+    return LociBatch.from_fields([["1", ".", ".", str(start), str(start + 20), ".", "10.0", ".", ".", ".", ".", ".", "AC", "AC" * 10]
+                                  for start in range(10_000, 10_000 + 50 * num_loci, 50)])
+
+
+class TestPairFileBatches(unittest.TestCase):
+    def test_pair_histograms_match_sources(self):
+        loci = make_loci(2 * LOCUS_BLOCK_SIZE + 10)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ["normal.bam", "tumor.bam"]]
+            rng = random.Random(0)
+            for seed, path in enumerate(paths):
+                write_indexed_bam(path, [(0, rng.randint(9_900, 10_000 + 50 * len(loci))) for _ in range(20_000)], seed)
+            sources = [HistogramSource(path, 10, False, None) for path in paths]
+            pair_histograms = PairHistograms(paths, 10, False, None, decompression_threads=2)
+            blocks = list(pair_histograms.read_blocks(loci))
+            self.assertEqual([len(block) for block, _ in blocks], [LOCUS_BLOCK_SIZE, LOCUS_BLOCK_SIZE, 10])
+            reader = PairFileBatches._worker_reader[1]
+            next(pair_histograms.read_blocks(loci[:LOCUS_BLOCK_SIZE + 1]))  # stopped early: its reader is stopped
+            self.assertFalse(reader.is_alive())
+            # the chunks after use one reader, and reading in the caller gives the same histograms
+            chunks = [loci[:LOCUS_BLOCK_SIZE + 5], loci[LOCUS_BLOCK_SIZE + 5:]]
+            chunk_blocks = [list(pair_histograms.read_blocks(chunk)) for chunk in chunks]
+            self.assertEqual(len({PairFileBatches._worker_reader[1].pid, PairFileBatches.worker_reader(PairFileBatches._worker_reader[0])[0].pid}), 1)
+            inline = PairHistograms(paths, 10, False, None, read_ahead=False)
+            for chunk, read_blocks in zip(chunks, chunk_blocks):
+                blocks_of_chunk = [(block, histograms) for block, histograms in read_blocks]
+                self.assertEqual([[[str(histogram) for histogram in source_histograms] for source_histograms in histograms] for _, histograms in blocks_of_chunk],
+                                 [[[str(histogram) for histogram in source_histograms] for source_histograms in histograms] for _, histograms in inline.read_blocks(chunk)])
+            for block, histograms in blocks:
+                for source, source_histograms in zip(sources, histograms):
+                    self.assertEqual([str(histogram) for histogram in source_histograms],
+                                     [str(histogram) for histogram in source.get_batch_histograms(block)])
+            self.assertGreater(sum(len(histogram.repeat_lengths) for _, histograms in blocks for histogram in histograms[1]), 0)
+            with self.assertRaises(FileNotFoundError):  # errors of the reader process are raised by the caller
+                list(PairHistograms([paths[0], os.path.join(directory, "missing.bam")], 10, False, None).read_blocks(loci))
+
+    def test_tumor_not_read_where_normal_has_few_reads(self):
+        loci = make_loci(LOCUS_BLOCK_SIZE + 10)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ["normal.bam", "tumor.bam"]]
+            rng = random.Random(1)
+            # the normal covers the first half of the loci, the tumor all of them
+            for seed, (path, end) in enumerate(zip(paths, [10_000 + 25 * len(loci), 10_000 + 50 * len(loci)])):
+                write_indexed_bam(path, [(0, rng.randint(9_900, end)) for _ in range(10_000)], seed)
+            tumor_source = HistogramSource(paths[1], 10, False, None)
+            num_covered, uncovered_tumor_reads = 0, 0
+            for block, (normal_histograms, tumor_histograms) in PairHistograms(paths, 10, False, None, min_reads=5).read_blocks(loci):
+                for normal_histogram, tumor_histogram, source_histogram in zip(normal_histograms, tumor_histograms, tumor_source.get_batch_histograms(block)):
+                    if normal_histogram.num_reads >= 5:
+                        num_covered += 1
+                        self.assertEqual(str(tumor_histogram), str(source_histogram))
+                    else:
+                        self.assertEqual((tumor_histogram.num_reads, tumor_histogram.locus.start), (0, normal_histogram.locus.start))
+                        uncovered_tumor_reads += source_histogram.num_reads
+            self.assertTrue(0 < num_covered < len(loci))
+            self.assertGreater(uncovered_tumor_reads, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
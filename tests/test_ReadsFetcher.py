@@ -0,0 +1,50 @@
+import os, random, tempfile, unittest
+import numpy as np
+import pysam
+
+from src.GenomicUtils.ReadsFetcher import ReadsFetcher
+from tests.testing_utils.write_bam_file import write_indexed_bam
+
+
+def spanning_reads(bam: pysam.AlignmentFile, chromosome: str, start: int, end: int):
+    return [(read.reference_start, read.reference_end, read.flag) for read in bam.fetch(chromosome)
+            if read.reference_start + 1 <= start and end <= read.reference_end and ReadsFetcher.simple_filter(read)]
+
+
+class TestReadsFetcher(unittest.TestCase):
+
+    def test_sweep_returns_exactly_spanning_reads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reads.bam")
+            rng = random.Random(1)
+            write_indexed_bam(path, [(rng.randint(0, 1), rng.randint(10_000, 12_000)) for _ in range(3_000)])
+            loci = sorted([(chromosome, start, start + rng.randint(2, 40)) for chromosome in "12" for start in rng.sample(range(9_950, 12_150), 400)],
+                          key=lambda locus: (locus[0], locus[2], -locus[1]))
+            bam = pysam.AlignmentFile(path, "rb")
+            for order in [loci, rng.sample(loci, len(loci))]:  # loci file order, then unsorted
+                fetcher = ReadsFetcher(pysam.AlignmentFile(path, "rb"))
+                for chromosome, start, end in order:
+                    fetched = [(read.reference_start, read.reference_end, read.flag) for read in fetcher.get_reads(chromosome, start, end)]
+                    self.assertEqual(fetched, spanning_reads(bam, chromosome, start, end))
+
+    def test_block_reads_match_sweep(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reads.bam")
+            rng = random.Random(2)
+            write_indexed_bam(path, [(0, rng.randint(10_000, 12_000)) for _ in range(3_000)], 2)
+            loci = sorted([(start, start + rng.randint(2, 40)) for start in rng.sample(range(9_950, 12_150), 300)], key=lambda locus: (locus[1], -locus[0]))
+            for order in [loci, rng.sample(loci, len(loci))]:
+                starts, ends = (np.array(column, dtype=np.int64) for column in zip(*order))
+                reads, num_reads, spanning = ReadsFetcher(pysam.AlignmentFile(path, "rb")).get_block_reads("1", starts, ends)
+                fetcher = ReadsFetcher(pysam.AlignmentFile(path, "rb"))
+                first_read = 0
+                for start, end, locus_num_reads in zip(starts.tolist(), ends.tolist(), num_reads.tolist()):
+                    locus_reads = spanning[first_read:first_read + locus_num_reads]
+                    first_read += locus_num_reads
+                    self.assertEqual(list(zip(reads.reference_starts[locus_reads].tolist(), reads.reference_ends[locus_reads].tolist())),
+                                     [(read.reference_start, read.reference_end) for read in fetcher.get_reads("1", start, end)])
+                self.assertGreater(first_read, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
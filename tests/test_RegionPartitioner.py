@@ -0,0 +1,49 @@
+import os, random, tempfile, unittest
+
+from src.Entry.RegionPartitioner import partition_loci, partition_shards
+from tests.testing_utils.write_bam_file import write_indexed_bam
+
+
+def write_loci_file(path: str, loci: list):
+    # only the columns the partitioner reads (chromosome, start, end) are filled in
+    with open(path, 'w') as loci_file:
+        for chromosome, start in loci:
+            loci_file.write(f"{chromosome}\t.\t.\t{start}\t{start + 20}\t.\t10\t.\t.\t.\t.\t.\tA\tAAAAAAAAAA\n")
+
+
+class TestRegionPartitioner(unittest.TestCase):
+
+    def test_chunks_balanced_by_reads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            BAM_path = os.path.join(directory, "reads.bam")
+            loci_path = os.path.join(directory, "loci.tsv")
+            rng = random.Random(0)
+            amplicon = [(0, rng.randint(500_000, 501_000)) for _ in range(60_000)]  # high coverage region of chromosome 1
+            background = [(rng.randint(0, 1), rng.randint(10_000, 1_000_000)) for _ in range(5_000)]
+            write_indexed_bam(BAM_path, amplicon + background)
+            loci = [(chromosome, start) for chromosome in "12" for start in range(10_000, 1_000_000, 1_000)]
+            write_loci_file(loci_path, loci)
+
+            chunk_sizes = partition_loci(loci_path, 0, len(loci), [BAM_path], cores=2)
+            self.assertEqual(sum(chunk_sizes), len(loci))
+            chunk_starts = [sum(chunk_sizes[:i]) for i in range(len(chunk_sizes))]
+            for chunk_start, chunk_size in zip(chunk_starts, chunk_sizes):  # no chunk straddles chromosomes
+                self.assertEqual(loci[chunk_start][0], loci[chunk_start + chunk_size - 1][0])
+            amplicon_chunk = max(i for i, chunk_start in enumerate(chunk_starts) if loci[chunk_start] <= ("1", 550_000))
+            full_chromosome_2_chunks = [size for chunk_start, size in zip(chunk_starts[:-1], chunk_sizes[:-1]) if loci[chunk_start][0] == "2"]
+            self.assertLess(chunk_sizes[amplicon_chunk], 0.8 * min(full_chromosome_2_chunks))
+
+            self.assertEqual(sum(partition_loci(loci_path, 100, 1_500, [BAM_path], cores=2)), 1_400)
+
+            shards = partition_shards(loci_path, 100, len(loci), [BAM_path], 3)
+            self.assertEqual([(shards[0].start, shards[-1].end)], [(100, len(loci))])
+            self.assertEqual([shard.end for shard in shards[:-1]], [shard.start for shard in shards[1:]])
+            self.assertAlmostEqual(sum(shard.load for shard in shards), 1.0)
+            self.assertLess(max(shard.load for shard in shards), 0.4)
+            amplicon_shard = next(shard for shard in shards if shard.end > loci.index(("1", 500_000)))
+            self.assertLess(amplicon_shard.end - amplicon_shard.start, min(shard.end - shard.start for shard in shards if shard != amplicon_shard))
+            self.assertEqual(partition_shards(loci_path, 0, 2, [BAM_path], 3)[2], (2, 2, 0.0))  # more shards than loci
+
+
+if __name__ == '__main__':
+    unittest.main()
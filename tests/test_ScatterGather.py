@@ -0,0 +1,50 @@
+import unittest, os, tempfile, gzip
+
+from src.Entry.ScatterGather import gather_outputs, shard_prefix
+from src.Entry.OutputWriter import OutputChunk, OrderedWriter, output_path
+from src.Entry.RunManifest import RunManifest
+
+
+def write_shard(output_file: str, lines: list, batch: list, compression: str = "none"):
+    # a shard's output, and its manifest, as a run with --shard writes them
+    chunk = OutputChunk(compression)
+    for line in lines:
+        chunk.append(line)
+    chunk.close()
+    with OrderedWriter(output_file, "CHROMOSOME\tSTART", compression, RunManifest.start(output_file, {"batch": batch}, lambda: [len(lines)])) as writer:
+        writer.add(0, chunk)
+
+
+class TestScatterGather(unittest.TestCase):
+    def test_gather_shards(self):
+        shard_lines = [["1\t100", "1\t200"], [], ["2\t50"]]
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, "run")
+            batches = [[0, 2], [2, 2], [2, 3]]
+            for shard in [3, 1, 2]:
+                write_shard(output_path(shard_prefix(prefix, shard, 3) + ".partial.mut", "none"), shard_lines[shard - 1], batches[shard - 1])
+                write_shard(output_path(shard_prefix(prefix, shard, 3) + ".normal.all", "gzip"), shard_lines[shard - 1], batches[shard - 1], "gzip")
+                with open(shard_prefix(prefix, shard, 3) + ".vcf", 'w') as vcf_file:
+                    vcf_file.write("##fileformat=VCFv4.2\n#CHROM\tPOS\n" + "\n".join(shard_lines[shard - 1]))
+            self.assertEqual(sorted(gather_outputs(prefix)), sorted([prefix + ".partial.mut.tsv", prefix + ".normal.all.tsv.gz", prefix + ".vcf"]))
+            with open(prefix + ".partial.mut.tsv") as gathered:
+                self.assertEqual(gathered.read(), "CHROMOSOME\tSTART\n1\t100\n1\t200\n2\t50\n")
+            with gzip.open(prefix + ".normal.all.tsv.gz", 'rt') as gathered:
+                self.assertEqual(gathered.read(), "CHROMOSOME\tSTART\n1\t100\n1\t200\n2\t50\n")
+            with open(prefix + ".vcf") as gathered:
+                self.assertEqual(gathered.read(), "##fileformat=VCFv4.2\n#CHROM\tPOS\n1\t100\n1\t200\n2\t50\n")
+            with self.assertRaises(ValueError):  # outputs exist
+                gather_outputs(prefix)
+
+            os.remove(shard_prefix(prefix, 2, 3) + ".vcf")
+            with self.assertRaises(ValueError):
+                gather_outputs(prefix, force=True)
+            write_shard(output_path(shard_prefix(prefix, 2, 3) + ".partial.mut", "none"), [], [1, 2])  # overlaps shard 1
+            os.remove(shard_prefix(prefix, 1, 3) + ".vcf")
+            os.remove(shard_prefix(prefix, 3, 3) + ".vcf")
+            with self.assertRaises(ValueError):
+                gather_outputs(prefix, force=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,9 @@
 import os, unittest
+import pysam
+
+from src.IndelCalling.Histogram import Histogram, add_reads_batch
+from src.IndelCalling.Locus import Locus
+from src.GenomicUtils.ReadRecord import ReadRecord
 
 from tests.testing_utils.generate_histograms import histogram_histograms
 from tests.testing_utils.read_results import ResultsReader
@@ -83,6 +88,29 @@ class TestHistogram(unittest.TestCase):
             current_line = next(results_reader)
             self.assertEqual(mapping_reads[i], current_line.motif_repeat_support[0], f"Failed on {i}")
 
+    def test_batched_repeat_lengths_match_per_read(self):
+        header = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "1", "LN": 100_000}]})
+        cigars = ["30M", "5S12M3I10M", "10M4D10M", "8M12D25M", "2H14M2I1D12M10N5M", "3=1X10=2I10M", "12M1I1D1I20M", "4M30D4M", "11M"]
+        reads = []
+        for i, cigar in enumerate(cigars):
+            read = pysam.AlignedSegment(header)
+            read.reference_id, read.reference_start, read.cigarstring = 0, 988 + i, cigar
+            read.query_sequence = "A" * read.query_length
+            reads.append(read)
+        records = [ReadRecord.from_read(read) for read in reads]
+        loci = [Locus("1", 1000, 1011, "AC", 6.0, "ACACACACACAC"), Locus("1", 1003, 1005, "T", 3.0, "TTT"), Locus("1", 990, 1030, "AAT", 13.7, "AAT")]
+        per_read = []
+        for locus in loci:
+            histogram = Histogram(locus, integer_indels_only=False)
+            for read in reads:
+                histogram.repeat_lengths[histogram.calculate_repeat_length(read)] += 1
+            per_read.append(histogram)
+        batched = [Histogram(locus, integer_indels_only=False) for locus in loci]
+        add_reads_batch(batched, [records, records[::-1], records])
+        for expected, histogram in zip(per_read, batched):
+            self.assertEqual(sorted(map(repr, expected.repeat_lengths.items())), sorted(map(repr, histogram.repeat_lengths.items())))
+        self.assertEqual(list(per_read[0].repeat_lengths.items()), list(batched[0].repeat_lengths.items()))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,15 @@
+import gzip
 from typing import List
 from dataclasses import dataclass
 
 
+def open_results(results_file: str):
+    # results tsv, or compressed results (see --compress)
+    if results_file.endswith(".gz"):
+        return gzip.open(results_file, 'rt')
+    return open(results_file, 'r')
+
+
 class ResultsLine:
     def __init__(self, chromosome: str, start: int, end: int, pattern: str, ref_seq: str, num_ref_repeats: float,
                  motif_repeats: List[float], motif_repeat_support: List[int]):
@@ -18,7 +26,7 @@ class ResultsLine:
 
 class ResultsReader:
     def __init__(self, results_file: str):
-        self.results_file = open(results_file, 'r')
+        self.results_file = open_results(results_file)
         header_line = next(self.results_file)
 
     def __iter__(self):
@@ -89,7 +97,7 @@ class ResultsLineMutationFile:
 
 class ResultsReaderMutationFile:
     def __init__(self, results_file: str):
-        self.results_file = open(results_file, 'r')
+        self.results_file = open_results(results_file)
         header_line = next(self.results_file)
 
     def __iter__(self):
@@ -0,0 +1,37 @@
+import random
+from typing import List, Tuple
+import pysam
+
+from src.GenomicUtils.AlignmentFlags import FLAG_OPTIONS
+
+CONTIG_LENGTH = 2_000_000
+
+
+def write_reference(path: str):
+    # FASTA of contigs "1" and "2", all A
+    with open(path, 'w') as fasta:
+        for contig in ["1", "2"]:
+            fasta.write(f">{contig}\n" + "".join("A" * 60 + "\n" for _ in range(CONTIG_LENGTH // 60)))
+    pysam.faidx(path)
+
+
+def write_indexed_bam(path: str, read_starts: List[Tuple[int, int]], seed: int = 0, reference: str = None):
+    # writes a sorted and indexed BAM of reads at the given (reference id, start), with contigs "1" and "2"
+    # cigars and flags are drawn at random, so reads have indels and some are filtered
+    # given reference (see write_reference), writes a CRAM against it
+    rng = random.Random(seed)
+    header = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "1", "LN": CONTIG_LENGTH}, {"SN": "2", "LN": CONTIG_LENGTH}]})
+    reads = []
+    for i, (reference_id, start) in enumerate(sorted(read_starts)):
+        read = pysam.AlignedSegment(header)
+        read.query_name = f"read_{i}"
+        read.reference_id = reference_id
+        read.reference_start = start
+        read.cigarstring = rng.choice(["100M", "40M5D60M", "30M2I68M", "10S90M", "50M"])
+        read.query_sequence = "A" * read.query_length
+        read.flag = rng.choice([0, 0, 0, 0, FLAG_OPTIONS.DUPLICATE_READ, FLAG_OPTIONS.SECONDARY_ALG])
+        reads.append(read)
+    with pysam.AlignmentFile(path, "wc" if reference else "wb", header=header, reference_filename=reference) as bam:
+        for read in reads:
+            bam.write(read)
+    pysam.index(path)